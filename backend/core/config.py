@@ -0,0 +1,139 @@
+"""
+This file contains the configuration snapshots. Every JSON file under configs/ is read into one
+immutable, versioned ConfigSnapshot. A watcher polls the files' modification times and, when one
+changed, builds a new snapshot and swaps it in with a single assignment, so a request sees either
+the old config or the new one, never a mix of both.
+
+Readers call current() on every request (a global lookup) instead of keeping values read at import
+time. Values derived from a snapshot (a parsed origin set, resolved classes, ...) are memoized on
+the snapshot with derive(), so they are rebuilt once per reload and not per request.
+"""
+import asyncio, json, logging, os, time
+from types import MappingProxyType
+
+CONFIG_DIR = "./configs"
+POLL_INTERVAL = 2  # seconds between checks of the config files
+
+
+def freeze(value):
+    """
+    Return a read-only copy of a parsed JSON value: dicts become mapping proxies, lists tuples.
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class ConfigSnapshot:
+    """
+    One consistent view of every config file, keyed by file name without .json.
+    """
+    def __init__(self, version: int, files: dict, stats: dict):
+        self.version = version
+        self.files = MappingProxyType(files)
+        self.stats = stats  # file name: (mtime_ns, size) the content was read at
+        self.loaded_at = time.time()
+        self._derived = {}
+
+    def get(self, name: str, default=None):
+        return self.files.get(name, default)
+
+    def __getitem__(self, name: str):
+        return self.files[name]
+
+    def derive(self, key: str, build):
+        """
+        Return build(self), computed on the first call for this snapshot and memoized after that.
+        """
+        try:
+            return self._derived[key]
+        except KeyError:
+            value = self._derived[key] = build(self)
+            return value
+
+
+def scan_config_files(directory: str = CONFIG_DIR) -> dict:
+    stats = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".json") and entry.is_file():
+                    stat = entry.stat()
+                    stats[entry.name[:-5]] = (stat.st_mtime_ns, stat.st_size)
+    except Exception as e:
+        logging.exception(f"Error scanning config directory {directory}: {e}")
+    return stats
+
+
+def build_snapshot(previous: ConfigSnapshot = None, directory: str = CONFIG_DIR, stats: dict = None) -> ConfigSnapshot:
+    """
+    Read the config files into a new snapshot. Unchanged files are reused from the previous snapshot,
+    and a file that fails to parse keeps its previous content, so a half-written edit never takes effect.
+    """
+    stats = scan_config_files(directory) if stats is None else stats
+    files, read_stats = {}, {}
+    for name, stat in stats.items():
+        if previous is not None and previous.stats.get(name) == stat:
+            files[name], read_stats[name] = previous.files[name], stat
+            continue
+        # The stat is remembered even if parsing fails, so a broken edit is not parsed again every poll
+        read_stats[name] = stat
+        try:
+            with open(os.path.join(directory, f"{name}.json")) as f:
+                files[name] = freeze(json.load(f))
+        except Exception as e:
+            logging.exception(f"Error loading config {name}.json, keeping the previous version: {e}")
+            if previous is not None and name in previous.files:
+                files[name] = previous.files[name]
+    return ConfigSnapshot((previous.version + 1) if previous is not None else 1, files, read_stats)
+
+
+_snapshot = build_snapshot()
+_reload_callbacks = []
+
+
+def current() -> ConfigSnapshot:
+    return _snapshot
+
+
+def on_reload(callback):
+    """
+    Call callback(snapshot) after every swap, for state that must be rebuilt when the config changes.
+    """
+    _reload_callbacks.append(callback)
+
+
+def reload(directory: str = CONFIG_DIR) -> bool:
+    """
+    Swap in a new snapshot if any config file was added, removed or modified. Returns True on a swap.
+    """
+    global _snapshot
+    stats = scan_config_files(directory)
+    if stats == _snapshot.stats:
+        return False
+    snapshot = build_snapshot(_snapshot, directory, stats)
+    if snapshot.files == _snapshot.files:
+        # Touched but identical, or an edit that failed to parse: keep the version, remember the stats
+        _snapshot.stats = snapshot.stats
+        return False
+    changed = sorted(name for name in snapshot.files.keys() | _snapshot.files.keys()
+                     if snapshot.files.get(name) != _snapshot.files.get(name))
+    _snapshot = snapshot
+    logging.info(f"Config snapshot {snapshot.version} loaded, changed: {', '.join(changed)}")
+    for callback in _reload_callbacks:
+        try:
+            callback(snapshot)
+        except Exception as e:
+            logging.exception(f"Error in config reload callback {callback}: {e}")
+    return True
+
+
+async def run_watcher(interval: float = POLL_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            reload()
+        except Exception as e:
+            logging.exception(f"Error reloading configs: {e}")
@@ -0,0 +1,171 @@
+"""
+This file contains the logging pipeline. Log calls on the event loop only put the record on a
+bounded queue; a QueueListener thread formats it (as JSON or text) and writes it to stdout, so a
+slow or backed-up log pipe never blocks request handling. When the queue is full the record is
+dropped and counted instead of waiting.
+
+Access lines are sampled per route before the record is even created: should_log_request(path)
+draws against the rate of the longest configured path prefix (logging.json, read from the current
+config snapshot), and only the requests that pass build a record at all. Blocked paths and rate
+limited requests, which scanners produce in floods, have their own rates. The security middleware
+writes these lines, so uvicorn's unsampled access log is turned off.
+"""
+import atexit, json, logging, queue, random, re, sys
+from logging.handlers import QueueHandler, QueueListener
+from backend.core import config
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+DEFAULT_QUEUE_SIZE = 10000
+
+# Attributes every LogRecord has; anything else on a record came in through extra=
+STANDARD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+stats = {"queued": 0, "dropped": 0, "sampled_out": 0}
+
+
+def load_logging_config(snapshot=None) -> dict:
+    return (snapshot or config.current()).get("logging") or {}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the fields passed through extra= next to the standard ones.
+    """
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves message formatting to the listener thread and drops records when
+    the queue is full.
+    """
+    def prepare(self, record):
+        # Only the traceback is rendered here, as the frames must not outlive the request
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            stats["queued"] += 1
+        except queue.Full:
+            stats["dropped"] += 1
+
+
+class LogListener(QueueListener):
+    """
+    QueueListener that can be stopped twice, and whose stop waits for room in a full queue
+    instead of failing, so everything queued is written before it returns.
+    """
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def build_sampler(snapshot):
+    """
+    Return (prefix pattern, rate per prefix, default rate) for the snapshot's route_sample_rates.
+    Longer prefixes come first in the alternation, so a match is always the longest prefix.
+    """
+    settings = load_logging_config(snapshot)
+    rates = dict(settings.get("route_sample_rates", {}))
+    pattern = None
+    if rates:
+        prefixes = sorted(rates, key=len, reverse=True)
+        pattern = re.compile("|".join(re.escape(prefix) for prefix in prefixes))
+    return pattern, rates, float(settings.get("access_sample_rate", 1.0))
+
+
+def sampled(rate: float) -> bool:
+    if rate >= 1.0 or (rate > 0.0 and random.random() < rate):
+        return True
+    stats["sampled_out"] += 1
+    return False
+
+
+def should_log_request(path: str) -> bool:
+    pattern, rates, rate = config.current().derive("log_sampler", build_sampler)
+    if pattern is not None:
+        match = pattern.match(path)
+        if match is not None:
+            rate = rates[match.group()]
+    return sampled(rate)
+
+
+def should_log_event(name: str) -> bool:
+    """
+    Sample a flood-prone event ("blocked", "rate_limited") at its <name>_sample_rate.
+    """
+    return sampled(float(load_logging_config().get(f"{name}_sample_rate", 1.0)))
+
+
+def setup_logging(logger_names=("uvicorn", "uvicorn.error"), stream=None):
+    """
+    Route the root logger and the given loggers through one queue to a single stdout writer
+    thread. Returns the started QueueListener; stop it on shutdown to flush what is queued.
+
+    uvicorn's access log is turned off: it would log every request unsampled, scanner floods
+    included, while the security middleware already writes one sampled line per request.
+    """
+    settings = load_logging_config()
+    level = getattr(logging, str(settings.get("level", "INFO")).upper(), logging.INFO)
+    if settings.get("format", "text") == "json":
+        formatter = JSONFormatter(datefmt=DATE_FORMAT)
+    else:
+        formatter = logging.Formatter(LOG_FORMAT, DATE_FORMAT)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(formatter)
+    log_queue = queue.Queue(int(settings.get("queue_size", DEFAULT_QUEUE_SIZE)))
+    queue_handler = NonBlockingQueueHandler(log_queue)
+
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(level)
+
+    # Uvicorn loggers write through the same queue instead of their own stdout handlers
+    for logger_name in logger_names:
+        logger = logging.getLogger(logger_name)
+        logger.handlers.clear()
+        logger.addHandler(queue_handler)
+        logger.propagate = False
+        logger.setLevel(level)
+
+    access_logger = logging.getLogger("uvicorn.access")
+    access_logger.handlers.clear()
+    access_logger.propagate = False
+    access_logger.disabled = True
+
+    listener = LogListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    # The lifespan stops it on shutdown; this covers exits without one
+    atexit.register(listener.stop)
+    return listener
+
+
+def logging_stats() -> dict:
+    return dict(stats)
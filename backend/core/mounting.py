@@ -0,0 +1,120 @@
+"""
+This file contains the lazy mounting of microservices and the startup import profiler.
+
+In lazy mode a microservice is mounted as a LazyService placeholder under its usual prefix. The
+service module is imported on the first request to that prefix (or by the background preload once
+the worker is ready), and its router is then served from a private APIRouter inside the mount.
+Exception handlers, middleware and the limiter still apply, since they wrap the whole app.
+"""
+import asyncio, importlib, logging, time
+from contextlib import AsyncExitStack
+from fastapi import APIRouter
+
+# module name: seconds spent importing it, in the order the modules were imported
+import_profile = {}
+
+
+def timed_import(module_name: str):
+    """
+    Import a module and record how long it took. A dependency shared by several modules is
+    charged to the first one that imports it.
+    """
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    import_profile.setdefault(module_name, time.perf_counter() - start)
+    return module
+
+
+def import_profile_report(limit: int = 10) -> str:
+    slowest = sorted(import_profile.items(), key=lambda item: item[1], reverse=True)[:limit]
+    total = sum(import_profile.values())
+    return f"{total:.2f}s importing {len(import_profile)} modules; slowest: " + \
+        ", ".join(f"{module} {seconds:.3f}s" for module, seconds in slowest)
+
+
+def import_profile_stats() -> dict:
+    return {module.replace(".", "_"): seconds for module, seconds in import_profile.items()}
+
+
+class LazyService:
+    """
+    ASGI app standing in for a microservice router until its module is imported.
+    """
+    def __init__(self, app, path: str, name: str, module_name: str, router_variable: str, exit_stack: AsyncExitStack):
+        self.app = app
+        self.path = path
+        self.name = name
+        self.module_name = module_name
+        self.router_variable = router_variable
+        self.exit_stack = exit_stack
+        self.router = None
+        self.lock = asyncio.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.router is not None
+
+    async def load(self):
+        async with self.lock:
+            if self.router is not None:
+                return self.router
+            # The import runs in a thread, so the event loop keeps serving the other routes meanwhile
+            module = await asyncio.to_thread(timed_import, self.module_name)
+            service_router: APIRouter = getattr(module, self.router_variable)
+            router = APIRouter()
+            router.include_router(service_router, tags=[f"microservice:{self.name}"])
+            # Eager mounting merges the router lifespan into the app's; here it is entered on load
+            # and exited with the app
+            await self.exit_stack.enter_async_context(service_router.lifespan_context(self.app))
+            self.router = router
+            logging.info(f"Microservice {self.name} loaded in {import_profile.get(self.module_name, 0):.3f}s")
+            return router
+
+    async def __call__(self, scope, receive, send):
+        router = self.router
+        if router is None:
+            try:
+                router = await self.load()
+            except Exception as e:
+                logging.error(f"Failed to load microservice {self.name}: {e}")
+                raise
+        # Route templates inside the mount are relative; the prefix keeps the latency labels apart
+        scope["mount_path"] = self.path
+        await router(scope, receive, send)
+
+
+class LazyServices:
+    """
+    The LazyService placeholders of an app, with the exit stack of their lifespans.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.services = {}
+        self.exit_stack = AsyncExitStack()
+
+    def mount(self, path: str, name: str, module_name: str, router_variable: str):
+        service = LazyService(self.app, path, name, module_name, router_variable, self.exit_stack)
+        self.app.mount(path, service, name=f"microservice:{name}")
+        self.services[name] = service
+        return service
+
+    async def preload(self):
+        """
+        Import every service not loaded yet, one at a time, after the worker started serving.
+        """
+        for service in self.services.values():
+            if service.loaded:
+                continue
+            try:
+                await service.load()
+            except Exception as e:
+                logging.error(f"Failed to preload microservice {service.name}: {e}")
+
+    async def close(self):
+        await self.exit_stack.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "services": len(self.services),
+            "loaded": sum(service.loaded for service in self.services.values()),
+        }
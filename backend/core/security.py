@@ -0,0 +1,172 @@
+"""
+This file contains the ASGI security middleware that blocks probing paths and suspended IPs,
+and the CORS middleware that reads the allowed origins from the current config snapshot
+"""
+import hmac, json, logging, os, re
+from time import perf_counter
+from fastapi import HTTPException, Request
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from backend.core import config, tracing
+from backend.core.tracing import tracing_settings
+from backend.core.logging_pipeline import should_log_event, should_log_request
+from backend.database.auth import decode_token
+
+SECURITY_FILE = "./configs/security.json"
+VALID_MICROSERVICE_TOKEN = os.getenv("VALID_MICROSERVICE_TOKEN")
+
+BLOCKED_RESPONSE = JSONResponse(content={"error": "You are not allowed to see this page"}, status_code=405)
+SUSPENDED_RESPONSE = JSONResponse(content={"message": "IP is suspended. Try again later."}, status_code=429)
+
+
+def load_path_blocklist(file_path: str = SECURITY_FILE):
+    """
+    Read the blocked path fragments, and per blocked fragment the fragments that exempt a path
+    from it, from the security config.
+    """
+    try:
+        with open(file_path) as f:
+            data = json.load(f)
+        return data.get("blocked_path_fragments", []), data.get("allowed_path_fragments", {})
+    except Exception as e:
+        logging.exception(f"Error loading path blocklist: {e}")
+        return [], {}
+
+
+def compile_fragments(fragments):
+    """
+    Compile a list of plain substrings into one alternation, so a path is scanned once.
+    Returns None for an empty list.
+    """
+    if not fragments:
+        return None
+    return re.compile("|".join(re.escape(fragment) for fragment in fragments))
+
+
+class SecurityMiddleware:
+    """
+    Pure ASGI middleware run in front of every HTTP request.
+
+    Requests whose path contains a blocked fragment get a 405, unless the path also contains one of
+    the fragments allowed for that blocked fragment (allowed_paths maps blocked to allowed ones),
+    requests from suspended IPs get a 429. Both are answered from the raw scope, before
+    a Request object is ever built. Anything else is passed on and timed; a request held
+    longer than max_connection_age has its database session closed. Every request is
+    observed in the per-route latency histogram, and sampled ones are traced (tracing.py).
+    """
+    def __init__(self, app, suspension_store, whitelisted_ips=(), blocked_paths=None,
+                 allowed_paths=None, max_connection_age=600):
+        self.app = app
+        self.suspension_store = suspension_store
+        self.whitelisted_ips = frozenset(whitelisted_ips)
+        self.max_connection_age = max_connection_age
+
+        if blocked_paths is None:
+            blocked_paths, allowed_paths = load_path_blocklist()
+        self.blocked_fragments = tuple(blocked_paths)
+        self.blocked_pattern = compile_fragments(blocked_paths)
+        self.allowed_fragments = {fragment: tuple(allowed) for fragment, allowed in (allowed_paths or {}).items()}
+
+    def is_blocked_path(self, path: str) -> bool:
+        if self.blocked_pattern is None or self.blocked_pattern.search(path) is None:
+            return False
+        # Rare path: a path is let through only if every blocked fragment in it is exempted
+        for fragment in self.blocked_fragments:
+            if fragment in path and not any(allowed in path for allowed in self.allowed_fragments.get(fragment, ())):
+                return True
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = perf_counter()
+        trace, token = tracing.start_trace()
+        status = None
+        server_timing = trace is not None and tracing_settings().get("server_timing", True)
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if server_timing:
+                    message["headers"] = [*message.get("headers", ()), (b"server-timing", trace.server_timing())]
+            await send(message)
+
+        log_request = False
+        try:
+            path = scope["path"]
+            # Same fallback as slowapi's get_remote_address
+            client = scope.get("client")
+            ip = client[0] if client else "127.0.0.1"
+            # Sampled before the record is created, so a line not logged costs one random draw
+            if self.is_blocked_path(path):
+                if should_log_event("blocked"):
+                    logging.info("blocked path - %s, method - %s", path, scope["method"],
+                                 extra={"path": path, "method": scope["method"], "ip": ip})
+                await BLOCKED_RESPONSE(scope, receive, send_with_timing)
+                return
+            # This is the access log line, uvicorn's own access log is off (see setup_logging)
+            log_request = should_log_request(path)
+
+            if ip not in self.whitelisted_ips and self.suspension_store.is_suspended(ip):
+                await SUSPENDED_RESPONSE(scope, receive, send_with_timing)
+                return
+
+            if trace is not None:
+                trace.add("middleware", perf_counter() - start_time)
+            await self.app(scope, receive, send_with_timing)
+            if perf_counter() - start_time > self.max_connection_age:
+                session = scope.get("state", {}).get("db")
+                if session is not None:
+                    await session.close()
+        finally:
+            elapsed = perf_counter() - start_time
+            if log_request:
+                logging.info("client path - %s, method - %s, status - %s, %.1f ms", path, scope["method"],
+                             status or 500, elapsed * 1000,
+                             extra={"path": path, "method": scope["method"], "ip": ip, "status": status or 500})
+            tracing.observe_request(scope, status or 500, elapsed, trace)
+            tracing.end_trace(token)
+
+
+def allowed_origins(snapshot) -> frozenset:
+    return frozenset(snapshot.get("origins", {}).get("origins", ()))
+
+
+class SnapshotCORSMiddleware(CORSMiddleware):
+    """
+    CORSMiddleware whose allowed origins come from origins.json in the current config snapshot,
+    so an edited origin list applies without a restart. The origin set is built once per
+    snapshot; a "*" entry allows every origin, echoed back like an explicit one.
+    """
+    def __init__(self, app, **options):
+        options.pop("allow_origins", None)
+        super().__init__(app, **options)
+
+    def is_allowed_origin(self, origin: str) -> bool:
+        origins = config.current().derive("cors_origins", allowed_origins)
+        if origin in origins or "*" in origins:
+            return True
+        return self.allow_origin_regex is not None and self.allow_origin_regex.fullmatch(origin) is not None
+
+
+################################################
+# Dependency returning the id of the user behind the bearer access token
+################################################
+async def current_user_id(request: Request) -> int:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    payload = decode_token(token) if scheme.lower() == "bearer" else None
+    if not payload or payload.get("type") != "access":
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return int(payload["sub"])
+
+
+################################################
+# Dependency for service-to-service calls, e.g. training jobs pushing embeddings
+################################################
+async def require_microservice_token(request: Request):
+    token = request.headers.get("x-microservice-token", "")
+    if not VALID_MICROSERVICE_TOKEN or not hmac.compare_digest(token, VALID_MICROSERVICE_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid microservice token")
@@ -0,0 +1,28 @@
+"""
+This file contains the in-process signal bus. Services emit a signal when a user's sleep, stress
+or nutrition data changes, and other services subscribe to react to it (for example by dropping
+cached results). Callbacks run synchronously in the emitting request and must be cheap.
+"""
+import logging
+from collections import defaultdict
+
+SLEEP = "sleep"
+STRESS = "stress"
+NUTRITION = "nutrition"
+
+_subscribers = defaultdict(list)
+
+
+def subscribe(signal: str, callback):
+    """
+    Call callback(user_id) every time signal is emitted.
+    """
+    _subscribers[signal].append(callback)
+
+
+def emit(signal: str, user_id: int):
+    for callback in _subscribers.get(signal, ()):
+        try:
+            callback(user_id)
+        except Exception as e:
+            logging.exception(f"Error in {signal} signal subscriber {callback}: {e}")
@@ -0,0 +1,137 @@
+"""
+This file contains the per-request tracing. The security middleware starts a Trace for a sampled
+share of requests (tracing.json sample_rate) and keeps it in a context variable, so code deep in a
+request (pool checkout, SQL events, bcrypt, JWT decode, template rendering) can add its time to it
+with span() or record() without the trace being passed around. When no trace is active those
+calls cost one context variable lookup.
+
+Stages finished before the response headers are sent go out in a Server-Timing header. Every
+request's total time is observed in a per-route histogram, and the stages of sampled requests in
+a per-route, per-stage histogram, both on /metrics.
+"""
+import random, time
+from contextvars import ContextVar
+from backend.core import config
+from backend.metrics import Histogram
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Request time by route template, method and status",
+    label_names=("route", "method", "status"),
+)
+STAGE_DURATION = Histogram(
+    "http_request_stage_seconds",
+    "Time per stage of sampled requests, by route template",
+    label_names=("route", "stage"),
+)
+
+_current_trace = ContextVar("trace", default=None)
+
+
+class Trace:
+    __slots__ = ("start", "stages")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}  # stage name: [seconds, count]
+
+    def add(self, name: str, seconds: float):
+        stage = self.stages.get(name)
+        if stage is None:
+            self.stages[name] = [seconds, 1]
+        else:
+            stage[0] += seconds
+            stage[1] += 1
+
+    def server_timing(self) -> bytes:
+        parts = []
+        for name, (seconds, count) in self.stages.items():
+            description = f';desc="{count} calls"' if count > 1 else ""
+            parts.append(f"{name};dur={seconds * 1000:.2f}{description}")
+        parts.append(f"app;dur={(time.perf_counter() - self.start) * 1000:.2f}")
+        return ", ".join(parts).encode()
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.add(self.name, time.perf_counter() - self.start)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def span(name: str):
+    """
+    Context manager adding the time spent inside it to stage name of the current trace, if any.
+    """
+    trace = _current_trace.get()
+    return NULL_SPAN if trace is None else _Span(trace, name)
+
+
+def record(name: str, seconds: float):
+    """
+    Add an already measured duration to stage name of the current trace, if any.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+def tracing_settings() -> dict:
+    return config.current().get("tracing") or {}
+
+
+def start_trace():
+    """
+    Start a trace for this request if it is sampled. Returns (trace or None, context token).
+    """
+    settings = tracing_settings()
+    rate = float(settings.get("sample_rate", 0.0)) if settings.get("enabled", True) else 0.0
+    if rate <= 0.0 or (rate < 1.0 and random.random() >= rate):
+        return None, None
+    trace = Trace()
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    if token is not None:
+        _current_trace.reset(token)
+
+
+def route_label(scope) -> str:
+    """
+    Route template of a matched request (or "unmatched"), so scanner paths do not create labels.
+    """
+    route = scope.get("route")
+    path = getattr(route, "path_format", None) or getattr(route, "path", None)
+    if path is None:
+        return "unmatched"
+    return scope.get("mount_path", "") + path
+
+
+def observe_request(scope, status: int, seconds: float, trace):
+    route = route_label(scope)
+    REQUEST_DURATION.observe(seconds, route, scope["method"], status)
+    if trace is not None:
+        for name, (stage_seconds, _) in trace.stages.items():
+            STAGE_DURATION.observe(stage_seconds, route, name)
@@ -2,7 +2,12 @@
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
-import os
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from fastapi import HTTPException
+import asyncio, hashlib, os, time
+import backend.global_variables as configs
+from backend.core import tracing
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -11,12 +16,86 @@ ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
 EMAIL_TOKEN_EXPIRE_MINUTES = int(os.getenv("EMAIL_TOKEN_EXPIRE_MINUTES", "1440"))
 
+DEFAULT_BCRYPT_ROUNDS = 12
+DEFAULT_BCRYPT_POOL_SIZE = 2
+DEFAULT_BCRYPT_MAX_QUEUE = 64
+DEFAULT_TOKEN_CACHE_SIZE = 10000
+
+_bcrypt_pool = None
+_bcrypt_pending = 0
+
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
+#############################################
+# bcrypt process pool
+#############################################
+def _init_bcrypt_worker(rounds: int):
+    """
+    Runs once in every pool process, so each worker hashes with the configured cost factor.
+    """
+    pwd_context.update(bcrypt__rounds=rounds)
+
+def _get_bcrypt_pool() -> ProcessPoolExecutor:
+    """
+    Return the bcrypt process pool, creating it on first use from misc.json
+    (bcrypt_pool_size, bcrypt_rounds).
+    """
+    global _bcrypt_pool
+    if _bcrypt_pool is None:
+        rounds = int(configs.MISC_CONFIG.get("bcrypt_rounds", DEFAULT_BCRYPT_ROUNDS))
+        pool_size = int(configs.MISC_CONFIG.get("bcrypt_pool_size", DEFAULT_BCRYPT_POOL_SIZE))
+        # Keep hashes produced in this process on the same cost factor as the pool
+        pwd_context.update(bcrypt__rounds=rounds)
+        _bcrypt_pool = ProcessPoolExecutor(
+            max_workers=pool_size,
+            initializer=_init_bcrypt_worker,
+            initargs=(rounds,),
+        )
+    return _bcrypt_pool
+
+async def _run_in_bcrypt_pool(func, *args):
+    """
+    Run func in the bcrypt pool without blocking the event loop.
+
+    At most bcrypt_max_queue calls may be pending per worker process; beyond that
+    the caller gets a 503 instead of piling up work that would only time out.
+    """
+    global _bcrypt_pending
+    max_queue = int(configs.MISC_CONFIG.get("bcrypt_max_queue", DEFAULT_BCRYPT_MAX_QUEUE))
+    if _bcrypt_pending >= max_queue:
+        raise HTTPException(status_code=503, detail="Server is busy. Try again later.")
+
+    _bcrypt_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        with tracing.span("bcrypt"):
+            return await loop.run_in_executor(_get_bcrypt_pool(), func, *args)
+    finally:
+        _bcrypt_pending -= 1
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_bcrypt_pool(hash_password, password)
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    return await _run_in_bcrypt_pool(verify_password, plain, hashed)
+
+def bcrypt_pool_stats() -> dict:
+    return {
+        "pending": _bcrypt_pending,
+        "max_queue": int(configs.MISC_CONFIG.get("bcrypt_max_queue", DEFAULT_BCRYPT_MAX_QUEUE)),
+        "started": _bcrypt_pool is not None,
+    }
+
+def shutdown_bcrypt_pool():
+    global _bcrypt_pool
+    if _bcrypt_pool is not None:
+        _bcrypt_pool.shutdown(wait=False, cancel_futures=True)
+        _bcrypt_pool = None
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -29,9 +108,76 @@ def create_email_token(data: dict, expires_delta: timedelta | None = None):
     to_encode.update({"exp": expire, "type": "email_verification"})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+#############################################
+# Verified token cache
+#############################################
+class TokenCache:
+    """
+    Bounded LRU of verified token claims, keyed by the SHA-256 digest of the token.
+
+    Each entry remembers the token's exp claim and is dropped once that moment
+    passes, so an expired token is never served from the cache.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # digest: (expires_at, payload)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, key: bytes):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, payload = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return dict(payload)
+
+    def put(self, key: bytes, payload: dict):
+        if self.max_size <= 0:
+            return
+        expires_at = payload.get("exp")
+        self.entries[key] = (float(expires_at) if expires_at is not None else None, dict(payload))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+_token_cache = None
+
+def get_token_cache() -> TokenCache:
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenCache(int(configs.MISC_CONFIG.get("token_cache_size", DEFAULT_TOKEN_CACHE_SIZE)))
+    return _token_cache
+
 def decode_token(token: str):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    cache = get_token_cache()
+    key = cache.digest(token)
+    payload = cache.get(key)
+    if payload is not None:
         return payload
+
+    try:
+        with tracing.span("jwt"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         return None
+    cache.put(key, payload)
+    return payload
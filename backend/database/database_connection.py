@@ -1,24 +1,33 @@
 """
 This file contains Async SQLAlchemy database connection manager with session management and environment-based configuration.
 """
-import os, logging
+import asyncio, os, logging
 from dotenv import load_dotenv
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, scoped_session
+from backend.database.instrumentation import InstrumentedAsyncQueuePool, instrument_engine
 import backend.global_variables as configs
 
 
 logging.basicConfig(level=logging.INFO)
 
+# Connections older than this are replaced on checkout, matches MAX_CONNECTION_AGE in backend/limiter.py
+DEFAULT_POOL_RECYCLE = 600
+
 
 class DatabaseConnection:
-    def __init__(self):
+    def __init__(self, db_url: str = None, pool_overrides: dict = None):
         """
         Initialize the DatabaseConnection object with a given configuration.
 
-        :param config: Configuration for the database connection.
-        :type config: str
+        :param db_url: SQLAlchemy URL used instead of default_connection from DB_connection.json,
+                       e.g. sqlite+aiosqlite:///path for local runs and benchmarks.
+        :type db_url: str
+        :param pool_overrides: Values replacing those from db_pool.json.
+        :type pool_overrides: dict
         """
+        self.db_url = db_url
+        self.pool_overrides = pool_overrides or {}
         self.engine = None
         self.session_factory = None
         
@@ -36,21 +45,30 @@ class DatabaseConnection:
         :type environment: str
         """
         logging.info(f"Initializing database connection")
-        configs.load_dbconfig()
-        dbConfig = configs.DBCONFIG["default_connection"]
-        if not dbConfig:
-            raise Exception(f"Invalid connection: {dbConfig}, cant connect to the database")
-
-        dbUrl = (
-            f"postgresql+asyncpg://{dbConfig['user']}:{dbConfig['password']}"
-            f"@{dbConfig['host']}:{dbConfig['port']}/{dbConfig['database']}"
-        )
+        if self.db_url:
+            dbUrl = self.db_url
+        else:
+            configs.load_dbconfig()
+            dbConfig = configs.DBCONFIG.get("default_connection")
+            if not dbConfig:
+                raise Exception(f"Invalid connection: {dbConfig}, cant connect to the database")
+
+            dbUrl = (
+                f"postgresql+asyncpg://{dbConfig['user']}:{dbConfig['password']}"
+                f"@{dbConfig['host']}:{dbConfig['port']}/{dbConfig['database']}"
+            )
 
+        poolConfig = {**configs.DB_POOL_CONFIG, **self.pool_overrides}
         self.engine = create_async_engine(
             dbUrl,
-            pool_size=10,
-            max_overflow=5,
+            pool_size=int(poolConfig.get("pool_size", 10)),
+            max_overflow=int(poolConfig.get("max_overflow", 5)),
+            pool_timeout=float(poolConfig.get("pool_timeout", 30)),
+            pool_recycle=int(poolConfig.get("pool_recycle", DEFAULT_POOL_RECYCLE)),
+            pool_pre_ping=bool(poolConfig.get("pool_pre_ping", True)),
+            poolclass=InstrumentedAsyncQueuePool,
         )
+        instrument_engine(self.engine, slow_query_ms=float(poolConfig.get("slow_query_ms", 500)))
         
         self.session_factory = sessionmaker(
             self.engine,
@@ -58,6 +76,36 @@ class DatabaseConnection:
             expire_on_commit=False,
         )
 
+    async def warmup(self, connections: int):
+        """
+        Open the given number of pool connections at once and return them to the pool,
+        so the first requests after startup do not pay for connection setup.
+
+        :param connections: How many connections to open, capped at the pool size.
+        :type connections: int
+        """
+        connections = min(connections, self.engine.pool.size())
+        opened = await asyncio.gather(*(self.engine.connect().start() for _ in range(connections)))
+        for connection in opened:
+            await connection.close()
+        logging.info(f"Database pool warmed with {len(opened)} connections")
+
+    async def ping(self):
+        """
+        Check out a pooled connection and report whether it is usable.
+
+        With pool_pre_ping (db_pool.json) the checkout itself sends a ping to the server and
+        replaces a dead connection, so a successful checkout means the database answered. The
+        check after it only looks at the pool's own state, so it works with every driver.
+        """
+        async with self.engine.connect() as connection:
+            raw_connection = await connection.get_raw_connection()
+            is_alive = raw_connection.is_valid and not connection.invalidated
+        return {
+            "alive": is_alive,
+            "pool": self.engine.pool.status(),
+        }
+
     def get_session(self):
         """
         Retrieve a scoped session using the current session factory.
@@ -95,6 +143,6 @@ class DatabaseConnection:
 load_dotenv()
 configName = os.getenv('SERVER_CONFIG')
 
-database_connection = DatabaseConnection(configName)
+database_connection = DatabaseConnection()
 # Use 'session' for database operations
 # Remember to close the session when done: session.close()
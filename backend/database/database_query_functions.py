@@ -5,6 +5,9 @@ import logging
 import sys
 from fastapi.responses import JSONResponse
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects import postgresql, sqlite
+
+DEFAULT_CHUNK_SIZE = 1000
 
 #############################################
 # Function to execute a query and return the first column value
@@ -16,16 +19,7 @@ async def execute_query(session, *args, skip_commit=False, migration=False):
             if not skip_commit:
                 await async_session.commit()
 
-            # Check if the result has rows to fetch
-            if result.returns_rows:
-                record = result.fetchone()
-                if record:
-                    # Return the first column value if a record was found
-                    return record[0]
-                else:
-                    return None
-            else:
-                return "no_data_in_result"
+            return first_column_value(result)
 
     except SQLAlchemyError as e:
         if not migration:
@@ -40,6 +34,106 @@ async def execute_query(session, *args, skip_commit=False, migration=False):
         error_line = exc_traceback.tb_lineno
         return f"Error executing query: An exception of type {type(e).__name__} occurred on line {error_line}: {str(e)}"
 
+#############################################
+# Function to return the first column value of a result
+#############################################
+def first_column_value(result):
+    # Check if the result has rows to fetch
+    if result.returns_rows:
+        record = result.fetchone()
+        if record:
+            # Return the first column value if a record was found
+            return record[0]
+        else:
+            return None
+    else:
+        return "no_data_in_result"
+
+#############################################
+# Function to stream the rows of a query in chunks
+#############################################
+async def stream_query(session, statement, params=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Async generator yielding lists of at most chunk_size rows.
+
+    Rows are fetched through a server-side cursor, so only one chunk is held in memory
+    no matter how large the result is. Errors are logged and re-raised, since a partially
+    consumed stream cannot be turned into an error value.
+    """
+    try:
+        async with session as async_session:
+            result = await async_session.stream(statement, params, execution_options={"yield_per": chunk_size})
+            async for rows in result.partitions(chunk_size):
+                yield rows
+    except SQLAlchemyError as e:
+        logging.error(f"Error streaming query: \n Query: {statement} \n Error: {e}")
+        raise
+
+#############################################
+# Function to execute one statement for many parameter sets
+#############################################
+async def execute_many(session, statement, params_list, skip_commit=False):
+    """
+    Run statement once per dict in params_list in a single driver executemany() call.
+    On asyncpg that call prepares the statement once and pipelines every parameter set
+    over the connection, so thousands of rows do not wait for one round trip each.
+    SQLAlchemy only rewrites an insert() into multi-row VALUES batches when it has
+    RETURNING, which this function does not use.
+    Returns the affected row count.
+    """
+    if not params_list:
+        return 0
+    try:
+        async with session as async_session:
+            result = await async_session.execute(statement, params_list)
+            if not skip_commit:
+                await async_session.commit()
+            return result.rowcount
+    except SQLAlchemyError as e:
+        logging.error(f"Error executing bulk query: \n Query: {statement} \n Error: {e}")
+        return f"Error executing bulk query {statement}: {e}"
+
+#############################################
+# Function to execute several statements in one transaction
+#############################################
+async def execute_in_transaction(session, *statements):
+    """
+    Execute statements in a single transaction and return the first column value of each.
+    Each item is either a statement or a (statement, params) tuple. If any statement
+    fails the whole transaction is rolled back.
+    """
+    try:
+        async with session as async_session:
+            async with async_session.begin():
+                results = []
+                for item in statements:
+                    statement, params = item if isinstance(item, tuple) else (item, None)
+                    result = await async_session.execute(statement, params)
+                    results.append(first_column_value(result))
+                return results
+    except SQLAlchemyError as e:
+        logging.error(f"Error executing transaction: \n Error: {e}")
+        return f"Error executing transaction: {e}"
+
+#############################################
+# Functions to build INSERT ... ON CONFLICT for the session's dialect
+#############################################
+def dialect_insert(session, table):
+    """
+    Return the Postgres or SQLite insert() for table, depending on the engine behind
+    the session or connection. Both support on_conflict_do_nothing / on_conflict_do_update.
+    """
+    dialect = getattr(session, "dialect", None) or session.bind.dialect
+    insert_func = sqlite.insert if dialect.name == "sqlite" else postgresql.insert
+    return insert_func(table)
+
+def insert_ignoring_conflicts(session, table, index_elements):
+    """
+    Return an insert() on table that skips rows conflicting on index_elements.
+    Combined with .returning(), a conflict shows up as an empty result instead of an error.
+    """
+    return dialect_insert(session, table).on_conflict_do_nothing(index_elements=index_elements)
+
 #############################################
 # Function to return error in JSON structure with actual message and status code
 #############################################
@@ -1,10 +1,43 @@
+import asyncio
 import logging
+import backend.global_variables as configs
 
 # Log config
 logging.basicConfig(level=logging.INFO)
 
 clients_pool = {}  # client_id: DatabaseConnection
 
+# Single-flight guard, concurrent first requests wait for one engine instead of each building their own
+_init_lock = asyncio.Lock()
+
+
+async def get_database_connection():
+    """
+    Return the initialized DatabaseConnection, creating it on first use.
+
+    Only one coroutine initializes the connection, the others wait on the lock
+    and reuse the result.
+
+    :return: The DatabaseConnection stored in the clients_pool.
+    :raises Exception: If there was an error creating or initializing the
+        DatabaseConnection.
+    """
+    db_conn = clients_pool.get("database_connection")
+    if db_conn is not None:
+        return db_conn
+
+    async with _init_lock:
+        if "database_connection" in clients_pool:
+            return clients_pool["database_connection"]
+
+        from backend.database.database_connection import DatabaseConnection
+
+        db_conn = DatabaseConnection()
+        await db_conn.init_db()
+        clients_pool["database_connection"] = db_conn
+        return db_conn
+
+
 async def get_session_for_database():
     """
     Return a session factory for the given client_name.
@@ -19,15 +52,35 @@ async def get_session_for_database():
         DatabaseConnection.
     """
     try:
-        from backend.db_connection.database_connection import DatabaseConnection
-
-        if "database_connection" in clients_pool:
-            return clients_pool["database_connection"].get_session_factory()
-
-        db_conn = DatabaseConnection()
-        await db_conn.init_db()
-        clients_pool["database_connection"] = db_conn
+        db_conn = await get_database_connection()
         return db_conn.get_session_factory()
     except Exception as e:
         logging.exception(f"Error in get_session_for_client: {e}")
-        raise e
\ No newline at end of file
+        raise e
+
+
+async def warm_up_database():
+    """
+    Initialize the database connection and open warmup_connections (db_pool.json) connections.
+    Called from the app lifespan before the worker starts serving.
+    """
+    try:
+        db_conn = await get_database_connection()
+        await db_conn.warmup(int(configs.DB_POOL_CONFIG.get("warmup_connections", 0)))
+    except Exception as e:
+        logging.exception(f"Error warming up the database pool: {e}")
+
+
+async def check_database_health():
+    try:
+        db_conn = await get_database_connection()
+        return await db_conn.ping()
+    except Exception as e:
+        logging.error(f"Database health check failed: {e}")
+        return {"alive": False, "error": str(e)}
+
+
+async def close_database():
+    db_conn = clients_pool.pop("database_connection", None)
+    if db_conn is not None and db_conn.engine is not None:
+        await db_conn.engine.dispose()
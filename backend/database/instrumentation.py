@@ -0,0 +1,103 @@
+"""
+This file contains SQLAlchemy pool and statement instrumentation exported on /metrics.
+
+Pool checkout wait is timed inside the pool class itself, statement time through the
+before/after_cursor_execute engine events. Statements are labelled by a fingerprint with
+literals and bind parameters replaced by "?", memoized per statement text. Both times are also
+added to the request trace, as db_checkout and sql.
+"""
+import logging, re, time
+from functools import lru_cache
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from backend.core import tracing
+from backend.metrics import Gauge, Histogram
+
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the pool",
+)
+QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Statement execution time by statement fingerprint",
+    label_names=("statement",),
+)
+
+_instrumented_engines = []
+
+
+def _pool_value(read):
+    def read_value():
+        return sum(read(engine.pool) for engine in _instrumented_engines) if _instrumented_engines else None
+    return read_value
+
+
+Gauge("db_pool_checked_out", "Connections currently checked out of the pool", _pool_value(lambda pool: pool.checkedout()))
+Gauge("db_pool_overflow", "Connections open beyond pool_size", _pool_value(lambda pool: max(pool.overflow(), 0)))
+Gauge("db_pool_size", "Configured pool size", _pool_value(lambda pool: pool.size()))
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\$\d+|%\([^)]+\)s|:\w+|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+MAX_FINGERPRINT_LENGTH = 160
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """
+    Normalize a statement so the same query with different values gets one label.
+    """
+    normalized = _LITERALS.sub("?", statement)
+    # IN (...) and VALUES (...) lists of any length get one label
+    normalized = _PLACEHOLDER_LISTS.sub("(?)", normalized)
+    normalized = _WHITESPACE.sub(" ", normalized).strip()
+    return normalized[:MAX_FINGERPRINT_LENGTH]
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """
+    AsyncAdaptedQueuePool that records how long each checkout waited, including the
+    time to open a new connection when the pool had to grow.
+    """
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            elapsed = time.perf_counter() - start
+            POOL_CHECKOUT_WAIT.observe(elapsed)
+            tracing.record("db_checkout", elapsed)
+
+
+def instrument_engine(engine, slow_query_ms: float = 500):
+    """
+    Attach statement timing to an AsyncEngine and register its pool for the pool gauges.
+
+    :param engine: The AsyncEngine returned by create_async_engine.
+    :param slow_query_ms: Statements slower than this are logged.
+    """
+    sync_engine = engine.sync_engine
+    slow_query_seconds = slow_query_ms / 1000
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_times = conn.info.get("query_start_times")
+        if not start_times:
+            return
+        elapsed = time.perf_counter() - start_times.pop()
+        QUERY_DURATION.observe(elapsed, fingerprint(statement))
+        tracing.record("sql", elapsed)
+        if elapsed > slow_query_seconds:
+            logging.warning(f"Slow query ({elapsed * 1000:.1f} ms): {statement}")
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_start_times"):
+            connection.info["query_start_times"].pop()
+
+    _instrumented_engines.append(engine)
@@ -1,14 +1,178 @@
 # models.py
-from sqlalchemy import Table, Column, BigInteger, Text, Boolean, TIMESTAMP, func
-from database import metadata
+from sqlalchemy import Table, Column, Index, BigInteger, Integer, SmallInteger, Float, LargeBinary, Text, Boolean, TIMESTAMP, func, false
+from backend.database import metadata
+
+# SQLite only auto-increments INTEGER PRIMARY KEY columns
+BigIntegerId = BigInteger().with_variant(Integer, "sqlite")
 
 users = Table(
     "users",
     metadata,
-    Column("id", BigInteger, primary_key=True),
+    Column("id", BigIntegerId, primary_key=True),
     Column("email", Text, nullable=False, unique=True),
     Column("hashed_password", Text, nullable=False),
     Column("full_name", Text),
-    Column("is_active", Boolean, nullable=False, server_default="false"),
+    Column("is_active", Boolean, nullable=False, server_default=false()),
+    Column("created_at", TIMESTAMP(timezone=True), server_default=func.now()),
+)
+
+# Compressed per-minute sample chunks, one row per (user, metric, minute), see backend/database/timeseries.py.
+# On Postgres the table is range-partitioned by month on minute_start.
+device_metric_chunks = Table(
+    "device_metric_chunks",
+    metadata,
+    Column("user_id", BigInteger, primary_key=True),
+    Column("metric", SmallInteger, primary_key=True),
+    Column("minute_start", BigInteger, primary_key=True),
+    Column("sample_count", Integer, nullable=False),
+    Column("payload", LargeBinary, nullable=False),
+    postgresql_partition_by="RANGE (minute_start)",
+)
+
+# count/sum/min/max per 60, 3600 and 86400 second bucket, merged at write time
+device_metric_rollups = Table(
+    "device_metric_rollups",
+    metadata,
+    Column("user_id", BigInteger, primary_key=True),
+    Column("metric", SmallInteger, primary_key=True),
+    Column("resolution", Integer, primary_key=True),
+    Column("bucket_start", BigInteger, primary_key=True),
+    Column("sample_count", BigInteger, nullable=False),
+    Column("value_sum", Float(precision=53), nullable=False),
+    Column("value_min", Float(precision=24), nullable=False),
+    Column("value_max", Float(precision=24), nullable=False),
+)
+
+# Sequence number up to which every batch of a device is durably stored, clients resume after it
+device_ingest_cursors = Table(
+    "device_ingest_cursors",
+    metadata,
+    Column("user_id", BigInteger, primary_key=True),
+    Column("device_id", Text, primary_key=True),
+    Column("committed_seq", BigInteger, nullable=False),
+    Column("updated_at", TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now()),
+)
+
+# Batches stored above a device's committed_seq, kept until the sequence before them is complete.
+# The primary key makes a batch flushed by two API workers (a retry that hit another worker) a no-op
+device_ingest_batches = Table(
+    "device_ingest_batches",
+    metadata,
+    Column("user_id", BigInteger, primary_key=True),
+    Column("device_id", Text, primary_key=True),
+    Column("seq", BigInteger, primary_key=True),
+    Column("created_at", TIMESTAMP(timezone=True), server_default=func.now()),
+)
+
+# Serialized streaming HRV state per user, see backend/services/stress/hrv.py
+hrv_states = Table(
+    "hrv_states",
+    metadata,
+    Column("user_id", BigInteger, primary_key=True),
+    Column("state", LargeBinary, nullable=False),
+    # Incremented by every save, which only applies on the version it was based on
+    Column("version", BigInteger, nullable=False, server_default="0"),
+    Column("updated_at", TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now()),
+)
+
+# Epoch sums of every user's night in progress, see backend/services/sleep/main.py. Uploads add to
+# the rows with an upsert, so the night is whole whichever worker served each upload; a user's rows
+# of an earlier night are deleted when the next night starts.
+sleep_epochs = Table(
+    "sleep_epochs",
+    metadata,
+    Column("user_id", BigInteger, primary_key=True),
+    Column("start_ms", BigInteger, primary_key=True),
+    Column("epoch", Integer, primary_key=True),
+    Column("activity_sum", Float(precision=53), nullable=False),
+    Column("activity_count", Float(precision=53), nullable=False),
+    Column("hr_sum", Float(precision=53), nullable=False),
+    Column("hr_sum_sq", Float(precision=53), nullable=False),
+    Column("hr_count", Float(precision=53), nullable=False),
+    # Epoch milliseconds of the last upload to the epoch
+    Column("updated_ms", BigInteger, nullable=False),
+)
+
+# One row per partner lab CSV upload; rows_committed / bytes_committed are the resume point
+lab_imports = Table(
+    "lab_imports",
+    metadata,
+    Column("id", BigIntegerId, primary_key=True),
+    Column("import_key", Text, nullable=False, unique=True),
+    Column("status", Text, nullable=False),
+    Column("columns", Text),
+    Column("rows_committed", BigInteger, nullable=False, server_default="0"),
+    Column("bytes_committed", BigInteger, nullable=False, server_default="0"),
+    Column("rows_rejected", BigInteger, nullable=False, server_default="0"),
+    Column("total_bytes", BigInteger),
+    Column("last_error", Text),
+    Column("created_at", TIMESTAMP(timezone=True), server_default=func.now()),
+    Column("updated_at", TIMESTAMP(timezone=True), server_default=func.now()),
+)
+
+# Normalized lab results; (import_id, row_number) makes a replayed batch a no-op
+lab_results = Table(
+    "lab_results",
+    metadata,
+    Column("import_id", BigInteger, primary_key=True),
+    Column("row_number", BigInteger, primary_key=True),
+    Column("patient_ref", Text, nullable=False),
+    Column("analyte", Text, nullable=False),
+    Column("value", Float(precision=53), nullable=False),
+    Column("unit", Text, nullable=False),
+    Column("reference_low", Float(precision=53)),
+    Column("reference_high", Float(precision=53)),
+    Column("flag", Text),
+    Column("collected_at", TIMESTAMP(timezone=True)),
+    Index("lab_results_patient", "patient_ref", "analyte", "collected_at"),
+)
+
+# Durable job queue, see backend/jobs. run_at / locked_at are epoch milliseconds; finished jobs are deleted,
+# jobs out of attempts stay with status "failed"
+jobs = Table(
+    "jobs",
+    metadata,
+    Column("id", BigIntegerId, primary_key=True),
+    Column("job_type", Text, nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("status", Text, nullable=False, server_default="queued"),
+    Column("attempts", Integer, nullable=False, server_default="0"),
+    Column("max_attempts", Integer, nullable=False),
+    Column("run_at", BigInteger, nullable=False),
+    Column("locked_by", Text),
+    Column("locked_at", BigInteger),
+    Column("last_error", Text),
     Column("created_at", TIMESTAMP(timezone=True), server_default=func.now()),
+    Index("jobs_claim", "job_type", "status", "run_at"),
+    Index("jobs_locked_by", "locked_by"),
+)
+
+# Recommender embedding updates received after the training job's export, replayed by every worker
+# on top of it, see backend/services/recommender/main.py. kind 0 is a user, 1 an item; a NULL
+# vector is a removed item.
+recommender_vectors = Table(
+    "recommender_vectors",
+    metadata,
+    Column("kind", SmallInteger, primary_key=True),
+    Column("entity_id", BigInteger, primary_key=True),
+    Column("vector", LargeBinary),
+    Column("revision", BigInteger, nullable=False),
+    Index("recommender_vectors_revision", "revision"),
+)
+
+# Users whose cached recommendations every worker drops, written from the in-process signals
+recommender_invalidations = Table(
+    "recommender_invalidations",
+    metadata,
+    Column("user_id", BigInteger, primary_key=True),
+    Column("revision", BigInteger, nullable=False),
+    Index("recommender_invalidations_revision", "revision"),
+)
+
+# One row handing out recommender revisions; its row lock makes writers commit in revision order
+recommender_revision = Table(
+    "recommender_revision",
+    metadata,
+    Column("id", SmallInteger, primary_key=True),
+    Column("revision", BigInteger, nullable=False),
 )
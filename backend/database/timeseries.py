@@ -0,0 +1,295 @@
+"""
+This file contains the compact time-series storage for device metrics.
+
+Samples are stored as compressed per-minute chunks: one row per (user, metric, minute) holding the
+millisecond offsets within the minute as uint16 and the values as float32, zlib-compressed. A write
+into a minute that already has a chunk decodes it and appends, so the row count stays one per
+minute however often the buffer flushes. On Postgres the chunk table is range-partitioned by
+month, partitions are created on first write.
+Every write also merges count/sum/min/max into 1-minute, 1-hour and 1-day rollup rows, so range
+queries are answered from the coarsest resolution that still gives the requested detail and never
+have to decompress raw chunks for long ranges.
+"""
+import logging, zlib
+from datetime import datetime, timezone
+import numpy as np
+from sqlalchemy import bindparam, case, select, tuple_, update
+from backend.database.database_query_functions import dialect_insert, insert_ignoring_conflicts
+from backend.database.models import device_metric_chunks, device_metric_rollups
+
+MINUTE_MS = 60_000
+DAY_MS = 86_400_000
+# Rollup resolutions in seconds, finest first
+ROLLUP_RESOLUTIONS = (60, 3600, 86400)
+DEFAULT_MAX_POINTS = 1000
+
+
+def encode_chunk(offsets: np.ndarray, values: np.ndarray) -> bytes:
+    return zlib.compress(offsets.astype("<u2").tobytes() + values.astype("<f4").tobytes(), 1)
+
+
+def decode_chunk(payload: bytes, count: int):
+    raw = zlib.decompress(payload)
+    offsets = np.frombuffer(raw, dtype="<u2", count=count)
+    values = np.frombuffer(raw, dtype="<f4", count=count, offset=count * 2)
+    return offsets, values
+
+
+def month_bounds(minute_start_ms: int):
+    start = datetime.fromtimestamp(minute_start_ms / 1000, tz=timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+
+def group_boundaries(*keys):
+    """
+    Start indices of runs of equal key tuples in sorted arrays, plus the final length.
+    """
+    change = np.zeros(len(keys[0]), dtype=bool)
+    change[0] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.append(np.flatnonzero(change), len(keys[0]))
+
+
+def rollup_rows(user_id, metric, ts_ms, value):
+    """
+    Rollup rows (count/sum/min/max per bucket, every resolution) of samples sorted by user, metric and time.
+    """
+    rows = []
+    value64 = value.astype(np.float64)
+    for resolution in ROLLUP_RESOLUTIONS:
+        bucket_start = ts_ms // (resolution * 1000) * (resolution * 1000)
+        bounds = group_boundaries(user_id, metric, bucket_start)
+        starts = bounds[:-1]
+        counts = np.diff(bounds)
+        sums = np.add.reduceat(value64, starts)
+        minimums = np.minimum.reduceat(value, starts)
+        maximums = np.maximum.reduceat(value, starts)
+        rows.extend(
+            {"user_id": u, "metric": m, "resolution": resolution, "bucket_start": b,
+             "sample_count": c, "value_sum": s, "value_min": lo, "value_max": hi}
+            for u, m, b, c, s, lo, hi in zip(
+                user_id[starts].tolist(), metric[starts].tolist(), bucket_start[starts].tolist(),
+                counts.tolist(), sums.tolist(), minimums.tolist(), maximums.tolist(),
+            )
+        )
+    return rows
+
+
+class TimeSeriesStore:
+    """
+    Reads and writes device metric time series on the engine created by DatabaseConnection.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.known_partitions = set()
+
+    async def ensure_partitions(self, connection, minute_starts):
+        if connection.dialect.name != "postgresql":
+            return
+        days = np.unique(minute_starts // DAY_MS)
+        months = {month_bounds(int(day) * DAY_MS) for day in days}
+        for start, end in sorted(months):
+            name = f"{device_metric_chunks.name}_{start:%Y_%m}"
+            if name in self.known_partitions:
+                continue
+            await connection.exec_driver_sql(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {device_metric_chunks.name} "
+                f"FOR VALUES FROM ({int(start.timestamp() * 1000)}) TO ({int(end.timestamp() * 1000)})"
+            )
+            self.known_partitions.add(name)
+
+    async def merge_chunks(self, connection, chunks: dict):
+        """
+        Store chunks given as {(user_id, metric, minute_start): (offsets, values)}, appending to the
+        chunk a minute already has from an earlier flush or another worker.
+
+        New minutes are inserted with ON CONFLICT DO NOTHING. The minutes that conflicted are then
+        read under a row lock, decoded, merged with the new samples and written back, so two
+        transactions writing the same minute wait for each other instead of overwriting each other.
+        """
+        table = device_metric_chunks
+        key_columns = [table.c.user_id, table.c.metric, table.c.minute_start]
+        stmt = insert_ignoring_conflicts(connection, table, key_columns).returning(*key_columns)
+        inserted = await connection.execute(stmt, [
+            {"user_id": user_id, "metric": metric, "minute_start": minute_start,
+             "sample_count": len(offsets), "payload": encode_chunk(offsets, values)}
+            for (user_id, metric, minute_start), (offsets, values) in chunks.items()
+        ])
+        existing = set(chunks) - {tuple(row) for row in inserted.all()}
+        if not existing:
+            return
+
+        stored = await connection.execute(
+            select(*key_columns, table.c.sample_count, table.c.payload)
+            .where(tuple_(*key_columns).in_(sorted(existing)))
+            .with_for_update()
+        )
+        merged = []
+        for user_id, metric, minute_start, count, payload in stored.all():
+            stored_offsets, stored_values = decode_chunk(payload, count)
+            new_offsets, new_values = chunks[(user_id, metric, minute_start)]
+            offsets = np.concatenate((stored_offsets.astype(np.int64), new_offsets))
+            values = np.concatenate((stored_values, new_values))
+            order = np.argsort(offsets, kind="stable")
+            merged.append({"chunk_user_id": user_id, "chunk_metric": metric, "chunk_minute_start": minute_start,
+                           "merged_count": len(offsets), "merged_payload": encode_chunk(offsets[order], values[order])})
+        await connection.execute(
+            update(table)
+            .where(table.c.user_id == bindparam("chunk_user_id"), table.c.metric == bindparam("chunk_metric"),
+                   table.c.minute_start == bindparam("chunk_minute_start"))
+            .values(sample_count=bindparam("merged_count"), payload=bindparam("merged_payload")),
+            merged,
+        )
+
+    async def write(self, connection, user_id, metric, ts_ms, value):
+        """
+        Store samples given as parallel arrays and update all rollups, on an open connection
+        so the caller controls the transaction.
+        """
+        if len(ts_ms) == 0:
+            return
+        user_id = np.asarray(user_id, dtype=np.int64)
+        metric = np.asarray(metric, dtype=np.int64)
+        ts_ms = np.asarray(ts_ms, dtype=np.int64)
+        value = np.asarray(value, dtype=np.float32)
+
+        order = np.lexsort((ts_ms, metric, user_id))
+        user_id, metric, ts_ms, value = user_id[order], metric[order], ts_ms[order], value[order]
+        minute_start = ts_ms // MINUTE_MS * MINUTE_MS
+
+        await self.ensure_partitions(connection, minute_start)
+
+        bounds = group_boundaries(user_id, metric, minute_start)
+        await self.merge_chunks(connection, {
+            (int(user_id[start]), int(metric[start]), int(minute_start[start])):
+                (ts_ms[start:end] - minute_start[start], value[start:end])
+            for start, end in zip(bounds[:-1], bounds[1:])
+        })
+
+        table = device_metric_rollups
+        stmt = dialect_insert(connection, table)
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.metric, table.c.resolution, table.c.bucket_start],
+            set_={
+                "sample_count": table.c.sample_count + excluded.sample_count,
+                "value_sum": table.c.value_sum + excluded.value_sum,
+                "value_min": case((excluded.value_min < table.c.value_min, excluded.value_min), else_=table.c.value_min),
+                "value_max": case((excluded.value_max > table.c.value_max, excluded.value_max), else_=table.c.value_max),
+            },
+        )
+        await connection.execute(stmt, rollup_rows(user_id, metric, ts_ms, value))
+
+    async def read_raw(self, user_id: int, metric: int, start_ms: int, end_ms: int, connection=None):
+        """
+        Return (ts_ms, values) arrays of the raw samples in [start_ms, end_ms), sorted by time.
+        Reads on connection if given, so the caller's transaction sees its own writes.
+        """
+        query = select(
+            device_metric_chunks.c.minute_start, device_metric_chunks.c.sample_count, device_metric_chunks.c.payload,
+        ).where(
+            device_metric_chunks.c.user_id == user_id,
+            device_metric_chunks.c.metric == metric,
+            device_metric_chunks.c.minute_start >= start_ms // MINUTE_MS * MINUTE_MS,
+            device_metric_chunks.c.minute_start < end_ms,
+        )
+        ts_parts, value_parts = [], []
+        if connection is None:
+            async with self.engine.connect() as connection:
+                chunks = (await connection.execute(query)).all()
+        else:
+            chunks = (await connection.execute(query)).all()
+        for minute_start, count, payload in chunks:
+            offsets, values = decode_chunk(payload, count)
+            ts_parts.append(minute_start + offsets.astype(np.int64))
+            value_parts.append(values)
+
+        if not ts_parts:
+            return np.empty(0, np.int64), np.empty(0, np.float32)
+        ts_ms, values = np.concatenate(ts_parts), np.concatenate(value_parts)
+        keep = (ts_ms >= start_ms) & (ts_ms < end_ms)
+        ts_ms, values = ts_ms[keep], values[keep]
+        order = np.argsort(ts_ms, kind="stable")
+        return ts_ms[order], values[order]
+
+    async def rebuild_rollups(self, connection, user_id: int, metric: int, start_ms: int, end_ms: int) -> int:
+        """
+        Recompute the rollups of one user and metric from the raw chunks, for the whole UTC days
+        covering [start_ms, end_ms). Used after chunks were corrected or deleted, since write() only
+        ever merges into existing rollups. Returns the number of samples rolled up.
+        """
+        start_ms = start_ms // DAY_MS * DAY_MS
+        end_ms = -(-end_ms // DAY_MS) * DAY_MS
+        table = device_metric_rollups
+        await connection.execute(table.delete().where(
+            table.c.user_id == user_id,
+            table.c.metric == metric,
+            table.c.bucket_start >= start_ms,
+            table.c.bucket_start < end_ms,
+        ))
+        ts_ms, values = await self.read_raw(user_id, metric, start_ms, end_ms, connection)
+        if len(ts_ms):
+            users, metrics = np.full(len(ts_ms), user_id, np.int64), np.full(len(ts_ms), metric, np.int64)
+            await connection.execute(table.insert(), rollup_rows(users, metrics, ts_ms, values))
+        return len(ts_ms)
+
+    @staticmethod
+    def pick_resolution(start_ms: int, end_ms: int, step_seconds=None, max_points=DEFAULT_MAX_POINTS):
+        """
+        Coarsest rollup resolution that is not coarser than the requested step, or None
+        when only raw samples are fine enough.
+        """
+        if step_seconds is None:
+            step_seconds = (end_ms - start_ms) / 1000 / max_points
+        usable = [resolution for resolution in ROLLUP_RESOLUTIONS if resolution <= step_seconds]
+        return usable[-1] if usable else None
+
+    async def read_series(self, user_id: int, metric: int, start_ms: int, end_ms: int,
+                          step_seconds=None, max_points=DEFAULT_MAX_POINTS):
+        """
+        Return a dict of NumPy arrays for [start_ms, end_ms) at the coarsest sufficient resolution:
+        ts_ms, count, mean, min, max, plus the resolution used (0 for raw samples).
+        """
+        resolution = self.pick_resolution(start_ms, end_ms, step_seconds, max_points)
+        if resolution is None:
+            ts_ms, values = await self.read_raw(user_id, metric, start_ms, end_ms)
+            return {"resolution": 0, "ts_ms": ts_ms, "count": np.ones(len(ts_ms), np.int64),
+                    "mean": values, "min": values, "max": values}
+
+        table = device_metric_rollups
+        query = select(
+            table.c.bucket_start, table.c.sample_count, table.c.value_sum, table.c.value_min, table.c.value_max,
+        ).where(
+            table.c.user_id == user_id,
+            table.c.metric == metric,
+            table.c.resolution == resolution,
+            table.c.bucket_start >= start_ms // (resolution * 1000) * (resolution * 1000),
+            table.c.bucket_start < end_ms,
+        ).order_by(table.c.bucket_start)
+        async with self.engine.connect() as connection:
+            rows = (await connection.execute(query)).all()
+
+        columns = np.array(rows, dtype=np.float64).reshape(-1, 5)
+        counts = columns[:, 1].astype(np.int64)
+        return {
+            "resolution": resolution,
+            "ts_ms": columns[:, 0].astype(np.int64),
+            "count": counts,
+            "mean": (columns[:, 2] / np.maximum(counts, 1)).astype(np.float32),
+            "min": columns[:, 3].astype(np.float32),
+            "max": columns[:, 4].astype(np.float32),
+        }
+
+
+_timeseries_store = None
+
+async def get_timeseries_store() -> TimeSeriesStore:
+    global _timeseries_store
+    if _timeseries_store is None:
+        from backend.database.db_pool_manager import get_database_connection
+        db_conn = await get_database_connection()
+        _timeseries_store = TimeSeriesStore(db_conn.engine)
+        logging.info("Time-series store attached to the database engine")
+    return _timeseries_store
@@ -0,0 +1,312 @@
+"""
+This file contains the wearable sample ingestion pipeline: payload parsing, vectorized validation,
+a per-worker buffer and the bulk writer that flushes it to the time-series store.
+
+Devices upload batches tagged with a per-device sequence number, counting batches from 0 without
+gaps. A batch is parsed straight into NumPy arrays (no per-sample objects), validated in a few array
+operations, and appended to the buffer. The buffer is flushed when it holds flush_samples samples or
+every flush_interval_seconds, in one transaction that also records each batch's seq.
+
+Retries of a batch may land on any API worker, so deduplication and the resume point live in the
+database, not in the workers: a flush skips batches at or below the device's committed_seq and those
+already in device_ingest_batches, and committed_seq only advances over consecutive stored batches.
+A batch still buffered in one worker therefore holds committed_seq back even when another worker
+stored later batches, and clients resume after committed_seq without losing anything.
+"""
+import asyncio, json, logging, struct, time
+import numpy as np
+from sqlalchemy import bindparam, case, delete, select
+from backend.database.db_pool_manager import get_session_for_database
+from backend.database.database_query_functions import dialect_insert, insert_ignoring_conflicts
+from backend.database.models import device_ingest_batches, device_ingest_cursors
+from backend.database.timeseries import get_timeseries_store
+
+DEVICES_FILE = "./configs/devices.json"
+
+# Binary payload: header, then `count` packed little-endian records
+BINARY_MAGIC = b"NBS1"
+BINARY_HEADER = struct.Struct("<4sI")  # magic, record count
+SAMPLE_DTYPE = np.dtype([("metric", "<u1"), ("ts_ms", "<i8"), ("value", "<f4")])
+
+
+class PayloadError(ValueError):
+    pass
+
+
+def load_device_config(file_path: str = DEVICES_FILE) -> dict:
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except Exception as e:
+        logging.exception(f"Error loading device config: {e}")
+        return {"metrics": {}}
+
+
+class SampleValidator:
+    """
+    Per-metric value ranges as lookup arrays indexed by metric code, so a whole batch is
+    checked with one gather and two comparisons.
+    """
+    def __init__(self, config: dict):
+        metrics = config.get("metrics", {})
+        size = max((metric["code"] for metric in metrics.values()), default=0) + 1
+        self.known = np.zeros(size, dtype=bool)
+        self.minimum = np.zeros(size, dtype=np.float32)
+        self.maximum = np.zeros(size, dtype=np.float32)
+        for metric in metrics.values():
+            self.known[metric["code"]] = True
+            self.minimum[metric["code"]] = metric["min"]
+            self.maximum[metric["code"]] = metric["max"]
+        self.max_clock_skew_ms = int(config.get("max_clock_skew_seconds", 300) * 1000)
+        self.max_sample_age_ms = int(config.get("max_sample_age_seconds", 604800) * 1000)
+
+    def valid_mask(self, metric, ts_ms, value, now_ms=None):
+        now_ms = now_ms or int(time.time() * 1000)
+        in_table = (metric >= 0) & (metric < len(self.known))
+        codes = np.where(in_table, metric, 0)
+        return (
+            in_table
+            & self.known[codes]
+            & np.isfinite(value)
+            & (value >= self.minimum[codes])
+            & (value <= self.maximum[codes])
+            & (ts_ms >= now_ms - self.max_sample_age_ms)
+            & (ts_ms <= now_ms + self.max_clock_skew_ms)
+        )
+
+
+def parse_binary(body: bytes):
+    if len(body) < BINARY_HEADER.size:
+        raise PayloadError("Payload is shorter than its header")
+    magic, count = BINARY_HEADER.unpack_from(body)
+    if magic != BINARY_MAGIC:
+        raise PayloadError("Unknown binary payload format")
+    if len(body) != BINARY_HEADER.size + count * SAMPLE_DTYPE.itemsize:
+        raise PayloadError("Payload length does not match its record count")
+    records = np.frombuffer(body, dtype=SAMPLE_DTYPE, count=count, offset=BINARY_HEADER.size)
+    return records["metric"].astype(np.int64), records["ts_ms"], records["value"].astype(np.float32)
+
+
+def parse_ndjson(body: bytes):
+    """
+    Each line is [metric_code, ts_ms, value]. The lines are joined into one JSON array
+    so the whole batch is decoded by a single json.loads call.
+    """
+    lines = [line for line in body.split(b"\n") if line.strip()]
+    if not lines:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+    try:
+        rows = np.array(json.loads(b"[" + b",".join(lines) + b"]"), dtype=np.float64)
+    except (ValueError, TypeError) as e:
+        raise PayloadError(f"Invalid NDJSON payload: {e}")
+    if rows.ndim != 2 or rows.shape[1] != 3:
+        raise PayloadError("Every NDJSON line must be [metric, ts_ms, value]")
+    return rows[:, 0].astype(np.int64), rows[:, 1].astype(np.int64), rows[:, 2].astype(np.float32)
+
+
+def contiguous_seq(committed: int, stored_seqs) -> int:
+    """
+    Highest seq reached from committed by consecutive stored batches.
+    """
+    for seq in sorted(stored_seqs):
+        if seq != committed + 1:
+            break
+        committed = seq
+    return committed
+
+
+async def write_samples(chunks):
+    """
+    Write buffered batches to the time-series store and advance the device cursors in one transaction.
+    Batches at or below a device's committed_seq, or already stored by any worker, are skipped.
+
+    :param chunks: List of (user_id, device_id, seq, metric, ts_ms, value) with array columns.
+    :return: Dict of (user_id, device_id): committed_seq after the flush.
+    """
+    store = await get_timeseries_store()
+    devices = {(user_id, device_id) for user_id, device_id, *_ in chunks}
+    user_ids = sorted({user_id for user_id, _ in devices})
+    async with store.engine.begin() as connection:
+        committed = {device: -1 for device in devices}
+        for user_id, device_id, seq in await connection.execute(
+            select(device_ingest_cursors.c.user_id, device_ingest_cursors.c.device_id, device_ingest_cursors.c.committed_seq)
+            .where(device_ingest_cursors.c.user_id.in_(user_ids))
+        ):
+            if (user_id, device_id) in committed:
+                committed[(user_id, device_id)] = seq
+        chunks = [chunk for chunk in chunks if chunk[2] > committed[(chunk[0], chunk[1])]]
+
+        # Claim every batch's seq; a batch another worker stored first comes back empty and is dropped
+        new_batches = set()
+        if chunks:
+            stmt = insert_ignoring_conflicts(connection, device_ingest_batches, [
+                device_ingest_batches.c.user_id, device_ingest_batches.c.device_id, device_ingest_batches.c.seq,
+            ]).returning(device_ingest_batches.c.user_id, device_ingest_batches.c.device_id, device_ingest_batches.c.seq)
+            rows = await connection.execute(stmt, [
+                {"user_id": user_id, "device_id": device_id, "seq": seq} for user_id, device_id, seq, *_ in chunks
+            ])
+            new_batches = {tuple(row) for row in rows}
+        chunks = [chunk for chunk in chunks if chunk[:3] in new_batches]
+
+        if chunks:
+            await store.write(
+                connection,
+                np.concatenate([np.full(len(metric), user_id, dtype=np.int64) for user_id, _, _, metric, _, _ in chunks]),
+                np.concatenate([metric for _, _, _, metric, _, _ in chunks]),
+                np.concatenate([ts_ms for _, _, _, _, ts_ms, _ in chunks]),
+                np.concatenate([value for _, _, _, _, _, value in chunks]),
+            )
+
+        # Advance committed_seq over consecutive stored batches, including other workers' committed ones
+        stored = {device: [] for device in devices}
+        for user_id, device_id, seq in await connection.execute(
+            select(device_ingest_batches.c.user_id, device_ingest_batches.c.device_id, device_ingest_batches.c.seq)
+            .where(device_ingest_batches.c.user_id.in_(user_ids))
+        ):
+            if (user_id, device_id) in stored:
+                stored[(user_id, device_id)].append(seq)
+        advanced = {}
+        for device, seqs in stored.items():
+            seq = contiguous_seq(committed[device], seqs)
+            if seq > committed[device]:
+                advanced[device] = seq
+            committed[device] = seq
+        if advanced:
+            params = [{"user_id": user_id, "device_id": device_id, "committed_seq": seq}
+                      for (user_id, device_id), seq in advanced.items()]
+            stmt = dialect_insert(connection, device_ingest_cursors)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[device_ingest_cursors.c.user_id, device_ingest_cursors.c.device_id],
+                set_={"committed_seq": case(
+                    (stmt.excluded.committed_seq > device_ingest_cursors.c.committed_seq, stmt.excluded.committed_seq),
+                    else_=device_ingest_cursors.c.committed_seq,
+                )},
+            )
+            await connection.execute(stmt, params)
+            # Batches under the cursor are covered by it from now on
+            await connection.execute(
+                delete(device_ingest_batches).where(
+                    device_ingest_batches.c.user_id == bindparam("user_id"),
+                    device_ingest_batches.c.device_id == bindparam("device_id"),
+                    device_ingest_batches.c.seq <= bindparam("committed_seq"),
+                ),
+                params,
+            )
+    return committed
+
+
+async def read_committed_seq(user_id: int, device_id: str) -> int:
+    session_maker = await get_session_for_database()
+    async with session_maker() as session:
+        seq = (await session.execute(
+            select(device_ingest_cursors.c.committed_seq).where(
+                device_ingest_cursors.c.user_id == user_id,
+                device_ingest_cursors.c.device_id == device_id,
+            )
+        )).scalar_one_or_none()
+    return seq if seq is not None else -1
+
+
+class SampleBuffer:
+    """
+    Per-worker buffer of validated samples, flushed in bulk by size or time. The duplicate check
+    here only catches retries that reach the same worker; the flush deduplicates across workers.
+    """
+    def __init__(self, config: dict, writer=write_samples, read_cursor=read_committed_seq):
+        self.writer = writer
+        self.read_cursor = read_cursor
+        self.flush_samples = int(config.get("flush_samples", 50000))
+        self.flush_interval = float(config.get("flush_interval_seconds", 1.0))
+        self.max_buffered_samples = int(config.get("max_buffered_samples", 500000))
+
+        self.chunks = []
+        self.buffered = set()  # (user_id, device_id, seq) of the batches in chunks
+        self.size = 0
+        self.committed_seq = {}  # (user_id, device_id): committed_seq last seen in the database
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+        self.metrics = {"samples_accepted": 0, "samples_rejected": 0, "duplicate_batches": 0,
+                        "flushes": 0, "flush_errors": 0, "last_flush_seconds": 0.0}
+
+    @property
+    def full(self) -> bool:
+        return self.size >= self.max_buffered_samples
+
+    async def known_committed_seq(self, user_id: int, device_id: str) -> int:
+        """
+        committed_seq as last seen by this worker. Other workers may have advanced it since, so it
+        is only ever too low, which lets a duplicate through to the flush but never drops a batch.
+        """
+        key = (user_id, device_id)
+        if key not in self.committed_seq:
+            self.committed_seq[key] = await self.read_cursor(user_id, device_id)
+        return self.committed_seq[key]
+
+    async def cursor(self, user_id: int, device_id: str):
+        """
+        Return (highest seq buffered here or committed, committed_seq read from the database).
+        """
+        committed = await self.read_cursor(user_id, device_id)
+        key = (user_id, device_id)
+        self.committed_seq[key] = max(committed, self.committed_seq.get(key, -1))
+        buffered = [seq for buffered_user, buffered_device, seq in self.buffered
+                    if (buffered_user, buffered_device) == key]
+        return max([committed, *buffered]), committed
+
+    async def add(self, user_id: int, device_id: str, seq: int, metric, ts_ms, value, rejected: int) -> bool:
+        """
+        Buffer one validated batch. Returns False if the batch is known to be stored or buffered already.
+        """
+        batch = (user_id, device_id, seq)
+        if seq <= await self.known_committed_seq(user_id, device_id) or batch in self.buffered:
+            self.metrics["duplicate_batches"] += 1
+            return False
+
+        self.buffered.add(batch)
+        self.chunks.append((user_id, device_id, seq, metric, ts_ms, value))
+        self.size += len(metric)
+        self.metrics["samples_accepted"] += len(metric)
+        self.metrics["samples_rejected"] += rejected
+
+        # Flush in the background so the request that crossed the threshold is not held up
+        if self.size >= self.flush_samples and (self.flush_task is None or self.flush_task.done()):
+            self.flush_task = asyncio.create_task(self.flush())
+        return True
+
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.chunks:
+                return
+            chunks, size = self.chunks, self.size
+            self.chunks, self.size = [], 0
+
+            start = time.perf_counter()
+            try:
+                committed = await self.writer(chunks)
+            except Exception as e:
+                self.metrics["flush_errors"] += 1
+                logging.exception(f"Error flushing {size} device samples: {e}")
+                # Keep the samples for the next flush, newer batches go after them
+                self.chunks = chunks + self.chunks
+                self.size += size
+                return
+
+            for user_id, device_id, seq, *_ in chunks:
+                self.buffered.discard((user_id, device_id, seq))
+            for key, seq in committed.items():
+                self.committed_seq[key] = max(seq, self.committed_seq.get(key, -1))
+            self.metrics["flushes"] += 1
+            self.metrics["last_flush_seconds"] = time.perf_counter() - start
+
+    async def run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {**self.metrics, "buffered_samples": self.size}
+
+
+device_config = load_device_config()
+sample_validator = SampleValidator(device_config)
+sample_buffer = SampleBuffer(device_config)
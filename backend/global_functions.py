@@ -2,36 +2,29 @@
 This file contains global functions to use in the project
 """
 
-import json, os, logging, importlib
-from jinja2 import FileSystemLoader, Environment
+import json, os, logging, importlib, hashlib, sys
+from jinja2 import FileSystemLoader, FileSystemBytecodeCache, Environment
+from jinja2.environment import load_extensions
+from backend.core import config, tracing
+from backend.metrics import register_collector
 
 logging.basicConfig(level=logging.INFO)
 
-_loaded_jinja_extensions = None
+_loaded_jinja_extensions = {}  # json path outside configs/: resolved extensions
+# Shared environments, keyed by loader folders, extension file and Environment options
+_jinja_envs = {}
 
 ########################################
 # Jinja extension loading and env setup
 ########################################
-def load_jinja_extensions(json_path: str):
-
-    # Check for "cached" extension list
-    global _loaded_jinja_extensions
-    if _loaded_jinja_extensions:
-        return _loaded_jinja_extensions
-    
-    # Default extensions and logic to populate json if DNE
-    DEFAULT_EXTENSIONS = [
-        "jinja2.ext.do",
-        "jinja2.ext.loopcontrols",
-        "jinja_try_catch.TryCatchExtension"
-    ]
-    if not os.path.exists(json_path):
-        with open(json_path, "w") as f:
-            json.dump(DEFAULT_EXTENSIONS, f, indent=2)
+# Default extensions, written to the json if it does not exist
+DEFAULT_EXTENSIONS = [
+    "jinja2.ext.do",
+    "jinja2.ext.loopcontrols",
+    "jinja_try_catch.TryCatchExtension"
+]
 
-    with open(json_path, "r") as f:
-        extensions = json.load(f)
-    
+def resolve_jinja_extensions(extensions) -> list:
     resolved_extensions = []
     for ext in extensions:
         if "." in ext:
@@ -41,14 +34,173 @@ def load_jinja_extensions(json_path: str):
             resolved_extensions.append(getattr(module, class_name))
         else:
             resolved_extensions.append(ext)  # Already imported string extension
-    _loaded_jinja_extensions = resolved_extensions
     return resolved_extensions
 
-def get_jinja_env(widget_folders_array: list = None, ext_json_path: str = "configs/jinja_ext.json"):
+def load_jinja_extensions(json_path: str):
+    """
+    Return the extensions listed in json_path. A file under configs/ is read from the current
+    config snapshot and resolved once per snapshot; other files are read and resolved once.
+    """
+    name = os.path.splitext(os.path.basename(json_path))[0]
+    snapshot = config.current()
+    if os.path.dirname(os.path.abspath(json_path)) == os.path.abspath(config.CONFIG_DIR) and name in snapshot.files:
+        return snapshot.derive(f"jinja_extensions:{name}", lambda snap: resolve_jinja_extensions(snap[name]))
+
+    if json_path in _loaded_jinja_extensions:
+        return _loaded_jinja_extensions[json_path]
+    if not os.path.exists(json_path):
+        with open(json_path, "w") as f:
+            json.dump(DEFAULT_EXTENSIONS, f, indent=2)
+    with open(json_path, "r") as f:
+        extensions = json.load(f)
+    _loaded_jinja_extensions[json_path] = resolve_jinja_extensions(extensions)
+    return _loaded_jinja_extensions[json_path]
+
+def refresh_jinja_extensions(snapshot):
+    """
+    Give every registered env the extensions of the new snapshot if its list changed. The env's
+    compiled templates are dropped and its bytecode cache files renamed, so nothing compiled with
+    the old extensions is served again.
+    """
+    for key, env in _jinja_envs.items():
+        try:
+            extensions = load_jinja_extensions(key[1])
+        except Exception as e:
+            logging.exception(f"Error loading jinja extensions from {key[1]}, keeping the current ones: {e}")
+            continue
+        if set(env.extensions) == {getattr(ext, "identifier", ext) for ext in extensions}:
+            continue
+        env.extensions = load_extensions(env, extensions)
+        env.bytecode_cache = _bytecode_cache(key, extensions)
+        if env.cache is not None:
+            env.cache.clear()
+        logging.info(f"Jinja extensions of {key[0]} reloaded")
+
+def load_jinja_config() -> dict:
+    # Read when an env is created, so a changed jinja.json applies to envs created after the reload
+    return config.current().get("jinja") or {"bytecode_cache_dir": None, "auto_reload": True}
+
+
+class CountingLoader(FileSystemLoader):
+    """
+    FileSystemLoader that records whether a template missing from the in-memory cache
+    came from the bytecode cache or had to be compiled from source.
+    """
+    def load(self, environment, name, globals=None):
+        compiles = environment.compiles
+        template = super().load(environment, name, globals)
+        environment.loads += 1
+        if environment.compiles == compiles:
+            environment.bytecode_hits += 1
+        return template
+
+
+class CountingEnvironment(Environment):
+    """
+    Environment keeping lookup, load and compile counters for /metrics.
+    """
+    def __init__(self, *args, **kwargs):
+        self.lookups = self.loads = self.compiles = self.bytecode_hits = 0
+        super().__init__(*args, **kwargs)
+
+    def get_template(self, *args, **kwargs):
+        self.lookups += 1
+        with tracing.span("template_load"):
+            return super().get_template(*args, **kwargs)
+
+    def compile(self, source, name=None, filename=None, raw=False, defer_init=False):
+        if not raw:
+            self.compiles += 1
+        return super().compile(source, name, filename, raw, defer_init)
+
+
+def _env_digest(key) -> str:
+    # Stable across processes, so every worker finds the bytecode the others wrote
+    text = repr([getattr(part, "__qualname__", part) for part in key])
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+def _bytecode_cache(key, extensions):
+    directory = load_jinja_config().get("bytecode_cache_dir")
+    if not directory:
+        return None
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except Exception as e:
+        logging.error(f"Jinja bytecode cache disabled, cannot create {directory}: {e}")
+        return None
+    # Async and sync envs compile the same file differently, so each env gets its own files
+    digest = _env_digest((*key, *(getattr(ext, "__name__", ext) for ext in extensions)))
+    return FileSystemBytecodeCache(directory, f"__jinja2_{digest}_%s.cache")
+
+
+def get_jinja_env(widget_folders_array: list = None, ext_json_path: str = "configs/jinja_ext.json", **env_options):
+    """
+    Return the shared Jinja Environment for these loader folders and options, creating it on
+    first use. Extra keyword arguments (enable_async, autoescape, ...) are passed on to the
+    Environment. Compiled templates are kept in the env's memory cache and in the bytecode
+    cache on disk, which all workers share.
+    """
+    folders = tuple(widget_folders_array or [])
+    key = (folders, ext_json_path, *sorted(env_options.items()))
+    env = _jinja_envs.get(key)
+    if env is not None:
+        return env
+
     extensions = load_jinja_extensions(ext_json_path)
-    
-    env = Environment(
-        loader=FileSystemLoader(widget_folders_array or []),
+    jinja_config = load_jinja_config()
+    env_options.setdefault("auto_reload", jinja_config.get("auto_reload", True))
+    env_options.setdefault("cache_size", jinja_config.get("cache_size", 400))
+    env = CountingEnvironment(
+        loader=CountingLoader(list(folders)),
         extensions=extensions,
+        bytecode_cache=_bytecode_cache(key, extensions),
+        **env_options,
     )
-    return env
\ No newline at end of file
+    _jinja_envs[key] = env
+    return env
+
+
+def jinja_template_stats() -> dict:
+    envs = list(_jinja_envs.values())
+    lookups = sum(env.lookups for env in envs)
+    loads = sum(env.loads for env in envs)
+    return {
+        "environments": len(envs),
+        "lookups": lookups,
+        "memory_hits": lookups - loads,
+        "bytecode_hits": sum(env.bytecode_hits for env in envs),
+        "compiles": sum(env.compiles for env in envs),
+    }
+
+register_collector("jinja_templates", jinja_template_stats)
+config.on_reload(refresh_jinja_extensions)
+
+
+def precompile_templates() -> int:
+    """
+    Compile every template of every registered env into the bytecode cache. Meant to run at
+    deploy time, after the routers have been imported, so workers start with a warm cache.
+    """
+    compiled = 0
+    for env in _jinja_envs.values():
+        for name in env.list_templates():
+            try:
+                env.get_template(name)
+                compiled += 1
+            except Exception as e:
+                logging.error(f"Failed to precompile template {name}: {e}")
+    return compiled
+
+
+########################################
+# Deploy step: python -m backend.global_functions precompile
+########################################
+if __name__ == "__main__":
+    if sys.argv[1:] != ["precompile"]:
+        sys.exit("usage: python -m backend.global_functions precompile")
+    # Importing the app imports every router, which registers their envs in backend.global_functions
+    import main  # noqa: F401
+    from backend import global_functions
+    logging.info(f"Precompiled {global_functions.precompile_templates()} templates "
+                 f"into {global_functions.load_jinja_config().get('bytecode_cache_dir')}")
@@ -2,6 +2,7 @@
 This file contains global variables to use in the project
 """
 import json, logging
+from backend.core import config
 
 
 JINJA_FOLDER_NAME = "jinja_files"
@@ -9,21 +10,34 @@ TEMPLATES_FOLDER_NAME = "backend/templates"
 STATIC_FOLDER_NAME = "backend/static"
 
 DBCONFIG = {}
+DB_POOL_CONFIG = {}
 RATE_LIMITER_CONFIG = {}
 MISC_CONFIG = {}
 
-def load_configs():
-    global RATE_LIMITER_CONFIG, MISC_CONFIG
+def load_dbconfig():
+    global DBCONFIG, DB_POOL_CONFIG
     try:
-        with open("./configs/rate_limiter.json") as f:
-            RATE_LIMITER_CONFIG = json.load(f)
+        with open("./configs/DB_connection.json") as f:
+            DBCONFIG = json.load(f)
     except Exception as e:
-        logging.exception(f"Error loading rate limiter config: {e}")
-        RATE_LIMITER_CONFIG = {}
+        logging.exception(f"Error loading database config: {e}")
+        DBCONFIG = {}
 
     try:
-        with open('./configs/misc.json') as f:
-            MISC_CONFIG = json.load(f)
+        with open("./configs/db_pool.json") as f:
+            DB_POOL_CONFIG = json.load(f)
     except Exception as e:
-        logging.exception(f"Error loading misc config: {e}")
-        MISC_CONFIG = {}
\ No newline at end of file
+        logging.exception(f"Error loading database pool config: {e}")
+        DB_POOL_CONFIG = {}
+
+def load_configs(snapshot=None):
+    """
+    Point the module globals at the current config snapshot. Runs again after every reload,
+    so code reading configs.MISC_CONFIG at call time always sees the current values.
+    """
+    global RATE_LIMITER_CONFIG, MISC_CONFIG
+    snapshot = snapshot or config.current()
+    RATE_LIMITER_CONFIG = snapshot.get("rate_limiter", {})
+    MISC_CONFIG = snapshot.get("misc", {})
+
+config.on_reload(load_configs)
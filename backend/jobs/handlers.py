@@ -0,0 +1,157 @@
+"""
+This file contains the job handlers run by the job workers, registered by job type.
+
+A handler is called as handler(payload, job) and finishes the job by returning. Any exception makes
+the job retry with backoff, PermanentJobError makes it fail at once. Jobs run at least once (a
+worker can die after the work but before the job is deleted), so every handler must be safe to
+run twice.
+"""
+import asyncio, logging, os
+from concurrent.futures import ThreadPoolExecutor
+from backend.jobs.queue import PermanentJobError, type_setting
+from backend.mail.mailer import SMTPConnection, get_mailer, is_transient_error
+
+HANDLERS = {}  # job type: async handler(payload, job)
+
+
+def job_handler(job_type: str):
+    def register(handler):
+        HANDLERS[job_type] = handler
+        return handler
+    return register
+
+
+#############################################
+# Email: the email jobs running together share a few SMTP sessions
+#############################################
+class EmailSender:
+    """
+    Sends the messages of email jobs over a few pooled SMTP connections, each used from one thread
+    at a time. Messages wait until a connection is free, and a free connection takes up to
+    batch_size waiting messages in one send_batch, so the email jobs a worker claims together go
+    out over one SMTP session per connection. A job only finishes once the server accepted its
+    message.
+    """
+    def __init__(self):
+        self.connections = None  # idle connections
+        self.executor = None
+        self.batch_size = 1
+        self.waiting = []  # (message, future of its send error or None) not handed to a connection yet
+        self.sending = set()  # executor futures of batches in progress
+        self.dispatch_scheduled = False
+
+    def start(self):
+        mailer = get_mailer()
+        size = int(type_setting("email", "connections", 2))
+        self.batch_size = int(type_setting("email", "send_batch_size", 20))
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="job-mailer")
+        self.connections = [
+            SMTPConnection(mailer.host, mailer.port, mailer.user, mailer.password,
+                           use_tls=mailer.use_tls, idle_timeout=mailer.idle_timeout, metrics=mailer.metrics)
+            for _ in range(size)
+        ]
+
+    async def send(self, to_email: str, subject: str, body: str):
+        if self.connections is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        sent = loop.create_future()
+        self.waiting.append((get_mailer().build_message(to_email, subject, body), sent))
+        if not self.dispatch_scheduled:
+            # After the jobs started in the same poll have queued their messages too
+            self.dispatch_scheduled = True
+            loop.call_soon(self._dispatch)
+        # A job cancelled by its timeout or by shutdown cancels sent, and a message still waiting is dropped
+        error = await sent
+        if error is not None:
+            if not is_transient_error(error):
+                raise PermanentJobError(f"Email to {to_email} rejected: {error}") from error
+            raise error
+
+    def _dispatch(self):
+        self.dispatch_scheduled = False
+        self.waiting = [(message, sent) for message, sent in self.waiting if not sent.done()]
+        while self.waiting and self.connections:
+            batch, self.waiting = self.waiting[:self.batch_size], self.waiting[self.batch_size:]
+            connection = self.connections.pop()
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, connection.send_batch, [message for message, _ in batch])
+            self.sending.add(future)
+            future.add_done_callback(lambda future, connection=connection, batch=batch: self._sent(future, connection, batch))
+
+    def _sent(self, future, connection, batch):
+        # The connection goes back to the pool when its thread is done with it, not when the jobs are
+        self.sending.discard(future)
+        self.connections.append(connection)
+        metrics = get_mailer().metrics
+        metrics["batches"] += 1
+        error = future.exception()
+        failures = {} if error else {id(message): failure for message, failure in future.result()}
+        for message, sent in batch:
+            outcome = error or failures.get(id(message))
+            metrics["failed" if outcome else "sent"] += 1
+            if not sent.done():
+                sent.set_result(outcome)
+        self._dispatch()
+
+    async def close(self):
+        if self.connections is None:
+            return
+        # Batches of cancelled jobs are still using their connections, wait for them to come back
+        while self.sending:
+            await asyncio.wait(list(self.sending))
+        loop = asyncio.get_running_loop()
+        for connection in self.connections:
+            await loop.run_in_executor(self.executor, connection.close)
+        self.executor.shutdown(wait=False)
+        self.connections = self.executor = None
+        self.waiting = []
+
+
+email_sender = EmailSender()
+
+
+@job_handler("email")
+async def send_email(payload: dict, job):
+    await email_sender.send(payload["to"], payload["subject"], payload["body"])
+
+
+#############################################
+# Analytics: recompute the rollups of a user's metric from the raw samples
+#############################################
+@job_handler("analytics")
+async def rebuild_rollups(payload: dict, job):
+    from backend.database.timeseries import get_timeseries_store
+    store = await get_timeseries_store()
+    async with store.engine.begin() as connection:
+        samples = await store.rebuild_rollups(
+            connection, int(payload["user_id"]), int(payload["metric"]), int(payload["start_ms"]), int(payload["end_ms"]),
+        )
+    logging.info(f"Rebuilt rollups of user {payload['user_id']} metric {payload['metric']} from {samples} samples")
+
+
+#############################################
+# Reports: render a health report CSV to a file for later download
+#############################################
+@job_handler("reports")
+async def generate_report(payload: dict, job):
+    from backend.routes.reports import RESOLUTIONS, csv_pieces, report_path, report_periods
+    path = report_path(int(payload["user_id"]), job.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    periods = report_periods(int(payload["user_id"]), RESOLUTIONS[payload["resolution"]],
+                             int(payload["start_ms"]), int(payload["end_ms"]))
+    # Written under a temporary name and renamed, so a download never sees a partial report
+    partial_path = f"{path}.partial"
+    try:
+        with open(partial_path, "w", newline="") as f:
+            async for piece in csv_pieces(periods):
+                f.write(piece)
+        os.replace(partial_path, path)
+    finally:
+        await periods.aclose()
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+async def close_handlers():
+    await email_sender.close()
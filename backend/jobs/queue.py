@@ -0,0 +1,174 @@
+"""
+This file contains the operations on the jobs table behind the durable job queue.
+
+Jobs are enqueued on the caller's session, so they commit or roll back together with the rest of
+the request's writes. Workers claim due jobs in batches with one UPDATE ... WHERE id IN
+(SELECT ... FOR UPDATE SKIP LOCKED) RETURNING statement: on Postgres concurrent workers skip each
+other's locked rows instead of waiting on them, and SQLite (which has no row locks, SQLAlchemy
+leaves the FOR UPDATE out) serializes the statement on its single writer lock, so the same code
+claims safely on both.
+
+A claimed job is "running" under its worker's id. Workers refresh locked_at of their jobs with a
+heartbeat, and a running job whose heartbeat is older than visibility_timeout_seconds is put back
+in the queue, so jobs of a worker that died are picked up by another one. Every write of a job's
+outcome is filtered on locked_by, so a worker that was presumed dead cannot delete or reschedule
+a job that another worker has claimed since.
+"""
+import json, random, time
+from sqlalchemy import case, delete, insert, select, update
+from backend.core import config
+from backend.database.models import jobs
+
+QUEUED = "queued"
+RUNNING = "running"
+FAILED = "failed"
+
+
+class PermanentJobError(Exception):
+    """
+    Raised by a handler for a job that will never succeed, so it fails without further retries.
+    """
+
+
+def load_jobs_config(snapshot=None) -> dict:
+    return (snapshot or config.current()).get("jobs") or {}
+
+
+def type_setting(job_type: str, key: str, default):
+    """
+    Setting of one job type (jobs.json types.<job_type>.<key>), falling back to the top-level key.
+    """
+    settings = load_jobs_config()
+    return settings.get("types", {}).get(job_type, {}).get(key, settings.get(key, default))
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def retry_delay(attempt: int) -> float:
+    """
+    Exponential backoff in seconds after the given failed attempt, with jitter so jobs that failed
+    together do not all come back at once.
+    """
+    settings = load_jobs_config()
+    delay = min(float(settings.get("backoff_base_seconds", 2)) * 2 ** (attempt - 1),
+                float(settings.get("max_backoff_seconds", 600)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def enqueue(session, job_type: str, payload: dict, delay_seconds: float = 0, max_attempts: int = None) -> int:
+    """
+    Add a job on the caller's session (or connection); it becomes visible to workers when the
+    caller commits. Returns the job id.
+
+    :param job_type: Name of the handler, see backend/jobs/handlers.py.
+    :param payload: JSON-serializable arguments of the handler.
+    :param delay_seconds: Earliest start, relative to now.
+    :param max_attempts: Attempts before the job is marked failed, defaults to jobs.json.
+    """
+    if max_attempts is None:
+        max_attempts = int(type_setting(job_type, "max_attempts", 5))
+    stmt = insert(jobs).values(
+        job_type=job_type,
+        payload=json.dumps(payload),
+        max_attempts=max_attempts,
+        run_at=now_ms() + int(delay_seconds * 1000),
+    ).returning(jobs.c.id)
+    return (await session.execute(stmt)).scalar_one()
+
+
+async def claim(connection, job_type: str, limit: int, worker_id: str) -> list:
+    """
+    Lock up to limit due jobs of job_type for worker_id in one round trip and return their rows
+    (id, job_type, payload, attempts, max_attempts). attempts already counts this run.
+    """
+    now = now_ms()
+    due = (
+        select(jobs.c.id)
+        .where(jobs.c.job_type == job_type, jobs.c.status == QUEUED, jobs.c.run_at <= now)
+        .order_by(jobs.c.run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    stmt = (
+        update(jobs)
+        .where(jobs.c.id.in_(due))
+        .values(status=RUNNING, locked_by=worker_id, locked_at=now, attempts=jobs.c.attempts + 1)
+        .returning(jobs.c.id, jobs.c.job_type, jobs.c.payload, jobs.c.attempts, jobs.c.max_attempts)
+    )
+    return (await connection.execute(stmt)).all()
+
+
+async def complete(connection, worker_id: str, job_ids) -> int:
+    """
+    Delete finished jobs still locked by worker_id, all of them in one statement. Returns how many were deleted.
+    """
+    result = await connection.execute(delete(jobs).where(jobs.c.id.in_(list(job_ids)), jobs.c.locked_by == worker_id))
+    return result.rowcount
+
+
+async def fail(connection, worker_id: str, job, error: str, permanent: bool = False):
+    """
+    Put a failed job back in the queue after its backoff delay, or mark it failed once it is out of
+    attempts (or the error is permanent). Returns True if it will be retried, None if the job is
+    no longer locked by worker_id and was left alone.
+    """
+    retry = not permanent and job.attempts < job.max_attempts
+    values = {"locked_by": None, "locked_at": None, "last_error": error[:2000]}
+    if retry:
+        values.update(status=QUEUED, run_at=now_ms() + int(retry_delay(job.attempts) * 1000))
+    else:
+        values.update(status=FAILED)
+    result = await connection.execute(
+        update(jobs).where(jobs.c.id == job.id, jobs.c.locked_by == worker_id).values(**values)
+    )
+    return retry if result.rowcount else None
+
+
+async def release(connection, worker_id: str, job_ids):
+    """
+    Return jobs a stopping worker did not finish to the queue, without counting the interrupted attempt.
+    """
+    await connection.execute(
+        update(jobs)
+        .where(jobs.c.id.in_(list(job_ids)), jobs.c.locked_by == worker_id, jobs.c.status == RUNNING)
+        .values(status=QUEUED, locked_by=None, locked_at=None, run_at=now_ms(), attempts=jobs.c.attempts - 1)
+    )
+
+
+async def heartbeat(connection, worker_id: str, job_ids):
+    await connection.execute(
+        update(jobs)
+        .where(jobs.c.id.in_(list(job_ids)), jobs.c.locked_by == worker_id, jobs.c.status == RUNNING)
+        .values(locked_at=now_ms())
+    )
+
+
+async def recover_stale(connection, visibility_timeout: float) -> int:
+    """
+    Requeue running jobs whose worker stopped sending heartbeats. A job that was on its last attempt
+    is marked failed instead, so a job that crashes its worker cannot take down every worker in turn.
+    Returns the number of recovered jobs.
+    """
+    result = await connection.execute(
+        update(jobs)
+        .where(jobs.c.status == RUNNING, jobs.c.locked_at < now_ms() - int(visibility_timeout * 1000))
+        .values(
+            status=case((jobs.c.attempts >= jobs.c.max_attempts, FAILED), else_=QUEUED),
+            locked_by=None,
+            locked_at=None,
+            last_error="worker stopped sending heartbeats",
+        )
+    )
+    return result.rowcount
+
+
+async def job_status(session, job_id: int):
+    """
+    Return (status, last_error, payload) of a job, or None once it finished (or never existed).
+    """
+    row = (await session.execute(
+        select(jobs.c.status, jobs.c.last_error, jobs.c.payload).where(jobs.c.id == job_id)
+    )).first()
+    return (row.status, row.last_error, json.loads(row.payload)) if row is not None else None
@@ -0,0 +1,212 @@
+"""
+This file contains the job worker, a process separate from the API workers that runs queued jobs.
+
+Each worker polls the jobs table and claims due jobs of a type in batches, as many as the type
+has free slots (jobs.json types.<type>.concurrency), so one round trip fetches up to batch_size
+jobs. Finished jobs are deleted and failures rescheduled in the same transaction as the next
+claim, and the worker polls again right away while claims come back full. Running jobs get a
+heartbeat every heartbeat_seconds, and every worker requeues jobs whose heartbeat stopped.
+
+On SIGTERM / SIGINT a worker stops claiming, gives running jobs shutdown_grace_seconds to finish
+and returns the rest to the queue.
+
+Run from the repository root:
+    python -m backend.jobs.worker [--types email,reports] [--processes N]
+"""
+import argparse, asyncio, json, logging, multiprocessing, os, signal, socket, time
+from backend.core import config
+from backend.jobs import queue
+from backend.jobs.handlers import HANDLERS, close_handlers
+
+
+class JobWorker:
+    def __init__(self, job_types=None, worker_id: str = None):
+        """
+        :param job_types: Job types this worker runs, defaults to every type with a handler.
+        :param worker_id: Name stored in locked_by, defaults to host:pid.
+        """
+        unknown = set(job_types or ()) - set(HANDLERS)
+        if unknown:
+            raise ValueError(f"No handler for job types: {', '.join(sorted(unknown))}")
+        self.job_types = list(job_types or HANDLERS)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.active = {job_type: 0 for job_type in self.job_types}
+        self.tasks = {}  # job id: task
+        self.finished = []  # ids of jobs done since the last poll
+        self.failures = []  # (job, error, permanent) since the last poll
+        self.wake = asyncio.Event()
+        self.stopping = False
+        self.last_heartbeat = 0.0
+        self.stats = {"claimed": 0, "completed": 0, "retried": 0, "failed": 0, "lost": 0, "recovered": 0, "polls": 0}
+
+    def stop(self):
+        self.stopping = True
+        self.wake.set()
+
+    async def _run_job(self, job):
+        timeout = float(queue.type_setting(job.job_type, "timeout_seconds", 300))
+        try:
+            await asyncio.wait_for(HANDLERS[job.job_type](json.loads(job.payload), job), timeout)
+            self.finished.append(job.id)
+        except asyncio.CancelledError:
+            raise
+        except queue.PermanentJobError as e:
+            logging.error(f"Job {job.id} ({job.job_type}) failed permanently: {e}")
+            self.failures.append((job, str(e), True))
+        except Exception as e:
+            logging.exception(f"Job {job.id} ({job.job_type}) failed on attempt {job.attempts}/{job.max_attempts}: {e!r}")
+            self.failures.append((job, repr(e), False))
+        finally:
+            self.active[job.job_type] -= 1
+            self.tasks.pop(job.id, None)
+            self.wake.set()
+
+    async def _flush(self, connection):
+        """
+        Write the outcome of every job that ended since the last poll. Returns what was written,
+        for _flushed once the transaction committed; if it does not, the outcomes stay for the next poll.
+        """
+        finished, failures = list(self.finished), list(self.failures)
+        outcomes = {"completed": 0, "retried": 0, "failed": 0, "lost": 0}
+        if finished:
+            outcomes["completed"] = await queue.complete(connection, self.worker_id, finished)
+            outcomes["lost"] += len(finished) - outcomes["completed"]
+        for job, error, permanent in failures:
+            retried = await queue.fail(connection, self.worker_id, job, error, permanent)
+            outcomes["lost" if retried is None else "retried" if retried else "failed"] += 1
+        return len(finished), len(failures), outcomes
+
+    def _flushed(self, written):
+        finished, failures, outcomes = written
+        # Jobs only ever get appended, the ones that ended during the transaction are kept
+        self.finished = self.finished[finished:]
+        self.failures = self.failures[failures:]
+        if outcomes["lost"]:
+            logging.warning(f"{outcomes['lost']} jobs were taken over by other workers before their outcome was written")
+        for key, count in outcomes.items():
+            self.stats[key] += count
+
+    async def poll(self, engine) -> bool:
+        """
+        One round of flush, heartbeat / recovery when due, and claims. Returns True if a claim came
+        back full, meaning more jobs are probably waiting.
+        """
+        settings = queue.load_jobs_config()
+        batch_size = int(settings.get("batch_size", 20))
+        now = time.monotonic()
+        more_waiting = False
+        async with engine.begin() as connection:
+            written = await self._flush(connection)
+            if now - self.last_heartbeat >= float(settings.get("heartbeat_seconds", 15)):
+                self.last_heartbeat = now
+                if self.tasks:
+                    await queue.heartbeat(connection, self.worker_id, list(self.tasks))
+                recovered = await queue.recover_stale(connection, float(settings.get("visibility_timeout_seconds", 120)))
+                if recovered:
+                    self.stats["recovered"] += recovered
+                    logging.warning(f"Requeued {recovered} jobs of workers that stopped sending heartbeats")
+            for job_type in self.job_types:
+                free = int(queue.type_setting(job_type, "concurrency", 1)) - self.active[job_type]
+                if free <= 0 or self.stopping:
+                    continue
+                limit = min(free, batch_size)
+                claimed = await queue.claim(connection, job_type, limit, self.worker_id)
+                more_waiting |= len(claimed) == limit
+                for job in claimed:
+                    self.active[job_type] += 1
+                    self.tasks[job.id] = asyncio.create_task(self._run_job(job))
+                self.stats["claimed"] += len(claimed)
+        self._flushed(written)
+        self.stats["polls"] += 1
+        return more_waiting
+
+    async def run(self, engine):
+        logging.info(f"Job worker {self.worker_id} running {', '.join(self.job_types)}")
+        while not self.stopping:
+            self.wake.clear()
+            try:
+                more_waiting = await self.poll(engine)
+            except Exception as e:
+                logging.exception(f"Job worker poll failed: {e}")
+                more_waiting = False
+            if more_waiting:
+                continue
+            try:
+                # A finished job wakes the loop early, to write its outcome and refill its slot
+                await asyncio.wait_for(self.wake.wait(), float(queue.load_jobs_config().get("poll_interval_seconds", 1.0)))
+            except asyncio.TimeoutError:
+                pass
+        await self.shutdown(engine)
+
+    async def shutdown(self, engine):
+        grace = float(queue.load_jobs_config().get("shutdown_grace_seconds", 20))
+        running = list(self.tasks.items())
+        if running:
+            logging.info(f"Job worker stopping, waiting up to {grace:g}s for {len(running)} jobs")
+            await asyncio.wait([task for _, task in running], timeout=grace)
+        unfinished = [(job_id, task) for job_id, task in running if not task.done()]
+        for _, task in unfinished:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in unfinished), return_exceptions=True)
+        async with engine.begin() as connection:
+            written = await self._flush(connection)
+            if unfinished:
+                await queue.release(connection, self.worker_id, [job_id for job_id, _ in unfinished])
+        self._flushed(written)
+        logging.info(f"Job worker {self.worker_id} stopped, {len(unfinished)} jobs returned to the queue, stats: {self.stats}")
+
+
+async def serve(job_types=None):
+    import backend.global_variables as configs
+    from backend.database.db_pool_manager import close_database, get_database_connection
+
+    configs.load_configs()
+    worker = JobWorker(job_types)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+    config_watcher_task = asyncio.create_task(config.run_watcher())
+    try:
+        db_conn = await get_database_connection()
+        await worker.run(db_conn.engine)
+    finally:
+        config_watcher_task.cancel()
+        await close_handlers()
+        await close_database()
+
+
+def run_process(job_types=None):
+    from backend.core.logging_pipeline import setup_logging
+    listener = setup_logging()
+    try:
+        asyncio.run(serve(job_types))
+    finally:
+        listener.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued jobs")
+    parser.add_argument("--types", help="comma-separated job types, default all")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes to start")
+    args = parser.parse_args()
+    job_types = args.types.split(",") if args.types else None
+
+    if args.processes <= 1:
+        run_process(job_types)
+        return
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_process, args=(job_types,), name=f"job-worker-{i}") for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    # Ctrl+C reaches the whole process group; SIGTERM to the parent is passed on to the workers
+    signal.signal(signal.SIGTERM, lambda *args: [process.terminate() for process in processes])
+    for process in processes:
+        while process.is_alive():
+            try:
+                process.join()
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == "__main__":
+    main()
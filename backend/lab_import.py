@@ -0,0 +1,403 @@
+"""
+This file contains the partner lab CSV import: an incremental CSV parser fed by the upload stream,
+unit normalization, the (analyte, sex, age band) reference-range index, and the import loop that
+commits results in batches together with the resume point.
+
+The upload is never held in memory: the parser only keeps the unfinished last record, at most
+max_record_bytes of it, and at most one batch of normalized rows is pending. Each batch is inserted
+in the same transaction that advances the import's rows_committed / bytes_committed, so after a
+failure the partner either re-sends the whole file (committed rows are skipped) or only the bytes
+after bytes_committed.
+"""
+import bisect, csv, json, logging, math, re, time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, or_, select, update
+from backend.database.db_pool_manager import get_session_for_database
+from backend.database.database_query_functions import execute_in_transaction, insert_ignoring_conflicts
+from backend.database.models import lab_imports, lab_results
+
+LABS_FILE = "./configs/labs.json"
+SEXES = ("M", "F")
+ROW_FIELDS = ("patient_ref", "sex", "age", "analyte", "value", "unit", "collected_at")
+UTF8_BOM = b"\xef\xbb\xbf"
+QUOTE = ord('"')
+QUOTE_OR_DELIMITER = re.compile(rb'[",]')
+RECORD_START = (False, True, False)
+# Fields that are unquoted, or quoted as a whole and closed on the same line
+SIMPLE_RECORD = re.compile(rb'(?:"(?:[^"]|"")*"|[^",]*)(?:,(?:"(?:[^"]|"")*"|[^",]*))*')
+
+# Imports running in this worker: import id -> live counters for the progress endpoint
+active_imports = {}
+
+
+class LabImportError(ValueError):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def load_lab_config(file_path: str = LABS_FILE) -> dict:
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except Exception as e:
+        logging.exception(f"Error loading lab config: {e}")
+        return {"analytes": {}, "age_bands": [0, 130], "columns": {}}
+
+
+def scan_quotes(data: bytes, state=RECORD_START):
+    """
+    Quote state after data given the one before it: (inside a quoted field, at the start of a
+    field, right after a closing quote). Follows the csv module: a quote opens a quoted field only
+    at the start of a field, a quote right after the closing one is an escaped quote, and any other
+    quote is part of the field.
+    """
+    quoted, at_field_start, after_close = state
+    field_start, closed_at = (0 if at_field_start else -1), (-1 if after_close else -2)
+    for match in QUOTE_OR_DELIMITER.finditer(data):
+        pos = match.start()
+        if quoted:
+            if data[pos] == QUOTE:
+                quoted, closed_at = False, pos
+        elif data[pos] != QUOTE:
+            field_start = pos + 1
+        elif pos == field_start or pos == closed_at + 1:
+            quoted = True
+    return quoted, not quoted and field_start == len(data), not quoted and closed_at == len(data) - 1
+
+
+class IncrementalCSVParser:
+    """
+    CSV parser fed with arbitrary byte chunks. Lines are grouped into records with the quote state
+    of the csv module, so quoted fields may contain newlines and chunk boundaries may fall anywhere.
+    A record longer than max_record_bytes is not kept: its bytes are scanned and skipped up to its
+    end, and it comes out as a csv.Error in place of the row. Every parsed row comes with the byte
+    offset just after it, the resume point once it is stored.
+    """
+    def __init__(self, offset: int = 0, max_record_bytes: int = 65536):
+        self.offset = offset
+        self.max_record_bytes = max_record_bytes
+        self.buffer = b""
+        self.pending = []
+        self.pending_bytes = 0
+        self.quotes = RECORD_START
+        self.oversized = False  # the pending record is too long and is being skipped
+        self.strip_bom = offset == 0
+
+    def _add(self, line: bytes, newline: int = 1):
+        self.pending_bytes += len(line) + newline
+        self.quotes = scan_quotes(line, self.quotes)
+        if self.pending_bytes > self.max_record_bytes:
+            self.oversized, self.pending = True, []
+        elif not self.oversized:
+            self.pending.append(line)
+
+    def _end_record(self):
+        record = None if self.oversized else b"\n".join(self.pending)
+        self.offset += self.pending_bytes
+        self.pending, self.pending_bytes, self.quotes, self.oversized = [], 0, RECORD_START, False
+        return record, self.offset
+
+    def _records(self, lines):
+        records = []
+        for line in lines:
+            if not self.pending_bytes and len(line) < self.max_record_bytes and (
+                    b'"' not in line or SIMPLE_RECORD.fullmatch(line)):
+                # a whole record on one line with only well-formed quoted fields, the common case
+                self.offset += len(line) + 1
+                records.append((line, self.offset))
+                continue
+            self._add(line)
+            if not self.quotes[0]:
+                records.append(self._end_record())
+        return records
+
+    def _rows(self, records):
+        # One text per record, so a record the reader fails on does not affect the next ones
+        reader = csv.reader([record.decode("utf-8", errors="replace") for record, _ in records if record is not None])
+        rows = []
+        for record, offset in records:
+            if record is None:
+                rows.append((csv.Error(f"record longer than {self.max_record_bytes} bytes"), offset))
+                continue
+            try:
+                rows.append((next(reader), offset))
+            except csv.Error as e:
+                rows.append((e, offset))
+        return rows
+
+    def feed(self, chunk: bytes):
+        if self.strip_bom and chunk:
+            data = self.buffer + chunk
+            if len(data) < len(UTF8_BOM) and UTF8_BOM.startswith(data):
+                self.buffer = data
+                return []
+            if data.startswith(UTF8_BOM):
+                # the BOM still counts towards the byte offset
+                self.offset += len(UTF8_BOM)
+                data = data[len(UTF8_BOM):]
+            self.strip_bom = False
+            self.buffer, chunk = b"", data
+        lines = (self.buffer + chunk).split(b"\n")
+        self.buffer = lines.pop()
+        records = self._records(lines)
+        if self.pending_bytes + len(self.buffer) > self.max_record_bytes:
+            # a line without end yet: scan and skip what there is of it
+            self._add(self.buffer, newline=0)
+            self.buffer = b""
+        return self._rows(records)
+
+    def finish(self):
+        """
+        Rows of the unterminated last record, if any.
+        """
+        if not self.buffer and not self.pending_bytes:
+            return []
+        # the last line has no newline to count, and may be empty after the newline of a quoted field
+        self._add(self.buffer, newline=0)
+        self.buffer = b""
+        return self._rows([self._end_record()])
+
+
+class LabNormalizer:
+    """
+    Analyte aliases, unit conversion factors and the reference-range index, all precomputed from
+    the lab config so each row costs a few dict lookups.
+
+    Reference ranges are expanded to every (analyte, sex, age band) they cover. A range covers an
+    age band when the band lies entirely within [age_min, age_max); sex-specific ranges take
+    precedence over "*" ranges.
+    """
+    def __init__(self, config: dict):
+        self.bands = config.get("age_bands", [0, 130])
+        self.aliases = {}
+        self.units = {}
+        self.factors = {}
+        self.ranges = {}
+        for name, analyte in config.get("analytes", {}).items():
+            for alias in [name, *analyte.get("aliases", [])]:
+                self.aliases[alias.strip().lower()] = name
+            self.units[name] = analyte["unit"]
+            self.factors[(name, analyte["unit"].lower())] = 1.0
+            for unit, factor in analyte.get("conversions", {}).items():
+                self.factors[(name, unit.lower())] = float(factor)
+            for reference in sorted(analyte.get("ranges", []), key=lambda reference: reference["sex"] == "*"):
+                sexes = SEXES if reference["sex"] == "*" else (reference["sex"].upper(),)
+                for band in range(len(self.bands) - 1):
+                    if reference["age_min"] <= self.bands[band] and self.bands[band + 1] <= reference["age_max"]:
+                        for sex in sexes:
+                            self.ranges.setdefault((name, sex, band), (reference["low"], reference["high"]))
+
+    def reference_range(self, analyte: str, sex: str, age: float):
+        band = bisect.bisect_right(self.bands, age) - 1
+        if band < 0 or band >= len(self.bands) - 1:
+            return None
+        return self.ranges.get((analyte, sex, band))
+
+    def normalize(self, row, positions) -> dict:
+        """
+        Turn one CSV row into a lab_results row; raises ValueError with the reason if it is unusable.
+        """
+        patient_ref, sex, age, analyte_name, value, unit, collected_at = (row[i].strip() for i in positions)
+        analyte = self.aliases.get(analyte_name.lower())
+        if analyte is None:
+            raise ValueError(f"unknown analyte {analyte_name!r}")
+        factor = self.factors.get((analyte, unit.lower()))
+        if factor is None:
+            raise ValueError(f"unknown unit {unit!r} for {analyte}")
+        if not patient_ref:
+            raise ValueError("missing patient id")
+        value = float(value) * factor
+        if not math.isfinite(value):
+            raise ValueError(f"value {value} is not a number")
+
+        reference = self.reference_range(analyte, sex[:1].upper(), float(age)) if sex and age else None
+        low, high = reference if reference else (None, None)
+        if collected_at:
+            collected_at = datetime.fromisoformat(collected_at)
+            if collected_at.tzinfo is None:
+                collected_at = collected_at.replace(tzinfo=timezone.utc)
+        return {
+            "patient_ref": patient_ref,
+            "analyte": analyte,
+            "value": value,
+            "unit": self.units[analyte],
+            "reference_low": low,
+            "reference_high": high,
+            "flag": None if reference is None else "L" if value < low else "H" if value > high else "N",
+            "collected_at": collected_at or None,
+        }
+
+
+def column_positions(header, columns: dict):
+    index = {name.strip().lower(): i for i, name in enumerate(header)}
+    missing = [columns.get(field, field) for field in ROW_FIELDS if columns.get(field, field).lower() not in index]
+    if missing:
+        raise LabImportError(f"CSV is missing columns: {', '.join(missing)}")
+    return tuple(index[columns.get(field, field).lower()] for field in ROW_FIELDS)
+
+
+lab_config = load_lab_config()
+lab_normalizer = LabNormalizer(lab_config)
+BATCH_ROWS = int(lab_config.get("batch_rows", 5000))
+STALE_IMPORT_SECONDS = int(lab_config.get("stale_import_seconds", 120))
+MAX_ERRORS_LOGGED = int(lab_config.get("max_errors_logged", 20))
+MAX_RECORD_BYTES = int(lab_config.get("max_record_bytes", 65536))
+
+
+async def claim_import(session_maker, import_key: str, total_bytes):
+    """
+    Create the import or take over an unfinished one. Returns its row, or raises if another
+    upload of the same import is still active.
+    """
+    async with session_maker() as session:
+        stmt = insert_ignoring_conflicts(session, lab_imports, [lab_imports.c.import_key])
+        await session.execute(stmt.values(import_key=import_key, status="new", total_bytes=total_bytes))
+        await session.commit()
+
+        stale_before = datetime.now(timezone.utc) - timedelta(seconds=STALE_IMPORT_SECONDS)
+        claimed = (await session.execute(
+            update(lab_imports)
+            .where(
+                lab_imports.c.import_key == import_key,
+                lab_imports.c.status != "completed",
+                or_(lab_imports.c.status != "running", lab_imports.c.updated_at < stale_before),
+            )
+            .values(status="running", last_error=None, updated_at=func.now(),
+                    total_bytes=func.coalesce(total_bytes, lab_imports.c.total_bytes))
+            .returning(*lab_imports.c)
+        )).mappings().first()
+        await session.commit()
+        if claimed is not None:
+            return dict(claimed)
+
+        existing = (await session.execute(
+            select(*lab_imports.c).where(lab_imports.c.import_key == import_key)
+        )).mappings().one()
+    if existing["status"] == "completed":
+        return dict(existing)
+    raise LabImportError("Another upload of this import is in progress", status_code=409)
+
+
+async def commit_batch(session_maker, import_id: int, batch, **progress):
+    session = session_maker()
+    statements = []
+    if batch:
+        statements.append((insert_ignoring_conflicts(session, lab_results, [lab_results.c.import_id, lab_results.c.row_number]), batch))
+    statements.append(update(lab_imports).where(lab_imports.c.id == import_id).values(updated_at=func.now(), **progress))
+    result = await execute_in_transaction(session, *statements)
+    if isinstance(result, str):
+        raise LabImportError(result, status_code=500)
+
+
+async def import_lab_csv(import_key: str, chunks, offset: int = 0, total_bytes=None) -> dict:
+    """
+    Import a partner lab CSV from an async iterator of byte chunks.
+
+    :param offset: 0 when chunks is the whole file, or the bytes_committed of an earlier attempt
+        when it is only the rest of the file.
+    :return: The final state of the import.
+    """
+    session_maker = await get_session_for_database()
+    record = await claim_import(session_maker, import_key, total_bytes)
+    if record["status"] == "completed":
+        return await read_import(import_key)
+    import_id = record["id"]
+
+    if offset not in (0, record["bytes_committed"]):
+        await commit_batch(session_maker, import_id, [], status="failed",
+                           last_error=f"offset {offset} is not the committed byte offset {record['bytes_committed']}")
+        raise LabImportError(f"Resume from offset 0 or {record['bytes_committed']}", status_code=416)
+    header = json.loads(record["columns"]) if offset else None
+    positions = column_positions(header, lab_config.get("columns", {})) if header else None
+    # A full re-upload skips the rows an earlier attempt already stored
+    skip_until = 0 if offset else record["rows_committed"]
+    row_number = record["rows_committed"] if offset else 0
+    rejected = record["rows_rejected"]
+    committed_bytes = record["bytes_committed"]
+
+    parser = IncrementalCSVParser(offset, MAX_RECORD_BYTES)
+    batch = []
+    last_commit = time.monotonic()
+    live = active_imports[import_id] = {"bytes_received": offset, "rows_parsed": row_number, "started": time.time()}
+
+    def consume(rows):
+        nonlocal header, positions, row_number, rejected, committed_bytes
+        for row, end_offset in rows:
+            # An unreadable record comes as the csv.Error raised for it
+            unreadable = isinstance(row, csv.Error)
+            if header is None:
+                if unreadable:
+                    raise LabImportError(f"Unreadable CSV header: {row}")
+                header = row
+                positions = column_positions(header, lab_config.get("columns", {}))
+            elif unreadable or (row and any(field.strip() for field in row)):
+                row_number += 1
+                if row_number > skip_until:
+                    try:
+                        if unreadable:
+                            raise row
+                        batch.append({"import_id": import_id, "row_number": row_number,
+                                      **lab_normalizer.normalize(row, positions)})
+                    except (ValueError, IndexError, csv.Error) as e:
+                        rejected += 1
+                        if rejected <= MAX_ERRORS_LOGGED:
+                            logging.warning(f"Lab import {import_key} row {row_number} rejected: {e}")
+            committed_bytes = end_offset
+
+    def progress(status):
+        if row_number < skip_until:
+            # still skipping stored rows, keep the resume point of the earlier attempt
+            return {"status": status}
+        return {"rows_committed": row_number, "bytes_committed": committed_bytes, "rows_rejected": rejected,
+                "columns": json.dumps(header) if header is not None else None, "status": status}
+
+    try:
+        async for chunk in chunks:
+            live["bytes_received"] += len(chunk)
+            consume(parser.feed(chunk))
+            live["rows_parsed"] = row_number
+            # A commit doubles as the heartbeat that keeps other uploads from taking the import over
+            if len(batch) >= BATCH_ROWS or time.monotonic() - last_commit > STALE_IMPORT_SECONDS / 4:
+                await commit_batch(session_maker, import_id, batch, **progress("running"))
+                batch.clear()
+                last_commit = time.monotonic()
+        consume(parser.finish())
+        if header is None:
+            raise LabImportError("The upload is empty")
+        await commit_batch(session_maker, import_id, batch, **progress("completed"))
+    except Exception as e:
+        if isinstance(e, LabImportError):
+            logging.warning(f"Lab import {import_key} rejected after row {row_number}: {e}")
+        else:
+            logging.exception(f"Lab import {import_key} stopped after row {row_number}: {e}")
+        try:
+            await commit_batch(session_maker, import_id, [], status="failed", last_error=str(e)[:1000])
+        except Exception:
+            logging.exception(f"Could not mark lab import {import_key} as failed")
+        if isinstance(e, LabImportError):
+            raise
+        raise LabImportError(f"Import stopped after row {row_number}: {e}", status_code=500)
+    finally:
+        active_imports.pop(import_id, None)
+
+    return await read_import(import_key)
+
+
+async def read_import(import_key: str):
+    session_maker = await get_session_for_database()
+    async with session_maker() as session:
+        record = (await session.execute(
+            select(*lab_imports.c).where(lab_imports.c.import_key == import_key)
+        )).mappings().first()
+    if record is None:
+        return None
+    record = dict(record)
+    record.pop("columns", None)
+    live = active_imports.get(record["id"])
+    if live:
+        record.update({"bytes_received": live["bytes_received"], "rows_parsed": live["rows_parsed"],
+                       "rows_per_second": round(live["rows_parsed"] / max(time.time() - live["started"], 1e-6), 1)})
+    if record.get("total_bytes"):
+        record["percent"] = round(100 * record.get("bytes_received", record["bytes_committed"]) / record["total_bytes"], 1)
+    return record
@@ -1,34 +1,136 @@
 """
 This file contains function to suspect IP's and remove suspected IP's
 """
-import asyncio
+import asyncio, heapq, logging, time
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from datetime import datetime, timedelta
+from backend.core import tracing
+from backend.limiter_storage import SQLITE_SCHEME, SharedSuspensionStore, sqlite_path_from_uri
+import backend.global_variables as configs
 
-limiter = Limiter(key_func=get_remote_address)
+if not configs.RATE_LIMITER_CONFIG:
+    configs.load_configs()
 
-# Create a dictionary to track suspended IPs and the suspension end time.
-suspended_ips = {}
+# "memory://" keeps limits per worker, "sqlite:///path" shares them between all workers on the host
+STORAGE_URI = configs.RATE_LIMITER_CONFIG.get("storage_uri", "memory://")
+
+
+
+class TracedLimiter(Limiter):
+    """
+    Limiter that adds the time of each limit check to the request trace as "rate_limit".
+    """
+    def _check_request_limit(self, *args, **kwargs):
+        with tracing.span("rate_limit"):
+            return super()._check_request_limit(*args, **kwargs)
+
+
+limiter = TracedLimiter(key_func=get_remote_address, storage_uri=STORAGE_URI)
+
+DEFAULT_RATE_LIMIT = "90/minute"
+
+
+def rate_limit(name: str):
+    """
+    Return a limit provider for @limiter.limit that reads rate_limiter.json[name] from the current
+    config snapshot on each request, so an edited limit applies without a restart.
+    The storage_uri is only read at startup.
+    """
+    def provider() -> str:
+        return configs.RATE_LIMITER_CONFIG.get(name, DEFAULT_RATE_LIMIT)
+    provider.__name__ = f"rate_limit_{name}"
+    return provider
 
 # Whitelisted IPs (example, add your own IPs)
 whitelisted_ips = {"127.0.0.1", "178.135.15.119", "18.133.195.17"}
 
-# A list to keep track of global tasks
-globalTasks = []
 MAX_CONNECTION_AGE = 600  # 10 minutes
+SWEEP_INTERVAL = 5  # seconds between expiry sweeps
 
 
-################################################
-# Function to suspend ip
-################################################
-async def suspend_ip(ip, suspension_period):
-    suspended_ips[ip] = datetime.now() + timedelta(seconds=suspension_period)
+class SuspensionStore:
+    """
+    Tracks suspended IPs and their suspension end time.
+
+    Suspending and looking up an IP are dict operations. Expiry is handled by a single
+    sweeper that pops a min-heap of end times, instead of one sleeping task per request.
+    A heap entry whose end time no longer matches the dict (the IP was suspended again)
+    is simply discarded when it comes up.
+    """
+    def __init__(self):
+        self.suspended_ips = {}  # ip: suspension end time
+        self.expiry_heap = []  # (suspension end time, ip)
+        self.sweeps = 0
+        self.expired_total = 0
+        self.last_sweep_expired = 0
+        self.last_sweep_seconds = 0.0
+
+    def suspend(self, ip, suspension_period):
+        end_time = datetime.now() + timedelta(seconds=suspension_period)
+        self.suspended_ips[ip] = end_time
+        heapq.heappush(self.expiry_heap, (end_time, ip))
+        return end_time
+
+    def is_suspended(self, ip, now=None):
+        end_time = self.suspended_ips.get(ip)
+        if end_time is None:
+            return False
+        # An entry past its end time is expired even if the sweeper has not reached it yet
+        return end_time > (now or datetime.now())
+
+    def __contains__(self, ip):
+        return self.is_suspended(ip)
+
+    def __len__(self):
+        return len(self.suspended_ips)
+
+    def sweep(self, now=None):
+        """
+        Remove every suspension whose end time has passed and return how many were removed.
+        """
+        start = time.perf_counter()
+        now = now or datetime.now()
+        expired = 0
+        while self.expiry_heap and self.expiry_heap[0][0] <= now:
+            end_time, ip = heapq.heappop(self.expiry_heap)
+            if self.suspended_ips.get(ip) == end_time:
+                del self.suspended_ips[ip]
+                expired += 1
+
+        self.sweeps += 1
+        self.expired_total += expired
+        self.last_sweep_expired = expired
+        self.last_sweep_seconds = time.perf_counter() - start
+        return expired
+
+    async def run_sweeper(self, interval=SWEEP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.exception(f"Error sweeping suspended IPs: {e}")
+
+    def metrics(self):
+        return {
+            "suspended_ips": len(self.suspended_ips),
+            "expiry_heap_size": len(self.expiry_heap),
+            "sweeps": self.sweeps,
+            "expired_total": self.expired_total,
+            "last_sweep_expired": self.last_sweep_expired,
+            "last_sweep_seconds": self.last_sweep_seconds,
+        }
+
+
+if STORAGE_URI.startswith(SQLITE_SCHEME):
+    suspension_store = SharedSuspensionStore(sqlite_path_from_uri(STORAGE_URI))
+else:
+    suspension_store = SuspensionStore()
 
 
 ################################################
-# Function to remove suspended ip
+# Function to suspend ip
 ################################################
-async def remove_suspended_ip(ip, suspension_period):
-    await asyncio.sleep(suspension_period)
-    suspended_ips.pop(ip, None)
+async def suspend_ip(ip, suspension_period):
+    return suspension_store.suspend(ip, suspension_period)
@@ -0,0 +1,186 @@
+"""
+This file contains SQLite-backed rate limit and suspension storage shared by every worker on one host.
+
+Point storage_uri in configs/rate_limiter.json at a file, preferably on tmpfs, e.g.
+"sqlite:///dev/shm/neurobiology-limiter.db". Every uvicorn worker opens the same file, so
+rate limit counters and IP suspensions apply host-wide instead of per process.
+Each update is a single UPSERT ... RETURNING statement, which SQLite runs atomically.
+"""
+import asyncio, os, sqlite3, threading, time, logging
+from datetime import datetime
+from limits.storage import Storage
+
+SQLITE_SCHEME = "sqlite://"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS suspensions (
+    ip TEXT PRIMARY KEY,
+    end_time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS suspensions_end_time ON suspensions (end_time);
+"""
+
+
+def sqlite_path_from_uri(uri: str) -> str:
+    if not uri.startswith(SQLITE_SCHEME):
+        raise ValueError(f"Invalid sqlite storage uri: {uri}")
+    return uri[len(SQLITE_SCHEME):]
+
+
+class SharedSQLiteFile:
+    """
+    One autocommit connection per process to the shared state file.
+
+    The connection is opened lazily and re-opened after a fork, so a parent process
+    that imported the app never hands its connection to uvicorn workers.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # The state is disposable, losing the last writes on power loss is fine
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def execute(self, sql: str, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchone()
+
+    def execute_rowcount(self, sql: str, params=()) -> int:
+        with self.lock:
+            return self.connection.execute(sql, params).rowcount
+
+
+class SQLiteStorage(Storage):
+    """
+    limits storage backend for the fixed-window strategy slowapi uses by default.
+    """
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.shared_file = SharedSQLiteFile(sqlite_path_from_uri(uri))
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        now = time.time()
+        row = self.shared_file.execute(
+            """
+            INSERT INTO rate_limits (key, count, expires_at) VALUES (:key, :amount, :expires_at)
+            ON CONFLICT (key) DO UPDATE SET
+                count = CASE WHEN rate_limits.expires_at <= :now THEN excluded.count
+                             ELSE rate_limits.count + excluded.count END,
+                expires_at = CASE WHEN rate_limits.expires_at <= :now OR :elastic THEN excluded.expires_at
+                                  ELSE rate_limits.expires_at END
+            RETURNING count
+            """,
+            {"key": key, "amount": amount, "expires_at": now + expiry, "now": now, "elastic": elastic_expiry},
+        )
+        return row[0]
+
+    def get(self, key: str) -> int:
+        row = self.shared_file.execute(
+            "SELECT count FROM rate_limits WHERE key = ? AND expires_at > ?", (key, time.time())
+        )
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        row = self.shared_file.execute("SELECT expires_at FROM rate_limits WHERE key = ?", (key,))
+        return row[0] if row else time.time()
+
+    def check(self) -> bool:
+        try:
+            self.shared_file.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> int:
+        return self.shared_file.execute_rowcount("DELETE FROM rate_limits")
+
+    def clear(self, key: str) -> None:
+        self.shared_file.execute_rowcount("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+
+class SharedSuspensionStore:
+    """
+    Host-wide counterpart of limiter.SuspensionStore with the same interface.
+
+    Lookups are a primary-key read; the sweeper deletes expired rows with one indexed
+    range delete, and whichever worker runs it first does the work for everyone.
+    """
+    def __init__(self, path: str):
+        self.shared_file = SharedSQLiteFile(path)
+        self.sweeps = 0
+        self.expired_total = 0
+        self.last_sweep_expired = 0
+        self.last_sweep_seconds = 0.0
+
+    def suspend(self, ip, suspension_period):
+        end_time = time.time() + suspension_period
+        self.shared_file.execute(
+            """
+            INSERT INTO suspensions (ip, end_time) VALUES (?, ?)
+            ON CONFLICT (ip) DO UPDATE SET end_time = excluded.end_time
+            """,
+            (ip, end_time),
+        )
+        return datetime.fromtimestamp(end_time)
+
+    def is_suspended(self, ip, now=None):
+        now = now.timestamp() if now else time.time()
+        return self.shared_file.execute(
+            "SELECT 1 FROM suspensions WHERE ip = ? AND end_time > ?", (ip, now)
+        ) is not None
+
+    def __contains__(self, ip):
+        return self.is_suspended(ip)
+
+    def __len__(self):
+        return self.shared_file.execute("SELECT count(*) FROM suspensions")[0]
+
+    def sweep(self, now=None):
+        start = time.perf_counter()
+        now = now.timestamp() if now else time.time()
+        expired = self.shared_file.execute_rowcount("DELETE FROM suspensions WHERE end_time <= ?", (now,))
+
+        self.sweeps += 1
+        self.expired_total += expired
+        self.last_sweep_expired = expired
+        self.last_sweep_seconds = time.perf_counter() - start
+        return expired
+
+    async def run_sweeper(self, interval=5):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.exception(f"Error sweeping suspended IPs: {e}")
+
+    def metrics(self):
+        return {
+            "suspended_ips": len(self),
+            "sweeps": self.sweeps,
+            "expired_total": self.expired_total,
+            "last_sweep_expired": self.last_sweep_expired,
+            "last_sweep_seconds": self.last_sweep_seconds,
+        }
@@ -0,0 +1,132 @@
+"""
+This file contains the SMTP side of email delivery: the settings from the SMTP_* environment
+variables, persistent SMTP connections that send a batch of messages per session, and the
+classification of SMTP errors into transient and permanent ones.
+
+Emails are queued as jobs and sent by the job workers (backend/jobs/handlers.py), which batch the
+email jobs they run together over a few of these connections; the jobs queue does the retrying.
+"""
+import os, smtplib, time
+from email.message import EmailMessage
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SMTP_HOST = os.getenv("SMTP_HOST")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true") == "true"
+FROM_EMAIL = os.getenv("FROM_EMAIL", SMTP_USER)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    4xx replies and dropped connections are worth retrying, 5xx replies are not.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, OSError)
+
+
+class SMTPConnection:
+    """
+    One persistent SMTP connection, only ever used from a single mailer thread at a time.
+    """
+    def __init__(self, host, port, user=None, password=None, use_tls=True, idle_timeout=60, metrics=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self.idle_timeout = idle_timeout
+        self.metrics = metrics if metrics is not None else {}
+        self.smtp = None
+        self.last_used = 0.0
+
+    def connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.use_tls:
+            smtp.starttls()
+        if self.user:
+            smtp.login(self.user, self.password)
+        self.smtp = smtp
+        self.metrics["connections_opened"] = self.metrics.get("connections_opened", 0) + 1
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                self.smtp.close()
+            self.smtp = None
+
+    def send_batch(self, messages):
+        """
+        Send every message over this connection and return a list of (message, error) failures.
+        """
+        # Servers drop idle sessions, reconnect rather than find out on the first send
+        if self.smtp is not None and time.monotonic() - self.last_used > self.idle_timeout:
+            self.close()
+
+        failures = []
+        for message in messages:
+            try:
+                if self.smtp is None:
+                    self.connect()
+                self.smtp.send_message(message)
+            except smtplib.SMTPResponseException as e:
+                failures.append((message, e))
+                # The session is still usable, clear the failed transaction
+                try:
+                    self.smtp.rset()
+                except Exception:
+                    self.close()
+            except (smtplib.SMTPException, OSError) as e:
+                failures.append((message, e))
+                self.close()
+        self.last_used = time.monotonic()
+        return failures
+
+
+class Mailer:
+    """
+    SMTP settings, delivery counters and message building shared by the email job handler.
+    """
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, user=SMTP_USER, password=SMTP_PASSWORD,
+                 from_email=FROM_EMAIL, use_tls=SMTP_USE_TLS, idle_timeout=60):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.from_email = from_email
+        self.use_tls = use_tls
+        self.idle_timeout = idle_timeout
+        self.metrics = {
+            "sent": 0,
+            "failed": 0,
+            "batches": 0,
+            "connections_opened": 0,
+        }
+
+    def build_message(self, to_email: str, subject: str, body: str) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = self.from_email
+        message["To"] = to_email
+        message["Subject"] = subject
+        message.set_content(body)
+        return message
+
+    def stats(self) -> dict:
+        return dict(self.metrics)
+
+
+_mailer = None
+
+def get_mailer() -> Mailer:
+    global _mailer
+    if _mailer is None:
+        _mailer = Mailer()
+    return _mailer
@@ -0,0 +1,98 @@
+"""
+This file contains a minimal local SMTP server that accepts and keeps every message.
+
+It is meant for tests and local development, pointed at by SMTP_HOST/SMTP_PORT with
+SMTP_USE_TLS=false and no SMTP_USER. It speaks just enough SMTP for smtplib (no STARTTLS
+or AUTH) and can be told to answer the next DATA commands with a given reply, to exercise
+retry handling.
+
+Run standalone:
+    python -m backend.mail.smtp_sink [port]
+"""
+import asyncio, email, logging, sys
+
+
+class SMTPSink:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.messages = []  # email.message.Message objects, in arrival order
+        self.connections = 0
+        self.failure_replies = []  # replies returned for the next DATA commands instead of 250
+
+    def fail_next(self, reply: str = "451 Try again later", times: int = 1):
+        self.failure_replies.extend([reply] * times)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+
+        async def reply(line: str):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 smtp-sink ready")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip().upper()
+
+                if command.startswith("EHLO"):
+                    await reply("250-smtp-sink\r\n250 8BITMIME")
+                elif command.startswith(("HELO", "MAIL", "RCPT", "RSET", "NOOP")):
+                    await reply("250 OK")
+                elif command == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    lines = []
+                    while True:
+                        data_line = await reader.readline()
+                        if data_line in (b".\r\n", b".\n", b""):
+                            break
+                        # Undo dot-stuffing
+                        lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                    if self.failure_replies:
+                        await reply(self.failure_replies.pop(0))
+                    else:
+                        self.messages.append(email.message_from_bytes(b"".join(lines)))
+                        await reply("250 OK")
+                elif command == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        finally:
+            writer.close()
+
+
+async def main(port: int):
+    async with SMTPSink(port=port) as sink:
+        logging.info(f"SMTP sink listening on {sink.host}:{sink.port}")
+        while True:
+            count = len(sink.messages)
+            await asyncio.sleep(1)
+            for message in sink.messages[count:]:
+                logging.info(f"Received email to {message['To']}: {message['Subject']}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1025))
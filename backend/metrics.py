@@ -0,0 +1,118 @@
+"""
+This file contains a small in-process metrics registry rendered in the Prometheus text format.
+
+Histograms keep one list of bucket counts per label set, so an observation is a bisect and
+a few integer additions. Collectors are callables returning a flat dict of numbers, read
+only when /metrics is scraped.
+"""
+import bisect, math
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+_collectors = []
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.label_names, label_values)} {value}"
+
+
+class Gauge:
+    """
+    Gauge whose value is read from a callable at scrape time.
+    """
+    def __init__(self, name: str, help_text: str, read_value):
+        self.name = name
+        self.help_text = help_text
+        self.read_value = read_value
+        _metrics.append(self)
+
+    def render(self):
+        try:
+            value = self.read_value()
+        except Exception:
+            return
+        if value is None:
+            return
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values: [bucket counts..., +Inf count, sum]
+        _metrics.append(self)
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), series):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                bucket_labels = _format_labels(self.label_names, label_values, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            labels = _format_labels(self.label_names, label_values)
+            yield f"{self.name}_sum{labels} {series[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def register_collector(prefix: str, collect):
+    """
+    Export every numeric value of the dict returned by collect() as the gauge <prefix>_<key>.
+    """
+    _collectors.append((prefix, collect))
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for prefix, collect in _collectors:
+        try:
+            values = collect()
+        except Exception:
+            continue
+        for key, value in values.items():
+            if isinstance(value, (bool, int, float)):
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {float(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,102 @@
+"""This FastAPI file defines the wearable ingestion endpoints. Devices upload batches of heart-rate,
+accelerometer and SpO2 samples as packed binary records or NDJSON, and get back the sequence number
+up to which their data is durably stored."""
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
+from backend.core.security import current_user_id
+from backend.device_ingest import (PayloadError, device_config, parse_binary, parse_ndjson,
+                                   sample_buffer, sample_validator)
+from backend.database.timeseries import DEFAULT_MAX_POINTS, get_timeseries_store
+
+router = APIRouter()
+
+MAX_BATCH_SAMPLES = int(device_config.get("max_batch_samples", 100000))
+MAX_BODY_BYTES = int(device_config.get("max_body_bytes", 4194304))
+METRIC_CODES = {name: metric["code"] for name, metric in device_config.get("metrics", {}).items()}
+
+
+async def read_body(request: Request, limit: int) -> bytes:
+    """
+    Read the request body, failing with 413 as soon as it grows past limit bytes. A declared
+    Content-Length is checked before anything is read; chunked bodies are counted as they arrive.
+    """
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > limit:
+        raise HTTPException(status_code=413, detail=f"Payloads are limited to {limit} bytes")
+    pieces, size = [], 0
+    async for piece in request.stream():
+        size += len(piece)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=f"Payloads are limited to {limit} bytes")
+        pieces.append(piece)
+    return b"".join(pieces)
+
+
+# Sample upload endpoint
+@router.post("/devices/{device_id}/samples")
+async def upload_samples(request: Request, device_id: str, seq: int = Query(..., ge=0),
+                         user_id: int = Depends(current_user_id)):
+    if sample_buffer.full:
+        raise HTTPException(status_code=503, detail="Ingestion buffer is full. Retry later.")
+
+    content_type = request.headers.get("content-type", "")
+    body = await read_body(request, MAX_BODY_BYTES)
+    try:
+        if content_type.startswith("application/octet-stream"):
+            metric, ts_ms, value = parse_binary(body)
+        elif content_type.startswith(("application/x-ndjson", "application/jsonl")):
+            metric, ts_ms, value = parse_ndjson(body)
+        else:
+            raise HTTPException(status_code=415, detail="Use application/octet-stream or application/x-ndjson")
+    except PayloadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if len(metric) > MAX_BATCH_SAMPLES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_SAMPLES} samples per batch")
+
+    valid = sample_validator.valid_mask(metric, ts_ms, value)
+    accepted = int(np.count_nonzero(valid))
+    if accepted < len(valid):
+        metric, ts_ms, value = metric[valid], ts_ms[valid], value[valid]
+
+    is_new = await sample_buffer.add(user_id, device_id, seq, metric, ts_ms, value, rejected=len(valid) - accepted)
+    # As seen by this worker; clients resume from GET /devices/{device_id}/cursor, which reads the database
+    committed_seq = await sample_buffer.known_committed_seq(user_id, device_id)
+    return JSONResponse(
+        status_code=202,
+        content={
+            "seq": seq,
+            "duplicate": not is_new,
+            "accepted": accepted if is_new else 0,
+            "rejected": len(valid) - accepted if is_new else 0,
+            "committed_seq": committed_seq,
+        },
+    )
+
+
+# Resume point for a device
+@router.get("/devices/{device_id}/cursor")
+async def device_cursor(device_id: str, user_id: int = Depends(current_user_id)):
+    received_seq, committed_seq = await sample_buffer.cursor(user_id, device_id)
+    return {"received_seq": received_seq, "committed_seq": committed_seq}
+
+
+# Metric history, served from the coarsest rollup that satisfies the requested step
+@router.get("/devices/metrics/{metric}")
+async def metric_series(metric: str, start_ms: int, end_ms: int, step_seconds: float | None = None,
+                        max_points: int = Query(DEFAULT_MAX_POINTS, ge=1, le=100000),
+                        user_id: int = Depends(current_user_id)):
+    if metric not in METRIC_CODES:
+        raise HTTPException(status_code=404, detail=f"Unknown metric {metric}")
+    if end_ms <= start_ms:
+        raise HTTPException(status_code=400, detail="end_ms must be after start_ms")
+
+    store = await get_timeseries_store()
+    series = await store.read_series(user_id, METRIC_CODES[metric], start_ms, end_ms, step_seconds, max_points)
+    return {
+        "metric": metric,
+        "resolution_seconds": series["resolution"],
+        **{key: series[key].tolist() for key in ("ts_ms", "count", "mean", "min", "max")},
+    }
@@ -0,0 +1,30 @@
+"""This FastAPI file defines the partner lab import endpoints. Labs stream large CSV exports of
+results, which are normalized and stored in batches; an interrupted import is resumed with the same
+import key, and its progress can be polled while it runs."""
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from backend.core.security import require_microservice_token
+from backend.lab_import import LabImportError, import_lab_csv, read_import
+
+router = APIRouter()
+
+
+# Streaming CSV import; offset is 0 for the whole file or the bytes_committed of an earlier attempt
+@router.post("/labs/imports", dependencies=[Depends(require_microservice_token)])
+async def import_lab_results(request: Request, import_key: str = Query(..., min_length=1, max_length=200),
+                             offset: int = Query(0, ge=0)):
+    content_length = request.headers.get("content-length")
+    total_bytes = offset + int(content_length) if content_length and content_length.isdigit() else None
+    try:
+        return await import_lab_csv(import_key, request.stream(), offset, total_bytes)
+    except LabImportError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+# Progress of an import: committed rows and bytes, plus live counters while it runs in this worker
+@router.get("/labs/imports/{import_key}", dependencies=[Depends(require_microservice_token)])
+async def lab_import_progress(import_key: str):
+    record = await read_import(import_key)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return record
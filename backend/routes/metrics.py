@@ -0,0 +1,15 @@
+"""This FastAPI file exposes the in-process metrics in the Prometheus text format. The metrics include
+SQL fingerprints, pool internals and per-route data, so scrapers must send the microservice token
+(x-microservice-token header)."""
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from backend.core.security import require_microservice_token
+from backend.metrics import render_metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", dependencies=[Depends(require_microservice_token)])
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,195 @@
+"""This FastAPI file defines the health report endpoints. Reports are rendered while their data is read:
+rollup rows are streamed from the database in chunks, fed to an async Jinja template (HTML) or a CSV
+writer, and sent out through a StreamingResponse as they are produced, so a year-long report is never
+held in memory and the first bytes go out before the first query returns."""
+
+import csv, io, logging, os, time
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from sqlalchemy import select
+from backend.core import tracing
+from backend.core.security import current_user_id
+from backend.database.db_pool_manager import get_session_for_database
+from backend.database.database_query_functions import stream_query
+from backend.database.models import device_metric_rollups
+from backend.device_ingest import device_config
+from backend.global_functions import get_jinja_env
+from backend.global_variables import TEMPLATES_FOLDER_NAME
+from backend.jobs.queue import enqueue, job_status, load_jobs_config
+
+router = APIRouter()
+
+RESOLUTIONS = {"hourly": 3600, "daily": 86400}
+MAX_REPORT_DAYS = 400
+ROWS_PER_FETCH = 2000
+STREAM_CHUNK_BYTES = 16384
+METRICS = list(device_config.get("metrics", {}))
+METRIC_NAMES = {metric["code"]: name for name, metric in device_config.get("metrics", {}).items()}
+
+# Shared env from the registry, so each template is compiled once and then served from its caches
+report_env = get_jinja_env([f"{TEMPLATES_FOLDER_NAME}/reports"], enable_async=True, autoescape=True)
+
+
+def report_path(user_id: int, job_id: int) -> str:
+    """
+    File a report export job writes to, under jobs.json reports_dir.
+    """
+    return os.path.join(load_jobs_config().get("reports_dir", "./data/reports"), str(user_id), f"{job_id}.csv")
+
+
+def validate_range(start_ms: int, end_ms: int):
+    if end_ms <= start_ms:
+        raise HTTPException(status_code=400, detail="end_ms must be after start_ms")
+    if end_ms - start_ms > MAX_REPORT_DAYS * 86_400_000:
+        raise HTTPException(status_code=400, detail=f"Reports cover at most {MAX_REPORT_DAYS} days")
+
+
+def period_label(bucket_start: int, resolution: int) -> str:
+    moment = datetime.fromtimestamp(bucket_start / 1000, tz=timezone.utc)
+    return moment.strftime("%Y-%m-%d %H:00" if resolution < 86400 else "%Y-%m-%d")
+
+
+async def report_periods(user_id: int, resolution: int, start_ms: int, end_ms: int):
+    """
+    Yield one dict per period with the rollups of every metric under readings, reading ROWS_PER_FETCH rows at a time.
+    """
+    table = device_metric_rollups
+    statement = select(
+        table.c.bucket_start, table.c.metric, table.c.sample_count, table.c.value_sum, table.c.value_min, table.c.value_max,
+    ).where(
+        table.c.user_id == user_id,
+        table.c.resolution == resolution,
+        table.c.bucket_start >= start_ms // (resolution * 1000) * (resolution * 1000),
+        table.c.bucket_start < end_ms,
+    ).order_by(table.c.bucket_start, table.c.metric)
+
+    session_maker = await get_session_for_database()
+    period = None
+    async for rows in stream_query(session_maker(), statement, chunk_size=ROWS_PER_FETCH):
+        for bucket_start, metric, count, total, low, high in rows:
+            if period is None or period["bucket_start"] != bucket_start:
+                if period is not None:
+                    yield period
+                period = {"bucket_start": bucket_start, "label": period_label(bucket_start, resolution), "readings": {}}
+            period["readings"][METRIC_NAMES.get(metric, str(metric))] = {
+                "mean": total / max(count, 1), "min": low, "max": high, "count": count,
+            }
+    if period is not None:
+        yield period
+
+
+async def csv_pieces(periods):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["period"] + [f"{metric}_{column}" for metric in METRICS for column in ("mean", "min", "max", "count")])
+    # The header goes out before the first query is run
+    yield output.getvalue()
+    output.seek(0)
+    output.truncate()
+    async for period in periods:
+        row = [period["label"]]
+        for metric in METRICS:
+            values = period["readings"].get(metric)
+            row += [round(values["mean"], 3), values["min"], values["max"], values["count"]] if values else ["", "", "", ""]
+        writer.writerow(row)
+        # Hand over what was written so far; the buffer never grows past one row
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    if output.tell():
+        yield output.getvalue()
+
+
+async def encoded_chunks(pieces, periods):
+    """
+    Join rendered pieces into chunks of about STREAM_CHUNK_BYTES. The first piece is sent on its
+    own, so the client gets its first byte before any report data has been read. The time spent
+    producing pieces (not sending them) goes to the request trace as "render".
+    """
+    buffer, size, first = [], 0, True
+    render_seconds, started = 0.0, time.perf_counter()
+    try:
+        async for piece in pieces:
+            render_seconds += time.perf_counter() - started
+            if first:
+                first = False
+                yield piece.encode()
+            else:
+                buffer.append(piece)
+                size += len(piece)
+                if size >= STREAM_CHUNK_BYTES:
+                    yield "".join(buffer).encode()
+                    buffer, size = [], 0
+            started = time.perf_counter()
+        if buffer:
+            yield "".join(buffer).encode()
+    except Exception as e:
+        # Headers are already sent: re-raising makes the server abort the response instead of
+        # ending it cleanly, so the client cannot take a cut-off report for a complete one
+        logging.exception(f"Error while streaming a report: {e}")
+        raise
+    finally:
+        tracing.record("render", render_seconds)
+        # Releases the database session if the client went away mid-report
+        await periods.aclose()
+
+
+# Health report endpoint
+@router.get("/reports/health")
+async def health_report(start_ms: int, end_ms: int,
+                        resolution: str = Query("daily", pattern="^(hourly|daily)$"),
+                        output: str = Query("html", alias="format", pattern="^(html|csv)$"),
+                        user_id: int = Depends(current_user_id)):
+    validate_range(start_ms, end_ms)
+
+    resolution_seconds = RESOLUTIONS[resolution]
+    periods = report_periods(user_id, resolution_seconds, start_ms, end_ms)
+    start, end = (datetime.fromtimestamp(ms / 1000, tz=timezone.utc).date().isoformat() for ms in (start_ms, end_ms))
+
+    if output == "csv":
+        return StreamingResponse(
+            encoded_chunks(csv_pieces(periods), periods),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="health_report_{start}_{end}.csv"'},
+        )
+
+    template = report_env.get_template("health_report.html")
+    pieces = template.generate_async(
+        periods=periods, metrics=METRICS, start=start, end=end,
+        resolution_name="hour" if resolution == "hourly" else "day",
+    )
+    return StreamingResponse(encoded_chunks(pieces, periods), media_type="text/html; charset=utf-8")
+
+
+# Report export endpoints: the CSV is rendered by a job worker, off the request path
+@router.post("/reports/health/export", status_code=202)
+async def export_health_report(start_ms: int, end_ms: int,
+                               resolution: str = Query("daily", pattern="^(hourly|daily)$"),
+                               user_id: int = Depends(current_user_id)):
+    validate_range(start_ms, end_ms)
+    session_maker = await get_session_for_database()
+    async with session_maker() as session:
+        job_id = await enqueue(session, "reports", {
+            "user_id": user_id, "resolution": resolution, "start_ms": start_ms, "end_ms": end_ms,
+        })
+        await session.commit()
+    return {"export_id": job_id, "url": f"/reports/exports/{job_id}"}
+
+
+@router.get("/reports/exports/{export_id}")
+async def download_export(export_id: int, user_id: int = Depends(current_user_id)):
+    path = report_path(user_id, export_id)
+    if os.path.exists(path):
+        return FileResponse(path, media_type="text/csv; charset=utf-8", filename=f"health_report_{export_id}.csv")
+
+    session_maker = await get_session_for_database()
+    async with session_maker() as session:
+        status = await job_status(session, export_id)
+    # A finished job without a file belongs to another user, or its file was cleaned up
+    if status is None or status[2].get("user_id") != user_id:
+        raise HTTPException(status_code=404, detail="Export not found")
+    state, last_error, _ = status
+    if state == "failed":
+        raise HTTPException(status_code=500, detail="Export failed")
+    return JSONResponse(status_code=202, content={"status": state, "retrying": last_error is not None})
@@ -2,24 +2,20 @@
 action keys and JSON data, with database interaction, HTTP client requests, and rate limiting. """
 
 import logging, os
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from sqlalchemy import select, insert, update
+from fastapi import APIRouter, HTTPException, Request
+from sqlalchemy import select, update
 from pydantic import BaseModel, EmailStr
 from dotenv import load_dotenv
-from backend.limiter import limiter
+from backend.limiter import limiter, rate_limit
 from backend.global_functions import get_jinja_env
 
 from backend.database.db_pool_manager import get_session_for_database
+from backend.database.database_query_functions import insert_ignoring_conflicts
 from backend.database.models import users
-from backend.database.auth import hash_password, verify_password, create_access_token, create_email_token, decode_token
+from backend.database.auth import hash_password_async, verify_password_async, create_access_token, create_email_token, decode_token
+from backend.jobs.queue import enqueue
 
-import smtplib
-from email.message import EmailMessage
-import asyncio
-
-from backend.global_variables import RATE_LIMITER_CONFIG
-
-RATE_LIMIT = RATE_LIMITER_CONFIG["general_rl"]
+RATE_LIMIT = rate_limit("general_rl")
 
 env = get_jinja_env()
 
@@ -28,11 +24,6 @@ load_dotenv()
 REDIS_SERVER_PASSWORD = os.getenv("REDIS_SERVER_PASSWORD")
 VALID_MICROSERVICE_TOKEN = os.getenv("VALID_MICROSERVICE_TOKEN")
 
-SMTP_HOST = os.getenv("SMTP_HOST")
-SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
-SMTP_USER = os.getenv("SMTP_USER")
-SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-FROM_EMAIL = os.getenv("FROM_EMAIL", SMTP_USER)
 FRONTEND_VERIFY_URL = os.getenv("FRONTEND_VERIFY_URL", "/verify-email")
 
 class SessionData(BaseModel):
@@ -64,47 +55,72 @@ class LoginIn(BaseModel):
     email: EmailStr
     password: str
 
-# helper: send email (runs in background)
-def send_email_sync(to_email: str, subject: str, body: str):
-    msg = EmailMessage()
-    msg["From"] = FROM_EMAIL
-    msg["To"] = to_email
-    msg["Subject"] = subject
-    msg.set_content(body)
-
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as smtp:
-        smtp.starttls()
-        smtp.login(SMTP_USER, SMTP_PASSWORD)
-        smtp.send_message(msg)
-
-async def send_email_background(to_email: str, subject: str, body: str):
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, send_email_sync, to_email, subject, body)
-
 # Signup endpoint
 @router.post("/users/signup")
-async def signup(payload: SignupIn, background_tasks: BackgroundTasks):
+async def signup(payload: SignupIn):
+    # hash before checking out a connection, so bcrypt time is not spent holding one
+    hashed = await hash_password_async(payload.password)
+
     session_maker = await get_session_for_database()
     async with session_maker() as session:
-
-        # check if user exists
-        get_user_query = select(users.c.id).where(users.c.email == payload.email)
-        get_user_query_response = await session.execute(get_user_query)
-
-        return get_user_query_response
-        if r.first():
+        # one round trip: an existing email makes RETURNING come back empty
+        stmt = (
+            insert_ignoring_conflicts(session, users, [users.c.email])
+            .values(email=payload.email, hashed_password=hashed, full_name=payload.full_name)
+            .returning(users.c.id)
+        )
+        user_id = (await session.execute(stmt)).scalar_one_or_none()
+        if user_id is None:
             raise HTTPException(status_code=400, detail="Email already registered")
 
-        hashed = hash_password(payload.password)
-        stmt = insert(users).values(email=payload.email, hashed_password=hashed, full_name=payload.full_name)
-        result = await session.execute(stmt)
         # build verification token
-        user_id = (await session.execute(select(users.c.id).where(users.c.email == payload.email))).scalar_one()
         token = create_email_token({"sub": str(user_id), "email": payload.email})
         verify_link = f"{FRONTEND_VERIFY_URL}?token={token}"
 
         subject = "Verify your email"
         body = f"Hi,\n\nPlease verify your email by clicking the link below:\n{verify_link}\n\nIf you didn't create an account, ignore this email.\n"
-        # send in background
-        background_tasks.add_task(asyncio.create_task, send_email_background(payload.email, subject, body))
-        return {"msg": "User created. Check your email to verify account."}
\ No newline at end of file
+        # the email job commits with the user, so a worker restart can lose neither of them
+        await enqueue(session, "email", {"to": payload.email, "subject": subject, "body": body})
+        await session.commit()
+
+    return {"msg": "User created. Check your email to verify account."}
+
+# Email verification endpoint
+@router.get("/users/verify-email")
+async def verify_email(token: str):
+    payload = decode_token(token)
+    if not payload or payload.get("type") != "email_verification":
+        raise HTTPException(status_code=400, detail="Invalid or expired verification link")
+
+    session_maker = await get_session_for_database()
+    async with session_maker() as session:
+        # one round trip: only an inactive account is updated, so RETURNING is empty for reused links
+        stmt = (
+            update(users)
+            .where(users.c.id == int(payload["sub"]), users.c.email == payload["email"], users.c.is_active.is_(False))
+            .values(is_active=True)
+            .returning(users.c.id)
+        )
+        user_id = (await session.execute(stmt)).scalar_one_or_none()
+        if user_id is None:
+            raise HTTPException(status_code=400, detail="Invalid or already used verification link")
+        await session.commit()
+
+    return {"msg": "Email verified. You can now log in."}
+
+# Login endpoint
+@router.post("/users/login", response_model=TokenOut)
+@limiter.limit(RATE_LIMIT)
+async def login(request: Request, payload: LoginIn):
+    session_maker = await get_session_for_database()
+    async with session_maker() as session:
+        get_user_query = select(users.c.id, users.c.hashed_password, users.c.is_active).where(users.c.email == payload.email)
+        user = (await session.execute(get_user_query)).first()
+
+    if user is None or not await verify_password_async(payload.password, user.hashed_password):
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    if not user.is_active:
+        raise HTTPException(status_code=403, detail="Email is not verified")
+
+    token = create_access_token({"sub": str(user.id), "email": payload.email})
+    return TokenOut(access_token=token)
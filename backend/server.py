@@ -1,15 +1,23 @@
 """
 This is the main file of the backend system, connect all files and microservices here
 """
-import asyncio, json, os, logging, time, importlib, sys
+import asyncio, json, os, logging, time
+STARTUP_BEGAN = time.perf_counter()  # before the backend imports, for the startup log
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import APIRouter, FastAPI, Request, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-from time import monotonic
 from starlette.responses import JSONResponse
-from backend.limiter import (limiter, suspend_ip, suspended_ips, globalTasks, remove_suspended_ip, whitelisted_ips)
+from backend.limiter import (limiter, suspend_ip, suspension_store, whitelisted_ips)
+from backend.database.auth import shutdown_bcrypt_pool, bcrypt_pool_stats, get_token_cache
+from backend.core.security import SecurityMiddleware, SnapshotCORSMiddleware
+from backend.core import config
+from backend.core.logging_pipeline import setup_logging, should_log_event, logging_stats
+from backend.core.mounting import LazyServices, timed_import, import_profile_report, import_profile_stats
+from backend.database.db_pool_manager import warm_up_database, check_database_health, close_database
+from backend.device_ingest import sample_buffer
+from backend.metrics import register_collector
 import backend.global_variables as configs
 
 load_dotenv()
@@ -17,7 +25,6 @@ configs.load_configs()
 configName = os.getenv('SERVER_CONFIG')
 MICROSERVICES_FILE = "./configs/microservices.json"
 ROUTES_FILE = "./configs/routes.json"
-ORIGINS_FILE = "./configs/origins.json"
 MAX_CONNECTION_AGE = 600
 SUSPENSION_PERIOD = 200
 # Set a static token needed for the cronjobs
@@ -33,7 +40,7 @@ try:
     routes = []
     for module in routes_modules:
         try:
-            routes.append(importlib.import_module(module).router)
+            routes.append(timed_import(module).router)
         except Exception as e:
             logging.error(f"Failed to import {module}: {e}")
 except Exception as e:
@@ -43,51 +50,48 @@ except Exception as e:
 # end configure cron jobs
 ################################################
 
+################################################
+# Worker startup and shutdown
+################################################
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper_task = asyncio.create_task(suspension_store.run_sweeper())
+    config_watcher_task = asyncio.create_task(config.run_watcher())
+    await warm_up_database()
+    flusher_task = asyncio.create_task(sample_buffer.run_flusher())
+    preload_task = None
+    if LAZY_MICROSERVICES and configs.MISC_CONFIG.get("preload_microservices", "true") == "true":
+        # Startup is done once this function yields, so the imports run while the worker already serves
+        preload_task = asyncio.create_task(lazy_services.preload())
+    yield
+    if preload_task is not None:
+        preload_task.cancel()
+    await lazy_services.close()
+    flusher_task.cancel()
+    await sample_buffer.flush()
+    sweeper_task.cancel()
+    config_watcher_task.cancel()
+    await close_database()
+    shutdown_bcrypt_pool()
+    log_listener.stop()
+
 app = FastAPI(
     debug=configs.MISC_CONFIG.get("debug_mode", "false")=="true",
     docs_url=None, # disables Swagger UI at /docs
-    openapi_url=None # disables OpenAPI JSON at /openapi.json
+    openapi_url=None, # disables OpenAPI JSON at /openapi.json
+    lifespan=lifespan,
     )
 
 app.state.limiter = limiter
 
-# Define global log format
-LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
-
-# Remove all existing handlers (important!)
-root_logger = logging.getLogger()
-for handler in root_logger.handlers[:]:
-    root_logger.removeHandler(handler)
-
-# Apply new logging configuration globally
-logging.basicConfig(
-    level=logging.INFO,
-    format=LOG_FORMAT,
-    datefmt=DATE_FORMAT,
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
-
-# Apply the same format to Uvicorn logs
-for logger_name in ("uvicorn", "uvicorn.access", "uvicorn.error"):
-    logger = logging.getLogger(logger_name)
-    logger.handlers.clear()
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
-
-################################################
-# Array of allowed origins
-################################################
-origins = []
-try:
-    with open(ORIGINS_FILE) as f:
-        origins = json.load(f)["origins"]
-    logging.info("Allowed origins loaded successfully.")
-except Exception as e:
-    logging.exception(f"Error loading allowed origins: {e}")
+# Lazy mode mounts placeholders and imports each microservice on its first request
+LAZY_MICROSERVICES = configs.MISC_CONFIG.get("lazy_microservices", "false") == "true"
+lazy_services = LazyServices(app)
 
+# Root and uvicorn loggers write through a queue to a single stdout writer thread (configs/logging.json)
+log_listener = setup_logging()
+# slowapi warns on every exceeded limit; those lines share the rate-limited sample rate
+logging.getLogger("slowapi").addFilter(lambda record: should_log_event("rate_limited"))
 
 @app.exception_handler(Exception)
 async def generic_exception_handler(request: Request, exc: Exception):
@@ -103,8 +107,10 @@ async def generic_exception_handler(request: Request, exc: Exception):
 async def custom_rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
     start_time4 = time.time()
     ip = get_remote_address(request)
-    if ip in suspended_ips and ip not in whitelisted_ips:
-        logging.info("Suspended IP: ", ip)
+    log_this = should_log_event("rate_limited")
+    if suspension_store.is_suspended(ip) and ip not in whitelisted_ips:
+        if log_this:
+            logging.info("Suspended IP: %s", ip, extra={"ip": ip})
         response = JSONResponse(
             content={
                 "message": "IP is suspended. Try again later."
@@ -118,9 +124,9 @@ async def custom_rate_limit_exceeded_handler(request: Request, exc: RateLimitExc
             },
             status_code=429)
 
-    end_time4 = time.time()
-    total_time4 = end_time4 - start_time4
-    logging.info(f"RateLimitExceededChecking took {total_time4:.2f} seconds to process")
+    if log_this:
+        logging.info("RateLimitExceededChecking took %.4f seconds to process", time.time() - start_time4,
+                     extra={"ip": ip, "path": request.url.path})
     return response
 
 
@@ -132,52 +138,44 @@ async def http_exception_handler(request, exc):
     )
 
 
-async def close_session(session):
-    session.close()
-
 ################################################
-# Function for blocking requests and setting a limit on the number of requests per server
+# In-process state exported on /metrics
 ################################################
-@app.middleware("http")
-async def check_ip(request: Request, call_next):
-    http_method = request.method
-    request_url = str(request.url)
-    logging.info(f"client URL - {request_url}, method - {http_method}")
-    if ".env" in request_url and "assets/environment" not in request_url:
-        return JSONResponse(content={"error": "You are not allowed to see this page"}, status_code=405)
-    if ".git" in request_url:
-        return JSONResponse(content={"error": "You are not allowed to see this page"}, status_code=405)
-    if "configs" in request_url:
-        return JSONResponse(content={"error": "You are not allowed to see this page"}, status_code=405)
-    if "DB_connection" in request_url:
-        return JSONResponse(content={"error": "You are not allowed to see this page"}, status_code=405)
+register_collector("suspension_store", suspension_store.metrics)
+register_collector("token_cache", lambda: get_token_cache().stats())
+register_collector("bcrypt_pool", bcrypt_pool_stats)
+register_collector("device_ingest", sample_buffer.stats)
+register_collector("lazy_microservices", lazy_services.stats)
+register_collector("import_seconds", import_profile_stats)
+register_collector("logging", logging_stats)
+register_collector("config", lambda: {"snapshot_version": config.current().version, "files": len(config.current().files)})
 
-    ip = get_remote_address(request)
 
-    # Check if the IP is suspended
-    if ip in suspended_ips and ip not in whitelisted_ips:
-        # IP is suspended, return a custom response
-        task = asyncio.create_task(remove_suspended_ip(ip, SUSPENSION_PERIOD))
-        globalTasks.append(task)
+################################################
+# Health probe for load balancers
+################################################
+@app.get("/health")
+async def health():
+    database = await check_database_health()
+    return JSONResponse(
+        status_code=200 if database["alive"] else 503,
+        content={"database": database},
+    )
 
-        response = JSONResponse(
-            content={"message": "IP is suspended. Try again later."},
-            status_code=429)
-    else:
-        # Cancel global tasks
-        for task in globalTasks:
-            task.cancel()
-        start_time = monotonic()  # Record the start time
-        elapsed_time = monotonic() - start_time  # Calculate elapsed time
-        response = await call_next(request)
-        delta = elapsed_time
-        if delta > MAX_CONNECTION_AGE:
-            await close_session(request.state.db)
-    return response
 
+################################################
+# Middleware for blocking requests from suspended IPs and to forbidden paths
+################################################
+app.add_middleware(
+    SecurityMiddleware,
+    suspension_store=suspension_store,
+    whitelisted_ips=whitelisted_ips,
+    max_connection_age=MAX_CONNECTION_AGE,
+)
+
+# Allowed origins are read from origins.json in the current config snapshot
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
+    SnapshotCORSMiddleware,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -207,13 +205,18 @@ def mount_microservices():
     microservices = fetch_microservices(MICROSERVICES_FILE)
 
     for service in microservices:
+        prefix = f"/{{client_name}}/microservices/{service['name']}"
+        module_name = f"backend.services.{service['name']}.main"
+        if LAZY_MICROSERVICES:
+            lazy_services.mount(prefix, service["name"], module_name, service["router_variable"])
+            continue
         try:
             # Dynamically import the router variable
-            module = importlib.import_module(f"backend.services.{service['name']}.main")
+            module = timed_import(module_name)
             router: APIRouter = getattr(module, service['router_variable'])
             app.include_router(
                 router,
-                prefix=f"/{{client_name}}/microservices/{service['name']}",
+                prefix=prefix,
                 tags=[f"microservice:{service['name']}"]
             )
         except Exception as e:
@@ -239,3 +242,4 @@ try:
 except Exception as e:
     logging.error(f"Error during router fetching: {e}")
 
+logging.info(f"App built in {time.perf_counter() - STARTUP_BEGAN:.2f}s, {import_profile_report()}")
@@ -0,0 +1,307 @@
+"""
+This file contains the read-only food index used by the nutrition microservice, and the offline
+CLI that builds it.
+
+The index is a directory of flat files that are memory-mapped at load time, so loading takes
+milliseconds and all workers share the same pages:
+    nutrients.npy        float32 (foods, nutrients), per 100 g
+    names.bin            UTF-8 names back to back, name_offsets.npy int64 (foods + 1)
+    prefix_keys.npy      normalized name suffixes starting at each word, sorted, fixed width
+    prefix_foods.npy     food id of every prefix key, prefix_rank.npy its rank (whole names, then short names)
+    short_prefix_*.npy   precomputed best foods of every prefix of up to SHORT_PREFIX characters
+    trigram_keys.npy     sorted unique trigram codes, trigram_ptr.npy / trigram_foods.npy their CSR postings
+    trigram_counts.npy   number of distinct trigrams of every name
+    meta.json            nutrient names and sizes
+
+Build it from a CSV whose first column is the food name and the other columns nutrients per 100 g:
+    python -m backend.services.nutrition.food_index foods.csv ./data/nutrition_index
+"""
+import argparse, csv, json, logging, math, os, re, sys, time, unicodedata
+import numpy as np
+
+KEY_WIDTH = 32
+INDEX_VERSION = 1
+# Prefixes this short match a large part of the catalogue, their results are precomputed
+SHORT_PREFIX = 3
+SHORT_PREFIX_TOP = 50
+NOT_NAME_START = 1 << 20
+NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(name: str) -> str:
+    """
+    Lower case ASCII words separated by single spaces; accents are dropped.
+    """
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return NON_ALNUM.sub(" ", ascii_name.lower()).strip()
+
+
+def trigram_codes(normalized: str) -> np.ndarray:
+    """
+    Distinct trigrams of a normalized name as uint32 codes, padded so word starts count more.
+    """
+    padded = np.frombuffer(f"  {normalized} ".encode(), dtype=np.uint8).astype(np.uint32)
+    if len(padded) < 3:
+        return np.empty(0, np.uint32)
+    return np.unique(padded[:-2] << 16 | padded[1:-1] << 8 | padded[2:])
+
+
+################################################
+# Offline build
+################################################
+def read_foods_csv(csv_path: str):
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        names, rows = [], []
+        for row in reader:
+            if not row or not row[0].strip():
+                continue
+            names.append(row[0].strip())
+            # Missing values count as zero so meal totals stay finite
+            rows.append([float(value) if value.strip() else 0.0 for value in row[1:len(header)]])
+    return header[1:], names, np.array(rows, dtype=np.float32).reshape(len(names), len(header) - 1)
+
+
+def unique_in_order(foods):
+    _, first = np.unique(foods, return_index=True)
+    return foods[np.sort(first)]
+
+
+def short_prefix_table(keys, foods, rank):
+    """
+    Best SHORT_PREFIX_TOP distinct foods for every prefix of 1..SHORT_PREFIX characters of the
+    sorted keys, as (prefixes, (prefixes, SHORT_PREFIX_TOP) food ids padded with -1).
+    """
+    prefixes, tops = [], []
+    for length in range(1, SHORT_PREFIX + 1):
+        truncated = keys.astype(f"S{length}")
+        values, starts = np.unique(truncated, return_index=True)
+        ends = np.append(starts[1:], len(keys))
+        for value, start, end in zip(values, starts, ends):
+            if len(value) < length:
+                continue
+            ranked = foods[start:end][np.argsort(rank[start:end], kind="stable")]
+            top = unique_in_order(ranked[:SHORT_PREFIX_TOP * 8])[:SHORT_PREFIX_TOP]
+            prefixes.append(value)
+            tops.append(np.pad(top, (0, SHORT_PREFIX_TOP - len(top)), constant_values=-1))
+    order = np.argsort(np.array(prefixes, dtype=f"S{SHORT_PREFIX}"), kind="stable")
+    return (np.array(prefixes, dtype=f"S{SHORT_PREFIX}")[order],
+            np.array(tops, dtype=np.int32).reshape(-1, SHORT_PREFIX_TOP)[order])
+
+
+def build_index(csv_path: str, out_dir: str):
+    """
+    Build every index file from the CSV and write them into out_dir.
+    """
+    nutrients, names, matrix = read_foods_csv(csv_path)
+    os.makedirs(out_dir, exist_ok=True)
+
+    encoded = [name.encode() for name in names]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in encoded], out=offsets[1:])
+
+    prefix_keys, prefix_foods, prefix_starts = [], [], []
+    trigram_parts, trigram_counts = [], np.zeros(len(names), dtype=np.int16)
+    for food_id, name in enumerate(names):
+        normalized = normalize(name)
+        starts = [0] + [match.end() for match in re.finditer(" ", normalized)]
+        for start in starts:
+            prefix_keys.append(normalized[start:].encode()[:KEY_WIDTH])
+            prefix_foods.append(food_id)
+            prefix_starts.append(start == 0)
+        codes = trigram_codes(normalized)
+        trigram_parts.append(codes)
+        trigram_counts[food_id] = len(codes)
+
+    keys = np.array(prefix_keys, dtype=f"S{KEY_WIDTH}")
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    prefix_foods = np.array(prefix_foods, dtype=np.int32)[order]
+    prefix_rank = (np.diff(offsets)[prefix_foods] + np.where(np.array(prefix_starts)[order], 0, NOT_NAME_START)).astype(np.int32)
+    short_prefixes, short_tops = short_prefix_table(keys, prefix_foods, prefix_rank)
+
+    codes = np.concatenate(trigram_parts) if trigram_parts else np.empty(0, np.uint32)
+    foods = np.repeat(np.arange(len(names), dtype=np.int32), [len(part) for part in trigram_parts])
+    posting_order = np.lexsort((foods, codes))
+    codes, foods = codes[posting_order], foods[posting_order]
+    trigram_keys, first = np.unique(codes, return_index=True)
+
+    np.save(os.path.join(out_dir, "nutrients.npy"), matrix)
+    with open(os.path.join(out_dir, "names.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(out_dir, "name_offsets.npy"), offsets)
+    np.save(os.path.join(out_dir, "prefix_keys.npy"), keys)
+    np.save(os.path.join(out_dir, "prefix_foods.npy"), prefix_foods)
+    np.save(os.path.join(out_dir, "prefix_rank.npy"), prefix_rank)
+    np.save(os.path.join(out_dir, "short_prefix_keys.npy"), short_prefixes)
+    np.save(os.path.join(out_dir, "short_prefix_top.npy"), short_tops)
+    np.save(os.path.join(out_dir, "trigram_keys.npy"), trigram_keys.astype(np.uint32))
+    np.save(os.path.join(out_dir, "trigram_ptr.npy"), np.append(first, len(codes)).astype(np.int64))
+    np.save(os.path.join(out_dir, "trigram_foods.npy"), foods)
+    np.save(os.path.join(out_dir, "trigram_counts.npy"), trigram_counts)
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump({"version": INDEX_VERSION, "foods": len(names), "nutrients": nutrients}, f, indent=2)
+    return len(names)
+
+
+################################################
+# Read-only index
+################################################
+class FoodIndex:
+    """
+    Memory-mapped food index: prefix and typo-tolerant search, lookups and meal totals.
+    """
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Food index version {meta.get('version')} is not {INDEX_VERSION}, rebuild it")
+        self.nutrient_names = meta["nutrients"]
+
+        def mapped(name):
+            return np.load(os.path.join(directory, name), mmap_mode="r")
+
+        self.nutrients = mapped("nutrients.npy")
+        self.names = np.memmap(os.path.join(directory, "names.bin"), dtype=np.uint8, mode="r") \
+            if os.path.getsize(os.path.join(directory, "names.bin")) else np.empty(0, np.uint8)
+        self.name_offsets = mapped("name_offsets.npy")
+        self.prefix_keys = mapped("prefix_keys.npy")
+        self.prefix_foods = mapped("prefix_foods.npy")
+        self.prefix_rank = mapped("prefix_rank.npy")
+        self.short_prefix_keys = mapped("short_prefix_keys.npy")
+        self.short_prefix_top = mapped("short_prefix_top.npy")
+        self.trigram_keys = mapped("trigram_keys.npy")
+        self.trigram_ptr = mapped("trigram_ptr.npy")
+        self.trigram_foods = mapped("trigram_foods.npy")
+        self.trigram_counts = mapped("trigram_counts.npy")
+
+    def __len__(self):
+        return len(self.nutrients)
+
+    def name(self, food_id: int) -> str:
+        return self.names[self.name_offsets[food_id]:self.name_offsets[food_id + 1]].tobytes().decode()
+
+    def prefix_matches(self, normalized: str, limit: int) -> np.ndarray:
+        """
+        Foods with a word starting with the query, names starting with it and short names first.
+        """
+        key = normalized.encode()[:KEY_WIDTH]
+        if len(key) <= SHORT_PREFIX and limit <= SHORT_PREFIX_TOP:
+            slot = np.searchsorted(self.short_prefix_keys, key)
+            if slot < len(self.short_prefix_keys) and self.short_prefix_keys[slot] == key:
+                top = np.asarray(self.short_prefix_top[slot, :limit])
+                return top[top >= 0]
+            return np.empty(0, np.int32)
+
+        lo = np.searchsorted(self.prefix_keys, key, side="left")
+        # UTF-8 never contains 0xff, so key + 0xff sorts after every key that starts with key
+        hi = np.searchsorted(self.prefix_keys, key, side="right") if len(key) == KEY_WIDTH \
+            else np.searchsorted(self.prefix_keys, key + b"\xff", side="left")
+        if lo == hi:
+            return np.empty(0, np.int32)
+
+        foods = np.asarray(self.prefix_foods[lo:hi])
+        rank = np.asarray(self.prefix_rank[lo:hi])
+        if len(foods) > limit * 4:
+            best = np.argpartition(rank, limit * 4)[:limit * 4]
+            foods, rank = foods[best], rank[best]
+        foods = foods[np.argsort(rank, kind="stable")]
+        if len(normalized) > KEY_WIDTH:
+            foods = np.array([food for food in foods if normalized in normalize(self.name(food))], dtype=np.int32)
+        return unique_in_order(foods)[:limit]
+
+    def fuzzy_matches(self, normalized: str, limit: int, min_similarity: float):
+        """
+        Typo-tolerant matches, best first, as (food ids, similarities). The similarity is the share
+        of the query's trigrams found in the name, so long names are not penalized for autocomplete;
+        ties go to the name with the higher Jaccard similarity, usually the shorter one.
+        """
+        codes = trigram_codes(normalized)
+        slots = np.searchsorted(self.trigram_keys, codes)
+        found = slots < len(self.trigram_keys)
+        found[found] = self.trigram_keys[slots[found]] == codes[found]
+        slots = slots[found]
+        if len(slots) == 0:
+            return np.empty(0, np.int32), np.empty(0)
+
+        starts, ends = self.trigram_ptr[slots], self.trigram_ptr[slots + 1]
+        postings = np.concatenate([self.trigram_foods[start:end] for start, end in zip(starts, ends)])
+        shared = np.bincount(postings, minlength=len(self.trigram_counts))
+        candidates = np.flatnonzero(shared >= max(1, math.ceil(min_similarity * len(codes))))
+        shared = shared[candidates]
+        similarity = shared / len(codes)
+        jaccard = shared / (len(codes) + self.trigram_counts[candidates] - shared)
+        rank = similarity + jaccard * 1e-3
+        if len(candidates) > limit:
+            best = np.argpartition(-rank, limit)[:limit]
+            candidates, similarity, rank = candidates[best], similarity[best], rank[best]
+        order = np.argsort(-rank, kind="stable")
+        return candidates[order], similarity[order]
+
+    def search(self, query: str, limit: int = 10, min_similarity: float = 0.5) -> list:
+        """
+        Autocomplete: prefix matches first, filled up with trigram matches for typos.
+        """
+        normalized = normalize(query)
+        if not normalized:
+            return []
+        results = [{"food_id": int(food), "name": self.name(food), "match": "prefix", "score": 1.0}
+                   for food in self.prefix_matches(normalized, limit)]
+        if len(results) < limit and len(normalized) >= 3:
+            seen = {result["food_id"] for result in results}
+            foods, similarity = self.fuzzy_matches(normalized, limit + len(results), min_similarity)
+            for food, score in zip(foods.tolist(), similarity.tolist()):
+                if len(results) == limit:
+                    break
+                if food not in seen:
+                    results.append({"food_id": food, "name": self.name(food), "match": "fuzzy", "score": round(score, 3)})
+        return results
+
+    def food(self, food_id: int) -> dict:
+        return {
+            "food_id": food_id,
+            "name": self.name(food_id),
+            "per_100g": dict(zip(self.nutrient_names, self.nutrients[food_id].tolist())),
+        }
+
+    def meal_totals(self, meal_ptr, food_ids, grams) -> np.ndarray:
+        """
+        Nutrient totals of many meals given in CSR form: meal i is food_ids[meal_ptr[i]:meal_ptr[i + 1]]
+        with the matching grams. This is the sparse (meals x foods) quantity matrix times the nutrient
+        matrix; only the rows of foods that appear are read. Returns float64 (meals, nutrients).
+        """
+        meal_ptr = np.asarray(meal_ptr, dtype=np.int64)
+        food_ids = np.asarray(food_ids, dtype=np.int64)
+        weighted = self.nutrients[food_ids].astype(np.float64) * (np.asarray(grams, dtype=np.float64) / 100)[:, None]
+        totals = np.zeros((len(meal_ptr) - 1, len(self.nutrient_names)))
+        # reduceat sums each meal's contiguous rows; it needs every start to be a non-empty meal
+        non_empty = np.diff(meal_ptr) > 0
+        if non_empty.any():
+            totals[non_empty] = np.add.reduceat(weighted, meal_ptr[:-1][non_empty], axis=0)
+        return totals
+
+
+def load_food_index(directory: str):
+    """
+    Map the index in directory, or return None if it has not been built.
+    """
+    start = time.perf_counter()
+    try:
+        index = FoodIndex(directory)
+    except Exception as e:
+        logging.error(f"Food index not available in {directory}: {e}")
+        return None
+    logging.info(f"Food index with {len(index)} foods mapped in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the nutrition food index from a CSV")
+    parser.add_argument("csv_path", help="CSV with a name column followed by nutrients per 100 g")
+    parser.add_argument("out_dir", help="Directory to write the index files into")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    count = build_index(args.csv_path, args.out_dir)
+    print(f"Indexed {count} foods into {args.out_dir} in {time.perf_counter() - started:.1f} s", file=sys.stderr)
@@ -0,0 +1,79 @@
+"""This FastAPI file defines the nutrition microservice: food autocomplete, food lookup and meal
+nutrient totals, all served from the memory-mapped food index built offline by food_index.py."""
+
+import json, logging
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from backend.core import signals
+from backend.core.security import current_user_id
+from backend.services.nutrition.food_index import load_food_index
+
+NUTRITION_FILE = "./configs/nutrition.json"
+
+
+def load_nutrition_config(file_path: str = NUTRITION_FILE) -> dict:
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except Exception as e:
+        logging.exception(f"Error loading nutrition config: {e}")
+        return {}
+
+
+nutrition_config = load_nutrition_config()
+MAX_SEARCH_LIMIT = int(nutrition_config.get("max_search_limit", 50))
+MIN_SIMILARITY = float(nutrition_config.get("min_trigram_similarity", 0.5))
+MAX_MEAL_ITEMS = int(nutrition_config.get("max_meal_items", 200))
+MAX_MEALS = int(nutrition_config.get("max_meals", 1000))
+# Mapped once when the service is mounted; the pages are shared by every worker
+food_index = load_food_index(nutrition_config.get("index_dir", "./data/nutrition_index"))
+
+router = APIRouter()
+
+
+def require_index():
+    if food_index is None:
+        raise HTTPException(status_code=503, detail="Food index is not built")
+    return food_index
+
+
+# Autocomplete endpoint
+@router.get("/foods/search")
+async def search_foods(q: str = Query(..., min_length=1, max_length=100),
+                       limit: int = Query(int(nutrition_config.get("search_limit", 10)), ge=1, le=MAX_SEARCH_LIMIT)):
+    return {"results": require_index().search(q, limit, MIN_SIMILARITY)}
+
+
+# Nutrients of one food per 100 g
+@router.get("/foods/{food_id}")
+async def get_food(food_id: int):
+    index = require_index()
+    if not 0 <= food_id < len(index):
+        raise HTTPException(status_code=404, detail="Food not found")
+    return index.food(food_id)
+
+
+# Meal totals endpoint: {"meals": [[{"food_id", "grams"}, ...], ...]}
+@router.post("/meals/totals")
+async def meal_totals(request: Request, user_id: int = Depends(current_user_id)):
+    index = require_index()
+    try:
+        meals = json.loads(await request.body())["meals"]
+        food_ids = [int(item["food_id"]) for meal in meals for item in meal]
+        grams = [float(item["grams"]) for meal in meals for item in meal]
+        sizes = [len(meal) for meal in meals]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Body must be {\"meals\": [[{\"food_id\", \"grams\"}]]}")
+    if len(meals) > MAX_MEALS or max(sizes, default=0) > MAX_MEAL_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_MEALS} meals of {MAX_MEAL_ITEMS} items")
+
+    food_ids, grams = np.array(food_ids, dtype=np.int64), np.array(grams)
+    if ((food_ids < 0) | (food_ids >= len(index))).any():
+        raise HTTPException(status_code=404, detail="Unknown food_id")
+    if (grams < 0).any() or not np.isfinite(grams).all():
+        raise HTTPException(status_code=400, detail="grams must be a non-negative number")
+
+    meal_ptr = np.concatenate(([0], np.cumsum(sizes)))
+    totals = index.meal_totals(meal_ptr, food_ids, grams)
+    signals.emit(signals.NUTRITION, user_id)
+    return {"nutrients": index.nutrient_names, "totals": np.round(totals, 3).tolist()}
@@ -0,0 +1,269 @@
+"""
+This file contains the embedding index, the request micro-batcher and the result cache used by the
+recommender microservice.
+
+User and item embeddings are rows of contiguous float32 matrices that grow by doubling, so item
+vectors are added, replaced or removed without rebuilding any index structure. A top-k query is one
+matrix product against the live item rows plus argpartition. Queries that arrive within
+batch_window_ms of each other are stacked and answered by a single matrix-matrix product.
+
+Queries run in a worker thread while updates arrive on the event loop. Updates write the matrices in
+place, between micro-batches: MicroBatcher.exclusive() holds new products back and waits for the
+running ones, so no product ever sees a half-written matrix and no update copies one.
+"""
+import asyncio, logging, os, time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import numpy as np
+
+
+class EmbeddingTable:
+    """
+    Id to row mapping over a growable float32 matrix. Removed rows are reused by later inserts.
+    Updates write the arrays in place, only reallocating them when they have to grow.
+    """
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.dim = dim
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.rows = {}
+        self.free_rows = []
+        self.size = 0  # rows in use or freed, the live rows are all below it
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _reserve(self, needed: int):
+        """
+        Make room for needed rows, doubling the capacity when it runs out.
+        """
+        capacity = len(self.vectors)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        ids = np.full(capacity, -1, dtype=np.int64)
+        ids[:self.size] = self.ids[:self.size]
+        self.vectors, self.ids = vectors, ids
+
+    def view(self):
+        """
+        (vectors, ids, live rows) of the rows in use. The arrays are views, changed by later updates.
+        """
+        return self.vectors[:self.size], self.ids[:self.size], len(self.rows)
+
+    def upsert(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        rows = np.empty(len(vectors), dtype=np.int64)
+        new = []
+        for i, item_id in enumerate(ids.tolist()):
+            row = self.rows.get(item_id)
+            if row is None:
+                row = self.free_rows.pop() if self.free_rows else None
+                if row is None:
+                    new.append(i)
+                    continue
+                self.rows[item_id] = row
+            rows[i] = row
+        if new:
+            self._reserve(self.size + len(new))
+            rows[new] = np.arange(self.size, self.size + len(new))
+            for i, row in zip(new, rows[new].tolist()):
+                self.rows[int(ids[i])] = row
+            self.size += len(new)
+        self.vectors[rows] = vectors
+        self.ids[rows] = ids
+
+    def remove(self, ids):
+        removed = [row for row in (self.rows.pop(int(item_id), None) for item_id in ids) if row is not None]
+        if not removed:
+            return
+        self.ids[removed] = -1
+        self.vectors[removed] = 0
+        self.free_rows.extend(removed)
+
+    def get(self, item_id: int):
+        row = self.rows.get(item_id)
+        return None if row is None else self.vectors[row]
+
+
+class EmbeddingIndex:
+    """
+    User and item embedding tables with batched top-k scoring by dot product.
+    """
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.users = EmbeddingTable(dim)
+        self.items = EmbeddingTable(dim)
+        self.version = 0  # bumped on every item change, cached results of older versions are stale
+
+    def upsert_items(self, ids, vectors):
+        self.items.upsert(ids, vectors)
+        self.version += 1
+
+    def remove_items(self, ids):
+        self.items.remove(ids)
+        self.version += 1
+
+    def top_k(self, queries, k: int):
+        """
+        Best k item ids and scores for every row of queries, shaped (queries, k) each. From a thread,
+        only call it while no update can run, see MicroBatcher.exclusive().
+        """
+        vectors, ids, live = self.items.view()
+        size = len(ids)
+        k = min(k, live)
+        if k == 0:
+            return np.empty((len(queries), 0), np.int64), np.empty((len(queries), 0), np.float32)
+        scores = np.asarray(queries, dtype=np.float32) @ vectors.T
+        if live < size:
+            scores[:, ids < 0] = -np.inf
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < size else np.tile(np.arange(size), (len(scores), 1))
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind="stable")[:, :k]
+        best = np.take_along_axis(best, order, axis=1)
+        return ids[best], np.take_along_axis(best_scores, order, axis=1)
+
+    @classmethod
+    def load(cls, directory: str, dim: int):
+        """
+        Load users.npy / user_ids.npy / items.npy / item_ids.npy exported by the training job,
+        or start empty if there is no export yet.
+        """
+        index = cls(dim)
+        try:
+            for table, name in ((index.users, "user"), (index.items, "item")):
+                path = os.path.join(directory, f"{name}s.npy")
+                if not os.path.exists(path):
+                    continue
+                vectors = np.load(path)
+                if vectors.shape[1] != dim:
+                    raise ValueError(f"{path} has dimension {vectors.shape[1]}, expected {dim}")
+                table.upsert(np.load(os.path.join(directory, f"{name}_ids.npy")), vectors)
+        except Exception as e:
+            logging.exception(f"Error loading embeddings from {directory}: {e}")
+            return cls(dim)
+        logging.info(f"Embedding index loaded with {len(index.users)} users and {len(index.items)} items")
+        return index
+
+
+class MicroBatcher:
+    """
+    Collects top-k queries for up to window_ms (or max_batch queries) and answers them with one
+    matrix product in a worker thread, so the event loop keeps serving while NumPy multiplies.
+    Index updates run inside exclusive(), between products.
+    """
+    def __init__(self, index: EmbeddingIndex, window_ms: float = 2.0, max_batch: int = 256):
+        self.index = index
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.pending = []
+        self.timer = None
+        self.running = set()  # references keep the batch tasks from being garbage collected
+        self.computing = 0  # products running in threads
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.writers = 0  # updates waiting for or holding exclusive(), new products wait for them
+        self.metrics = {"queries": 0, "batches": 0, "largest_batch": 0, "compute_seconds": 0.0}
+
+    async def query(self, vector, k: int):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((vector, k, future))
+        if len(self.pending) >= self.max_batch:
+            self._dispatch()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self._dispatch)
+        return await future
+
+    @asynccontextmanager
+    async def exclusive(self):
+        """
+        Hold new products back and wait for the running ones, so the block can write the index in
+        place. Queries arriving meanwhile are answered once it ends.
+        """
+        self.writers += 1
+        try:
+            while self.computing:
+                await self.idle.wait()
+            yield
+        finally:
+            self.writers -= 1
+            if not self.writers and self.pending and self.timer is None:
+                self._dispatch()
+
+    def _dispatch(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.writers:
+            return
+        while self.pending:
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            # Counted here, before the task starts, so exclusive() cannot slip in ahead of it
+            self.computing += 1
+            self.idle.clear()
+            task = asyncio.create_task(self._run(batch))
+            self.running.add(task)
+            task.add_done_callback(self._done)
+
+    def _done(self, task):
+        self.running.discard(task)
+        self.computing -= 1
+        if not self.computing:
+            self.idle.set()
+
+    async def _run(self, batch):
+        queries = np.stack([vector for vector, _, _ in batch])
+        k = max(k for _, k, _ in batch)
+        start = time.perf_counter()
+        try:
+            ids, scores = await asyncio.to_thread(self.index.top_k, queries, k)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.metrics["queries"] += len(batch)
+        self.metrics["batches"] += 1
+        self.metrics["largest_batch"] = max(self.metrics["largest_batch"], len(batch))
+        self.metrics["compute_seconds"] += time.perf_counter() - start
+        for row, (_, k, future) in enumerate(batch):
+            if not future.done():
+                future.set_result((ids[row, :k], scores[row, :k]))
+
+    def stats(self) -> dict:
+        return dict(self.metrics)
+
+
+class RecommendationCache:
+    """
+    LRU cache of per-user results, tagged with the item version they were computed against.
+    """
+    def __init__(self, max_size: int = 50000):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # user_id: (version, k, ids, scores)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, k: int, version: int):
+        entry = self.entries.get(user_id)
+        if entry is None or entry[0] != version or entry[1] < k:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[2][:k], entry[3][:k]
+
+    def put(self, user_id: int, k: int, version: int, ids, scores):
+        self.entries[user_id] = (version, k, ids, scores)
+        self.entries.move_to_end(user_id)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self.entries.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
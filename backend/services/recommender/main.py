@@ -0,0 +1,246 @@
+"""This FastAPI file defines the recommender microservice. Recommendations are the top-k items by
+embedding dot product, computed in micro-batches and cached per user until the user's sleep, stress
+or nutrition data changes or the item embeddings are updated. Embedding updates and invalidations
+go through the database, so every API worker, and a restarted one, sees them."""
+
+import asyncio, json, logging
+from contextlib import asynccontextmanager
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import select
+from backend.core import signals
+from backend.core.security import current_user_id, require_microservice_token
+from backend.database.db_pool_manager import get_database_connection
+from backend.database.database_query_functions import dialect_insert
+from backend.database.models import recommender_invalidations, recommender_revision, recommender_vectors
+from backend.metrics import register_collector
+from backend.services.recommender.index import EmbeddingIndex, MicroBatcher, RecommendationCache
+
+RECOMMENDER_FILE = "./configs/recommender.json"
+
+
+def load_recommender_config(file_path: str = RECOMMENDER_FILE) -> dict:
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except Exception as e:
+        logging.exception(f"Error loading recommender config: {e}")
+        return {}
+
+
+USER, ITEM = 0, 1
+
+
+class IndexSync:
+    """
+    Keeps this worker's embedding index and result cache in step with the other workers.
+
+    Embedding updates are written to recommender_vectors and signal invalidations to
+    recommender_invalidations, each transaction under the next revision of recommender_revision.
+    Every worker applies the rows above the revision it has seen on startup, every
+    sync_interval_seconds, and right after its own writes. The counter row stays locked until the
+    writing transaction commits, so revisions become visible in order and a pull never skips one.
+    Pulled rows are written into the index between the batcher's products.
+    """
+    def __init__(self, index: EmbeddingIndex, cache: RecommendationCache, batcher: MicroBatcher = None):
+        self.index = index
+        self.cache = cache
+        self.batcher = batcher
+        self.revision = 0
+        self.pending_invalidations = set()
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    async def next_revision(connection) -> int:
+        stmt = dialect_insert(connection, recommender_revision).values(id=1, revision=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[recommender_revision.c.id], set_={"revision": recommender_revision.c.revision + 1},
+        ).returning(recommender_revision.c.revision)
+        return (await connection.execute(stmt)).scalar_one()
+
+    async def save_vectors(self, kind: int, ids, vectors=None):
+        """
+        Store user or item vectors, or remove items when vectors is None, then pull them into this worker.
+        """
+        db_conn = await get_database_connection()
+        async with db_conn.engine.begin() as connection:
+            revision = await self.next_revision(connection)
+            stmt = dialect_insert(connection, recommender_vectors)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[recommender_vectors.c.kind, recommender_vectors.c.entity_id],
+                set_={"vector": stmt.excluded.vector, "revision": stmt.excluded.revision},
+            )
+            await connection.execute(stmt, [
+                {"kind": kind, "entity_id": entity_id, "revision": revision,
+                 "vector": None if vectors is None else vectors[i].astype("<f4").tobytes()}
+                for i, entity_id in enumerate(ids.tolist())
+            ])
+        await self.pull()
+
+    def invalidate(self, user_id: int):
+        """
+        Signal subscriber: drop the user's entry here at once, and in the other workers after the next pull.
+        """
+        self.cache.invalidate(user_id)
+        self.pending_invalidations.add(user_id)
+
+    async def pull(self):
+        async with self.lock:
+            db_conn = await get_database_connection()
+            if self.pending_invalidations:
+                users, self.pending_invalidations = self.pending_invalidations, set()
+                try:
+                    async with db_conn.engine.begin() as connection:
+                        revision = await self.next_revision(connection)
+                        stmt = dialect_insert(connection, recommender_invalidations)
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=[recommender_invalidations.c.user_id],
+                            set_={"revision": stmt.excluded.revision},
+                        )
+                        await connection.execute(stmt, [{"user_id": user_id, "revision": revision} for user_id in users])
+                except Exception:
+                    self.pending_invalidations |= users
+                    raise
+
+            async with db_conn.engine.connect() as connection:
+                # Everything up to the counter's value is committed, rows above it are left for the next pull
+                latest = (await connection.execute(select(recommender_revision.c.revision))).scalar()
+                if latest is None or latest <= self.revision:
+                    return
+                def in_range(table):
+                    return (table.c.revision > self.revision) & (table.c.revision <= latest)
+                vectors = (await connection.execute(
+                    select(recommender_vectors.c.kind, recommender_vectors.c.entity_id, recommender_vectors.c.vector)
+                    .where(in_range(recommender_vectors)).order_by(recommender_vectors.c.revision)
+                )).all()
+                invalidated = (await connection.execute(
+                    select(recommender_invalidations.c.user_id).where(in_range(recommender_invalidations))
+                )).scalars().all()
+            if self.batcher is None:
+                self.apply(vectors, invalidated)
+            else:
+                async with self.batcher.exclusive():
+                    self.apply(vectors, invalidated)
+            self.revision = latest
+
+    def apply(self, vectors, invalidated):
+        """
+        Apply pulled rows in revision order, each run of the same kind of change in one call.
+        """
+        runs = []
+        for kind, entity_id, vector in vectors:
+            change = (kind, vector is None)
+            if not runs or runs[-1][0] != change:
+                runs.append((change, [], []))
+            runs[-1][1].append(entity_id)
+            if vector is not None:
+                runs[-1][2].append(np.frombuffer(vector, dtype="<f4"))
+        for (kind, removed), ids, rows in runs:
+            ids = np.asarray(ids, dtype=np.int64)
+            if kind == ITEM and removed:
+                self.index.remove_items(ids)
+            elif kind == ITEM:
+                self.index.upsert_items(ids, np.stack(rows))
+            else:
+                self.index.users.upsert(ids, np.stack(rows))
+                invalidated = [*invalidated, *ids.tolist()]
+        for user_id in invalidated:
+            self.cache.invalidate(user_id)
+
+    async def run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.pull()
+            except Exception as e:
+                logging.exception(f"Error syncing the recommender index: {e}")
+
+
+recommender_config = load_recommender_config()
+DIM = int(recommender_config.get("dim", 64))
+MAX_K = int(recommender_config.get("max_k", 100))
+MAX_UPSERT_ITEMS = int(recommender_config.get("max_upsert_items", 100000))
+
+embedding_index = EmbeddingIndex.load(recommender_config.get("embeddings_dir", "./data/recommender"), DIM)
+batcher = MicroBatcher(embedding_index, float(recommender_config.get("batch_window_ms", 2)),
+                       int(recommender_config.get("max_batch", 256)))
+cache = RecommendationCache(int(recommender_config.get("cache_size", 50000)))
+index_sync = IndexSync(embedding_index, cache, batcher)
+
+for signal in (signals.SLEEP, signals.STRESS, signals.NUTRITION):
+    signals.subscribe(signal, index_sync.invalidate)
+register_collector("recommender_batcher", batcher.stats)
+register_collector("recommender_cache", cache.stats)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    try:
+        await index_sync.pull()
+    except Exception as e:
+        logging.exception(f"Error loading recommender updates, retrying in the background: {e}")
+    syncer = asyncio.create_task(index_sync.run(float(recommender_config.get("sync_interval_seconds", 1))))
+    yield
+    syncer.cancel()
+
+
+# Merged into the application lifespan by include_router
+router = APIRouter(lifespan=lifespan)
+
+
+async def read_vectors(request: Request, max_rows: int):
+    """
+    Parse {"ids": [...], "vectors": [[...], ...]} into an id array and a float32 matrix.
+    """
+    try:
+        body = json.loads(await request.body())
+        ids = np.asarray(body["ids"], dtype=np.int64)
+        vectors = np.asarray(body.get("vectors", np.empty((len(ids), DIM))), dtype=np.float32)
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Body must be {\"ids\": [...], \"vectors\": [[...]]}")
+    if ids.ndim != 1 or len(ids) > max_rows:
+        raise HTTPException(status_code=413, detail=f"At most {max_rows} ids per request")
+    if vectors.shape != (len(ids), DIM) or not np.isfinite(vectors).all():
+        raise HTTPException(status_code=400, detail=f"Every vector must hold {DIM} finite numbers")
+    return ids, vectors
+
+
+# Recommendations for the current user
+@router.get("/recommendations")
+async def recommendations(k: int = Query(int(recommender_config.get("default_k", 10)), ge=1, le=MAX_K),
+                          user_id: int = Depends(current_user_id)):
+    version = embedding_index.version
+    cached = cache.get(user_id, k, version)
+    if cached is None:
+        vector = embedding_index.users.get(user_id)
+        if vector is None:
+            raise HTTPException(status_code=404, detail="No embedding for this user yet")
+        ids, scores = await batcher.query(vector.copy(), k)
+        # Tagged with the version read before the query, so an update during it leaves the entry stale
+        cache.put(user_id, k, version, ids, scores)
+        cached = ids, scores
+    ids, scores = cached
+    return {"items": ids.tolist(), "scores": np.round(scores, 5).tolist()}
+
+
+# Item embedding updates from the training job; stored for every worker, replacing existing vectors
+@router.put("/items", dependencies=[Depends(require_microservice_token)])
+async def upsert_items(request: Request):
+    ids, vectors = await read_vectors(request, MAX_UPSERT_ITEMS)
+    await index_sync.save_vectors(ITEM, ids, vectors)
+    return {"items": len(embedding_index.items), "version": embedding_index.version}
+
+
+@router.delete("/items", dependencies=[Depends(require_microservice_token)])
+async def remove_items(request: Request):
+    ids, _ = await read_vectors(request, MAX_UPSERT_ITEMS)
+    await index_sync.save_vectors(ITEM, ids)
+    return {"items": len(embedding_index.items), "version": embedding_index.version}
+
+
+# User embedding updates from the training job
+@router.put("/users", dependencies=[Depends(require_microservice_token)])
+async def upsert_users(request: Request):
+    ids, vectors = await read_vectors(request, MAX_UPSERT_ITEMS)
+    await index_sync.save_vectors(USER, ids, vectors)
+    return {"users": len(embedding_index.users)}
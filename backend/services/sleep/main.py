@@ -0,0 +1,157 @@
+"""This FastAPI file defines the sleep analysis microservice. Nights are staged from accelerometer and
+heart-rate samples by the vectorized engine in staging.py, either many nights in one batch call or
+tonight's hypnogram updated incrementally as the wearable uploads new samples. Tonight's epoch sums
+are kept in the sleep_epochs table, so uploads may go to any worker and survive a restart."""
+
+import json, time
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import delete, func, select
+from backend.core import signals
+from backend.core.security import current_user_id
+from backend.database.db_pool_manager import get_database_connection
+from backend.database.database_query_functions import dialect_insert
+from backend.database.models import sleep_epochs
+from backend.routes.devices import read_body
+from backend.services.sleep.staging import (EPOCH_SECONDS, STAGE_NAMES, IncrementalHypnogram,
+                                            stage_nights, summarize)
+
+router = APIRouter()
+
+MAX_BATCH_NIGHTS = 10000
+MAX_NIGHT_HOURS = 16
+MAX_SCORE_BODY_BYTES = 64 * 1024 * 1024
+MAX_TONIGHT_BODY_BYTES = 4 * 1024 * 1024
+# A night nobody uploaded to for TONIGHT_IDLE_SECONDS is over
+TONIGHT_IDLE_SECONDS = 6 * 3600
+
+
+async def add_tonight_sums(user_id: int, hypnogram: IncrementalHypnogram, now_ms: int) -> int:
+    """
+    Add the epoch sums of one upload to the user's night in one transaction, after deleting the
+    user's rows of any other night. Returns the number of epochs of the night so far.
+    """
+    epochs, sums = hypnogram.epoch_sums()
+    rows = [{"user_id": user_id, "start_ms": hypnogram.start_ms, "epoch": int(epoch), "updated_ms": now_ms,
+             **{name: float(values[i]) for name, values in sums.items()}}
+            for i, epoch in enumerate(epochs)]
+    db_conn = await get_database_connection()
+    async with db_conn.engine.begin() as connection:
+        await connection.execute(delete(sleep_epochs).where(
+            sleep_epochs.c.user_id == user_id, sleep_epochs.c.start_ms != hypnogram.start_ms))
+        if rows:
+            stmt = dialect_insert(connection, sleep_epochs)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[sleep_epochs.c.user_id, sleep_epochs.c.start_ms, sleep_epochs.c.epoch],
+                set_={"updated_ms": stmt.excluded.updated_ms,
+                      **{name: sleep_epochs.c[name] + stmt.excluded[name] for name in IncrementalHypnogram.SUMS}},
+            )
+            await connection.execute(stmt, rows)
+        last_epoch = (await connection.execute(
+            select(func.max(sleep_epochs.c.epoch))
+            .where(sleep_epochs.c.user_id == user_id, sleep_epochs.c.start_ms == hypnogram.start_ms)
+        )).scalar()
+    return 0 if last_epoch is None else last_epoch + 1
+
+
+async def load_tonight(user_id: int, now_ms: int):
+    """
+    The user's latest night rebuilt from its epoch sums, or None if there is none or it is over.
+    """
+    latest = select(func.max(sleep_epochs.c.start_ms)).where(sleep_epochs.c.user_id == user_id).scalar_subquery()
+    db_conn = await get_database_connection()
+    async with db_conn.engine.connect() as connection:
+        rows = (await connection.execute(
+            select(sleep_epochs.c.start_ms, sleep_epochs.c.updated_ms, sleep_epochs.c.epoch,
+                   *(sleep_epochs.c[name] for name in IncrementalHypnogram.SUMS))
+            .where(sleep_epochs.c.user_id == user_id, sleep_epochs.c.start_ms == latest)
+        )).all()
+    if not rows or now_ms - max(row.updated_ms for row in rows) > TONIGHT_IDLE_SECONDS * 1000:
+        return None
+    columns = np.array([row[2:] for row in rows], dtype=np.float64)
+    sums = {name: columns[:, i + 1] for i, name in enumerate(IncrementalHypnogram.SUMS)}
+    return IncrementalHypnogram.from_epoch_sums(rows[0].start_ms, columns[:, 0], sums)
+
+
+def sample_columns(rows, width: int, name: str):
+    """
+    Turn a list of [ts_ms, value, ...] rows into (ts_ms, values) arrays without a per-row loop.
+    """
+    array = np.asarray(rows if rows else np.empty((0, width)), dtype=np.float64)
+    if array.ndim != 2 or array.shape[1] != width:
+        raise HTTPException(status_code=400, detail=f"Every {name} sample must have {width} numbers")
+    return array[:, 0].astype(np.int64), array[:, 1:]
+
+
+def night_summary(stages, summary, night: int):
+    return {
+        "epoch_seconds": EPOCH_SECONDS,
+        "minutes": dict(zip(STAGE_NAMES, summary["minutes"][night].tolist())),
+        "total_sleep_minutes": float(summary["total_sleep_minutes"][night]),
+        "efficiency": round(float(summary["efficiency"][night]), 4),
+        "stages": stages.tolist(),
+    }
+
+
+# Batch scoring endpoint: {"nights": [{"start_ms", "end_ms", "accel": [[ts, x, y, z]], "hr": [[ts, bpm]]}]}
+@router.post("/score")
+async def score_nights(request: Request, user_id: int = Depends(current_user_id)):
+    try:
+        nights = json.loads(await read_body(request, MAX_SCORE_BODY_BYTES))["nights"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Body must be a JSON object with a nights list")
+    if not 0 < len(nights) <= MAX_BATCH_NIGHTS:
+        raise HTTPException(status_code=413, detail=f"Send between 1 and {MAX_BATCH_NIGHTS} nights")
+
+    start_ms, end_ms, accel, hr = [], [], [], []
+    for night in nights:
+        try:
+            start_ms.append(int(night["start_ms"]))
+            end_ms.append(int(night["end_ms"]))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Every night needs start_ms and end_ms")
+        if not 0 < end_ms[-1] - start_ms[-1] <= MAX_NIGHT_HOURS * 3600 * 1000:
+            raise HTTPException(status_code=400, detail=f"A night must last between 0 and {MAX_NIGHT_HOURS} hours")
+        accel.append(sample_columns(night.get("accel"), 4, "accel"))
+        hr.append(sample_columns(night.get("hr"), 2, "hr"))
+
+    stages, epochs, summary = stage_nights(
+        start_ms, end_ms,
+        np.repeat(np.arange(len(nights)), [len(ts) for ts, _ in accel]),
+        np.concatenate([ts for ts, _ in accel]), np.concatenate([xyz for _, xyz in accel]),
+        np.repeat(np.arange(len(nights)), [len(ts) for ts, _ in hr]),
+        np.concatenate([ts for ts, _ in hr]), np.concatenate([bpm[:, 0] for _, bpm in hr]),
+    )
+    return {"nights": [night_summary(stages[i, :epochs[i]], summary, i) for i in range(len(nights))]}
+
+
+# Incremental endpoint: {"start_ms", "accel": [[ts, x, y, z]], "hr": [[ts, bpm]]}; a new start_ms starts a new night
+@router.post("/tonight/samples")
+async def add_tonight_samples(request: Request, user_id: int = Depends(current_user_id)):
+    try:
+        body = json.loads(await read_body(request, MAX_TONIGHT_BODY_BYTES))
+        start_ms = int(body["start_ms"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Body must be a JSON object with start_ms")
+
+    accel_ts, accel_xyz = sample_columns(body.get("accel"), 4, "accel")
+    hr_ts, hr_bpm = sample_columns(body.get("hr"), 2, "hr")
+    if len(accel_ts) and accel_ts.max() - start_ms > MAX_NIGHT_HOURS * 3600 * 1000 \
+            or len(hr_ts) and hr_ts.max() - start_ms > MAX_NIGHT_HOURS * 3600 * 1000:
+        raise HTTPException(status_code=400, detail=f"Samples are more than {MAX_NIGHT_HOURS} hours after start_ms")
+
+    upload = IncrementalHypnogram(start_ms)
+    upload.accumulate(accel_ts, accel_xyz, hr_ts, hr_bpm[:, 0])
+    n_epochs = await add_tonight_sums(user_id, upload, int(time.time() * 1000))
+    signals.emit(signals.SLEEP, user_id)
+    return {"epochs": n_epochs}
+
+
+# Tonight's hypnogram so far
+@router.get("/tonight")
+async def get_tonight(user_id: int = Depends(current_user_id)):
+    hypnogram = await load_tonight(user_id, int(time.time() * 1000))
+    if hypnogram is None:
+        raise HTTPException(status_code=404, detail="No samples for tonight yet")
+    stages = hypnogram.hypnogram()
+    return {"start_ms": hypnogram.start_ms, **night_summary(stages, summarize(stages[None]), 0)}
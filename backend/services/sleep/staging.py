@@ -0,0 +1,304 @@
+"""
+This file contains the vectorized sleep staging engine used by the sleep microservice.
+
+Raw accelerometer and heart-rate samples are reduced to 30-second epoch features with bincount,
+for any number of nights at once. Sleep/wake is scored with a Cole-Kripke style weighted window
+over epoch activity, and sleep epochs are split into light, deep and REM from heart rate relative
+to the night's own baseline. Every step works on (nights, epochs) arrays, so one night and ten
+thousand nights go through the same code without a per-sample or per-epoch Python loop.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+EPOCH_SECONDS = 30
+EPOCH_MS = EPOCH_SECONDS * 1000
+
+WAKE, LIGHT, DEEP, REM = 0, 1, 2, 3
+STAGE_NAMES = ("wake", "light", "deep", "rem")
+
+# Cole-Kripke weights for epochs t-4 .. t+2, rescaled for activity in milli-g
+SLEEP_WAKE_WEIGHTS = np.array([106, 54, 58, 76, 230, 74, 67], dtype=np.float32)
+SLEEP_WAKE_BEFORE = 4
+SLEEP_WAKE_AFTER = 2
+SLEEP_WAKE_SCALE = 0.00025
+# REM is rare in the first sleep cycle
+REM_LATENCY_EPOCHS = 60 * 60 // EPOCH_SECONDS
+
+
+def epoch_index(night, ts_ms, start_ms, n_epochs):
+    """
+    Flat (night, epoch) bucket of every sample and a mask of samples inside their night.
+
+    :param night: Night number of every sample.
+    :param ts_ms: Sample timestamps in milliseconds.
+    :param start_ms: Start of every night, indexed by night number.
+    """
+    epoch = (ts_ms - start_ms[night]) // EPOCH_MS
+    inside = (epoch >= 0) & (epoch < n_epochs)
+    return night * n_epochs + np.where(inside, epoch, 0), inside
+
+
+def epoch_mean_std(night, ts_ms, values, start_ms, n_nights, n_epochs):
+    """
+    Mean, standard deviation and sample count of values per (night, epoch), shaped (n_nights, n_epochs).
+    """
+    flat, inside = epoch_index(night, ts_ms, start_ms, n_epochs)
+    flat, values = flat[inside], values[inside].astype(np.float64)
+    size = n_nights * n_epochs
+    count = np.bincount(flat, minlength=size)
+    total = np.bincount(flat, weights=values, minlength=size)
+    total_sq = np.bincount(flat, weights=values * values, minlength=size)
+    safe = np.maximum(count, 1)
+    mean = total / safe
+    std = np.sqrt(np.maximum(total_sq / safe - mean * mean, 0))
+    shape = (n_nights, n_epochs)
+    return mean.reshape(shape), std.reshape(shape), count.reshape(shape)
+
+
+def epoch_features(night, start_ms, n_nights, n_epochs, accel_ts, accel_xyz, hr_ts, hr_bpm):
+    """
+    Reduce raw samples of many nights to epoch features.
+
+    Activity is the mean deviation of the acceleration magnitude from 1 g, in milli-g.
+    Returns a dict of (n_nights, n_epochs) arrays: activity, hr_mean, hr_std, has_activity, has_hr.
+    """
+    accel_night, hr_night = night
+    magnitude = np.abs(np.sqrt(np.einsum("ij,ij->i", accel_xyz, accel_xyz)) - 1.0) * 1000
+    activity, _, activity_count = epoch_mean_std(accel_night, accel_ts, magnitude, start_ms, n_nights, n_epochs)
+    hr_mean, hr_std, hr_count = epoch_mean_std(hr_night, hr_ts, hr_bpm, start_ms, n_nights, n_epochs)
+    return {
+        "activity": activity,
+        "hr_mean": hr_mean,
+        "hr_std": hr_std,
+        "has_activity": activity_count > 0,
+        "has_hr": hr_count > 0,
+    }
+
+
+def fill_gaps(values, present):
+    """
+    Carry the last present epoch forward (and the first one backward) along each night.
+    """
+    index = np.where(present, np.arange(values.shape[1]), 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    filled = np.take_along_axis(values, index, axis=1)
+    first = np.argmax(present, axis=1)
+    leading = np.arange(values.shape[1]) < first[:, None]
+    return np.where(leading, np.take_along_axis(values, first[:, None], axis=1), filled)
+
+
+def masked_percentile(values, mask, q: float):
+    """
+    Per-night q-th percentile (linear interpolation, like np.percentile) of values where mask is
+    True, shaped (n_nights, 1). Masked-out epochs are sorted to the end of each row, so a night's
+    result does not depend on how far it was padded.
+    """
+    ordered = np.sort(np.where(mask, values, np.inf), axis=1)
+    position = (np.maximum(mask.sum(axis=1, keepdims=True), 1) - 1) * (q / 100)
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    below = np.take_along_axis(ordered, low, axis=1)
+    above = np.take_along_axis(ordered, high, axis=1)
+    return np.where(high > low, below + (above - below) * (position - low), below)
+
+
+def sleep_wake(activity):
+    """
+    Cole-Kripke style score over a t-4 .. t+2 epoch window; True where asleep.
+    """
+    padded = np.pad(activity, ((0, 0), (SLEEP_WAKE_BEFORE, SLEEP_WAKE_AFTER)), mode="edge")
+    windows = sliding_window_view(padded, len(SLEEP_WAKE_WEIGHTS), axis=1)
+    return SLEEP_WAKE_SCALE * (windows @ SLEEP_WAKE_WEIGHTS) < 1.0
+
+
+def smooth_stages(stages, in_night):
+    """
+    Replace single-epoch blips by the surrounding stage when both neighbours agree and are in the night.
+    """
+    smoothed = stages.copy()
+    previous, current, following = stages[:, :-2], stages[:, 1:-1], stages[:, 2:]
+    blip = (previous == following) & (current != previous) & in_night[:, 2:]
+    smoothed[:, 1:-1] = np.where(blip, previous, current)
+    return smoothed
+
+
+def score_epochs(activity, hr_mean, hr_std, has_activity=None, has_hr=None, in_night=None):
+    """
+    Stage every epoch of every night; all inputs are (n_nights, n_epochs) arrays.
+
+    in_night marks the epochs that belong to each night when shorter nights are padded to the
+    longest one. Padding is left out of every per-night statistic and gap filling, so a night is
+    scored the same alone and in any batch.
+
+    Returns int8 stages (WAKE, LIGHT, DEEP, REM). Epochs with no data at all, and padding, are wake.
+    """
+    activity = np.asarray(activity, dtype=np.float32)
+    hr_mean = np.asarray(hr_mean, dtype=np.float32)
+    hr_std = np.asarray(hr_std, dtype=np.float32)
+    in_night = np.ones(activity.shape, bool) if in_night is None else in_night
+    has_activity = in_night if has_activity is None else has_activity & in_night
+    has_hr = in_night if has_hr is None else has_hr & in_night
+
+    # Padding is filled from the night's last epoch, like the edge padding of the sleep/wake window
+    activity = fill_gaps(activity, has_activity) if not has_activity.all() else activity
+    asleep = sleep_wake(activity)
+
+    # Heart rate relative to the night's own sleep baseline
+    hr_valid = has_hr & asleep
+    hr_count = np.maximum(hr_valid.sum(axis=1, keepdims=True), 1)
+    baseline = np.where(hr_valid, hr_mean, 0).sum(axis=1, keepdims=True, dtype=np.float64) / hr_count
+    spread = np.sqrt(np.where(hr_valid, (hr_mean - baseline) ** 2, 0).sum(axis=1, keepdims=True) / hr_count)
+    hr_z = (hr_mean - baseline) / np.maximum(spread, 1.0)
+    variability = np.where(has_hr, hr_std, masked_percentile(hr_std, in_night, 50))
+
+    quiet = activity < masked_percentile(activity, in_night, 50)
+    deep = asleep & has_hr & quiet & (hr_z < -0.5) & (variability <= masked_percentile(variability, in_night, 50))
+    past_latency = np.cumsum(asleep, axis=1) > REM_LATENCY_EPOCHS
+    rem = asleep & has_hr & quiet & (hr_z > 0.3) & past_latency & ~deep
+
+    stages = np.full(activity.shape, LIGHT, dtype=np.int8)
+    stages[deep] = DEEP
+    stages[rem] = REM
+    stages[~asleep | ~(has_activity | has_hr)] = WAKE
+    stages = smooth_stages(stages, in_night)
+    stages[~in_night] = WAKE
+    return stages
+
+
+def summarize(stages, in_night=None):
+    """
+    Per-night minutes per stage, total sleep time and sleep efficiency, counting only epochs in in_night.
+    """
+    in_night = np.ones(stages.shape, bool) if in_night is None else in_night
+    epochs = in_night.sum(axis=1)
+    minutes = np.stack([((stages == stage) & in_night).sum(axis=1) for stage in range(len(STAGE_NAMES))], axis=1) * EPOCH_SECONDS / 60
+    total_sleep = minutes[:, LIGHT] + minutes[:, DEEP] + minutes[:, REM]
+    in_bed = np.maximum(np.asarray(epochs) * EPOCH_SECONDS / 60, 1)
+    return {
+        "minutes": minutes,
+        "total_sleep_minutes": total_sleep,
+        "efficiency": total_sleep / in_bed,
+    }
+
+
+def stage_nights(start_ms, end_ms, accel_night, accel_ts, accel_xyz, hr_night, hr_ts, hr_bpm):
+    """
+    Batch mode: stage many nights from raw samples in one call.
+
+    Nights are padded to the longest one; returns (stages, n_epochs per night, summary).
+    """
+    start_ms = np.asarray(start_ms, dtype=np.int64)
+    epochs_per_night = -(-(np.asarray(end_ms, dtype=np.int64) - start_ms) // EPOCH_MS)
+    n_nights, n_epochs = len(start_ms), int(epochs_per_night.max(initial=0))
+
+    features = epoch_features(
+        (np.asarray(accel_night), np.asarray(hr_night)), start_ms, n_nights, n_epochs,
+        np.asarray(accel_ts, dtype=np.int64), np.asarray(accel_xyz, dtype=np.float32).reshape(-1, 3),
+        np.asarray(hr_ts, dtype=np.int64), np.asarray(hr_bpm, dtype=np.float32),
+    )
+    in_night = np.arange(n_epochs) < epochs_per_night[:, None]
+    stages = score_epochs(**features, in_night=in_night)
+    return stages, epochs_per_night, summarize(stages, in_night)
+
+
+class IncrementalHypnogram:
+    """
+    Tonight's hypnogram for one user, updated as samples arrive.
+
+    Epoch sums live in growable arrays, so adding samples is a bincount into them. The whole night
+    so far is rescored after every update: the deep/REM thresholds are per-night statistics, so
+    new samples can change any earlier epoch. The hypnogram is therefore always exactly what
+    score_epochs gives for the samples received, and one rescore of a 16 hour night is well under
+    a millisecond. The sums are additive, so the sums of several uploads can be stored and added
+    up elsewhere, and a hypnogram rebuilt from them with from_epoch_sums.
+    """
+    SUMS = ("activity_sum", "activity_count", "hr_sum", "hr_sum_sq", "hr_count")
+
+    def __init__(self, start_ms: int, capacity: int = 1200):
+        self.start_ms = int(start_ms)
+        self.n_epochs = 0
+        self.activity_sum = np.zeros(capacity)
+        self.activity_count = np.zeros(capacity)
+        self.hr_sum = np.zeros(capacity)
+        self.hr_sum_sq = np.zeros(capacity)
+        self.hr_count = np.zeros(capacity)
+        self.stages = np.zeros(0, dtype=np.int8)
+
+    def _grow(self, n_epochs):
+        capacity = len(self.activity_sum)
+        if n_epochs <= capacity:
+            return
+        new_capacity = max(n_epochs, capacity * 2)
+        for name in self.SUMS:
+            old = getattr(self, name)
+            grown = np.zeros(new_capacity, dtype=old.dtype)
+            grown[:capacity] = old
+            setattr(self, name, grown)
+
+    def _accumulate(self, ts_ms, values, sums, sums_sq=None, counts=None):
+        epoch = (np.asarray(ts_ms, dtype=np.int64) - self.start_ms) // EPOCH_MS
+        keep = epoch >= 0
+        epoch, values = epoch[keep], np.asarray(values, dtype=np.float64)[keep]
+        if len(epoch) == 0:
+            return
+        size = int(epoch.max()) + 1
+        self._grow(size)
+        self.n_epochs = max(self.n_epochs, size)
+        # the attributes may have been replaced by _grow
+        getattr(self, sums)[:size] += np.bincount(epoch, weights=values, minlength=size)
+        getattr(self, counts)[:size] += np.bincount(epoch, minlength=size)
+        if sums_sq:
+            getattr(self, sums_sq)[:size] += np.bincount(epoch, weights=values * values, minlength=size)
+
+    def accumulate(self, accel_ts=(), accel_xyz=(), hr_ts=(), hr_bpm=()):
+        """
+        Add samples to the epoch sums without rescoring.
+        """
+        accel_xyz = np.asarray(accel_xyz, dtype=np.float32).reshape(-1, 3)
+        if len(accel_xyz):
+            magnitude = np.abs(np.sqrt(np.einsum("ij,ij->i", accel_xyz, accel_xyz)) - 1.0) * 1000
+            self._accumulate(accel_ts, magnitude, "activity_sum", counts="activity_count")
+        if len(hr_bpm):
+            self._accumulate(hr_ts, hr_bpm, "hr_sum", "hr_sum_sq", "hr_count")
+
+    def add_samples(self, accel_ts=(), accel_xyz=(), hr_ts=(), hr_bpm=()):
+        self.accumulate(accel_ts, accel_xyz, hr_ts, hr_bpm)
+        self._rescore()
+
+    def epoch_sums(self):
+        """
+        The epochs that received samples and {name: sums of those epochs} for every name in SUMS.
+        """
+        n = self.n_epochs
+        epochs = np.flatnonzero((self.activity_count[:n] > 0) | (self.hr_count[:n] > 0))
+        return epochs, {name: getattr(self, name)[epochs] for name in self.SUMS}
+
+    @classmethod
+    def from_epoch_sums(cls, start_ms: int, epochs, sums: dict):
+        """
+        Rebuild and score a night from epoch_sums output, or the totals of several of them.
+        """
+        epochs = np.asarray(epochs, dtype=np.int64)
+        hypnogram = cls(start_ms, capacity=max(int(epochs.max(initial=-1)) + 1, 1))
+        for name in cls.SUMS:
+            getattr(hypnogram, name)[epochs] = sums[name]
+        hypnogram.n_epochs = int(epochs.max(initial=-1)) + 1
+        hypnogram._rescore()
+        return hypnogram
+
+    def _rescore(self):
+        n = self.n_epochs
+        if n == 0:
+            return
+        activity_count = self.activity_count[:n]
+        hr_count = self.hr_count[:n]
+        safe_hr = np.maximum(hr_count, 1)
+        hr_mean = self.hr_sum[:n] / safe_hr
+        hr_std = np.sqrt(np.maximum(self.hr_sum_sq[:n] / safe_hr - hr_mean ** 2, 0))
+        self.stages = score_epochs(
+            (self.activity_sum[:n] / np.maximum(activity_count, 1))[None],
+            hr_mean[None], hr_std[None], (activity_count > 0)[None], (hr_count > 0)[None],
+        )[0]
+
+    def hypnogram(self):
+        return self.stages.copy()
@@ -0,0 +1,352 @@
+"""
+This file contains the heart-rate variability engine used by the stress microservice.
+
+HRVState keeps one user's beats of the last window_seconds in fixed-capacity ring buffers with
+running sums, so RMSSD, SDNN and pNN50 cost O(new beats) per update and not O(window). The LF/HF
+ratio comes from a Welch spectrum of the window resampled to an even grid; it is recomputed once per
+stride_seconds, not on every beat. The state packs to a few kilobytes of bytes and back, so it
+can be persisted between restarts. batch_hrv computes the same metrics at every stride of a long
+recording with prefix sums and one batched FFT, for backfills.
+"""
+import math, struct
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+LF_BAND = (0.04, 0.15)
+HF_BAND = (0.15, 0.40)
+NN50_MS = 50.0
+# Running sums are rebuilt from the window after this many beats, to cancel floating point drift
+EXACT_EVERY = 1000
+
+STATE_MAGIC = b"HRV1"
+# magic, capacity, count, nn50, updates since exact, sum_rr, sum_rr_sq, sum_diff_sq,
+# last spectral ts, lf, hf, baseline rmssd
+STATE_HEADER = struct.Struct("<4sIIII7d")
+
+
+class HRVSettings:
+    """
+    Engine parameters read once from configs/stress.json.
+    """
+    def __init__(self, config: dict):
+        self.window_ms = float(config.get("window_seconds", 300)) * 1000
+        self.stride_ms = float(config.get("stride_seconds", 30)) * 1000
+        self.resample_hz = float(config.get("resample_hz", 4))
+        self.segment = int(config.get("welch_segment_seconds", 64) * self.resample_hz)
+        self.min_rr_ms = float(config.get("min_rr_ms", 300))
+        self.max_rr_ms = float(config.get("max_rr_ms", 2000))
+        self.baseline_alpha = float(config.get("baseline_alpha", 0.02))
+        max_heart_rate = float(config.get("max_heart_rate", 220))
+        self.capacity = int(math.ceil(self.window_ms / 60000 * max_heart_rate)) + 1
+
+
+def clean_beats(ts_ms, rr_ms, settings: HRVSettings, after_ms=-math.inf):
+    """
+    Sort beats by time, drop duplicates, beats not after after_ms and non-physiological intervals.
+    """
+    ts_ms = np.asarray(ts_ms, dtype=np.float64)
+    rr_ms = np.asarray(rr_ms, dtype=np.float64)
+    order = np.argsort(ts_ms, kind="stable")
+    ts_ms, rr_ms = ts_ms[order], rr_ms[order]
+    keep = (rr_ms >= settings.min_rr_ms) & (rr_ms <= settings.max_rr_ms) & (ts_ms > after_ms)
+    keep[1:] &= ts_ms[1:] > ts_ms[:-1]
+    return ts_ms[keep], rr_ms[keep]
+
+
+def band_powers(resampled, settings: HRVSettings):
+    """
+    Welch LF and HF power of evenly resampled RR intervals, over the last axis of `resampled`.
+
+    Segments are Hann-windowed and overlap by half; a window shorter than one segment
+    is used as a single segment.
+    """
+    segment = min(settings.segment, resampled.shape[-1])
+    if segment < 8:
+        nan = np.full(resampled.shape[:-1], np.nan)
+        return nan, nan
+    segments = sliding_window_view(resampled, segment, axis=-1)[..., ::max(segment // 2, 1), :]
+    segments = segments - segments.mean(axis=-1, keepdims=True)
+    taper = np.hanning(segment)
+    power = np.abs(np.fft.rfft(segments * taper, axis=-1)) ** 2
+    psd = power.mean(axis=-2) / (settings.resample_hz * (taper ** 2).sum())
+    freqs = np.fft.rfftfreq(segment, 1 / settings.resample_hz)
+    step = freqs[1]
+    lf = psd[..., (freqs >= LF_BAND[0]) & (freqs < LF_BAND[1])].sum(axis=-1) * step
+    hf = psd[..., (freqs >= HF_BAND[0]) & (freqs < HF_BAND[1])].sum(axis=-1) * step
+    return lf, hf
+
+
+def stress_score(rmssd, baseline_rmssd, lf_hf):
+    """
+    0 (relaxed) to 100 (stressed): RMSSD below the personal baseline and a high LF/HF ratio raise it.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vagal = np.nan_to_num(np.log(rmssd / baseline_rmssd), nan=0.0, posinf=0.0, neginf=0.0)
+        balance = np.nan_to_num(np.log(lf_hf), nan=0.0, posinf=0.0, neginf=0.0)
+    return np.clip(50 - 40 * vagal + 15 * balance, 0, 100)
+
+
+class HRVState:
+    """
+    One user's streaming HRV state over the last window_seconds of beats.
+    """
+    def __init__(self, settings: HRVSettings, capacity=None):
+        self.settings = settings
+        self.capacity = capacity or settings.capacity
+        self.ts = np.zeros(self.capacity)
+        self.rr = np.zeros(self.capacity)
+        self.head = 0
+        self.count = 0
+        self.nn50 = 0
+        self.updates = 0
+        self.sum_rr = 0.0
+        self.sum_rr_sq = 0.0
+        self.sum_diff_sq = 0.0
+        self.last_spectral_ts = -math.inf
+        self.lf = math.nan
+        self.hf = math.nan
+        self.baseline_rmssd = math.nan
+
+    def _positions(self, start, stop):
+        return (self.head + np.arange(start, stop)) % self.capacity
+
+    @property
+    def newest_ts(self) -> float:
+        return self.ts[(self.head + self.count - 1) % self.capacity] if self.count else -math.inf
+
+    def window(self):
+        """
+        Beat times and RR intervals of the window in time order (a copy).
+        """
+        positions = self._positions(0, self.count)
+        return self.ts[positions], self.rr[positions]
+
+    def _count_before(self, cutoff: float) -> int:
+        # The ring is sorted in logical order, so binary search each contiguous piece
+        end = self.head + self.count
+        if end <= self.capacity:
+            return int(np.searchsorted(self.ts[self.head:end], cutoff))
+        first = self.ts[self.head:]
+        in_first = int(np.searchsorted(first, cutoff))
+        if in_first < len(first):
+            return in_first
+        return len(first) + int(np.searchsorted(self.ts[:end - self.capacity], cutoff))
+
+    def _reset(self):
+        self.head = self.count = self.nn50 = self.updates = 0
+        self.sum_rr = self.sum_rr_sq = self.sum_diff_sq = 0.0
+
+    def _evict(self, evicted: int):
+        if evicted <= 0:
+            return
+        if evicted >= self.count:
+            self._reset()
+            return
+        # Include the first kept beat, its interval to the last evicted beat goes too
+        rr = self.rr[self._positions(0, evicted + 1)]
+        diffs = np.diff(rr)
+        self.sum_rr -= rr[:-1].sum()
+        self.sum_rr_sq -= (rr[:-1] ** 2).sum()
+        self.sum_diff_sq -= (diffs ** 2).sum()
+        self.nn50 -= int(np.count_nonzero(np.abs(diffs) > NN50_MS))
+        self.head = (self.head + evicted) % self.capacity
+        self.count -= evicted
+
+    def _rebuild_sums(self):
+        _, rr = self.window()
+        diffs = np.diff(rr)
+        self.sum_rr, self.sum_rr_sq = rr.sum(), (rr ** 2).sum()
+        self.sum_diff_sq = (diffs ** 2).sum()
+        self.nn50 = int(np.count_nonzero(np.abs(diffs) > NN50_MS))
+        self.updates = 0
+
+    def add_beats(self, ts_ms, rr_ms) -> int:
+        """
+        Append beats (timestamps and RR intervals in ms), evict the ones that left the window and
+        refresh the spectrum if a stride has passed. Returns the number of beats kept.
+        """
+        ts_ms, rr_ms = clean_beats(ts_ms, rr_ms, self.settings, after_ms=self.newest_ts)
+        added = len(ts_ms)
+        if added == 0:
+            return 0
+        if added >= self.capacity:
+            self._reset()
+            ts_ms, rr_ms = ts_ms[-self.capacity:], rr_ms[-self.capacity:]
+        elif self.count + added > self.capacity:
+            self._evict(self.count + added - self.capacity)
+
+        previous = self.rr[(self.head + self.count - 1) % self.capacity] if self.count else None
+        diffs = np.diff(rr_ms, prepend=previous) if previous is not None else np.diff(rr_ms)
+        positions = self._positions(self.count, self.count + len(ts_ms))
+        self.ts[positions] = ts_ms
+        self.rr[positions] = rr_ms
+        self.count += len(ts_ms)
+        self.sum_rr += rr_ms.sum()
+        self.sum_rr_sq += (rr_ms ** 2).sum()
+        self.sum_diff_sq += (diffs ** 2).sum()
+        self.nn50 += int(np.count_nonzero(np.abs(diffs) > NN50_MS))
+
+        self._evict(self._count_before(self.newest_ts - self.settings.window_ms))
+        self.updates += len(ts_ms)
+        if self.updates >= EXACT_EVERY:
+            self._rebuild_sums()
+        if self.newest_ts - self.last_spectral_ts >= self.settings.stride_ms:
+            self._update_spectrum()
+        return added
+
+    def merge_beats(self, ts_ms, rr_ms) -> int:
+        """
+        Merge beats that need not be newer than the window, such as beats another worker received
+        for the same user: union with the window by timestamp, trim to window_seconds from the newest
+        beat, then recompute the running sums and the spectrum. The baseline is left as it is.
+        Returns the number of beats in the window.
+        """
+        window_ts, window_rr = self.window()
+        ts_ms, rr_ms = clean_beats(np.concatenate((window_ts, np.asarray(ts_ms, dtype=np.float64))),
+                                   np.concatenate((window_rr, np.asarray(rr_ms, dtype=np.float64))), self.settings)
+        if len(ts_ms) == 0:
+            return self.count
+        keep = ts_ms >= ts_ms[-1] - self.settings.window_ms
+        ts_ms, rr_ms = ts_ms[keep][-self.capacity:], rr_ms[keep][-self.capacity:]
+        self._reset()
+        self.ts[:len(ts_ms)] = ts_ms
+        self.rr[:len(rr_ms)] = rr_ms
+        self.count = len(ts_ms)
+        self._rebuild_sums()
+        self._update_spectrum(update_baseline=False)
+        return self.count
+
+    def _update_spectrum(self, update_baseline: bool = True):
+        ts, rr = self.window()
+        self.last_spectral_ts = self.newest_ts
+        if len(ts) < 2:
+            return
+        grid = np.arange(ts[0], ts[-1], 1000 / self.settings.resample_hz)
+        lf, hf = band_powers(np.interp(grid, ts, rr), self.settings)
+        self.lf, self.hf = float(lf), float(hf)
+        if not update_baseline:
+            return
+        rmssd = self.time_domain()["rmssd"]
+        if not math.isnan(rmssd):
+            alpha = self.settings.baseline_alpha
+            self.baseline_rmssd = rmssd if math.isnan(self.baseline_rmssd) \
+                else (1 - alpha) * self.baseline_rmssd + alpha * rmssd
+
+    def time_domain(self) -> dict:
+        n = self.count
+        if n < 2:
+            return {"mean_hr": math.nan, "rmssd": math.nan, "sdnn": math.nan, "pnn50": math.nan}
+        mean_rr = self.sum_rr / n
+        return {
+            "mean_hr": 60000 / mean_rr,
+            "rmssd": math.sqrt(max(self.sum_diff_sq, 0.0) / (n - 1)),
+            "sdnn": math.sqrt(max(self.sum_rr_sq - self.sum_rr * mean_rr, 0.0) / (n - 1)),
+            "pnn50": 100 * self.nn50 / (n - 1),
+        }
+
+    def metrics(self) -> dict:
+        metrics = self.time_domain()
+        lf_hf = self.lf / self.hf if self.hf > 0 else math.nan
+        metrics.update({
+            "lf": self.lf,
+            "hf": self.hf,
+            "lf_hf": lf_hf,
+            "baseline_rmssd": self.baseline_rmssd,
+            "stress": float(stress_score(metrics["rmssd"], self.baseline_rmssd, lf_hf)),
+            "beats": self.count,
+            "window_end_ms": self.newest_ts if self.count else None,
+        })
+        return metrics
+
+    def to_bytes(self) -> bytes:
+        ts, rr = self.window()
+        header = STATE_HEADER.pack(
+            STATE_MAGIC, self.capacity, self.count, self.nn50, self.updates,
+            self.sum_rr, self.sum_rr_sq, self.sum_diff_sq, self.last_spectral_ts,
+            self.lf, self.hf, self.baseline_rmssd,
+        )
+        return header + ts.astype("<f8").tobytes() + rr.astype("<f4").tobytes()
+
+    @classmethod
+    def from_bytes(cls, payload: bytes, settings: HRVSettings):
+        (magic, capacity, count, nn50, updates, sum_rr, sum_rr_sq, sum_diff_sq,
+         last_spectral_ts, lf, hf, baseline_rmssd) = STATE_HEADER.unpack_from(payload)
+        if magic != STATE_MAGIC:
+            raise ValueError("Unknown HRV state format")
+        state = cls(settings, capacity=max(capacity, settings.capacity))
+        offset = STATE_HEADER.size
+        state.ts[:count] = np.frombuffer(payload, dtype="<f8", count=count, offset=offset)
+        state.rr[:count] = np.frombuffer(payload, dtype="<f4", count=count, offset=offset + count * 8)
+        state.count, state.nn50, state.updates = count, nn50, updates
+        state.sum_rr, state.sum_rr_sq, state.sum_diff_sq = sum_rr, sum_rr_sq, sum_diff_sq
+        state.last_spectral_ts, state.lf, state.hf, state.baseline_rmssd = last_spectral_ts, lf, hf, baseline_rmssd
+        # RR intervals are stored as float32, so the sums are rebuilt from what was restored
+        state._rebuild_sums()
+        return state
+
+
+def batch_hrv(ts_ms, rr_ms, settings: HRVSettings, baseline_rmssd=math.nan):
+    """
+    HRV metrics of every window ending at each stride of a recording, for backfills.
+
+    Time-domain metrics come from prefix sums (O(beats + windows)); the spectra of all
+    windows come from one batched FFT over a strided view of the resampled recording.
+    Returns a dict of arrays keyed like HRVState.metrics, plus window_end_ms.
+    """
+    ts, rr = clean_beats(ts_ms, rr_ms, settings)
+    if len(ts) < 2:
+        return {"window_end_ms": np.empty(0)}
+
+    window_end = np.arange(ts[0] + settings.stride_ms, ts[-1] + settings.stride_ms, settings.stride_ms)
+    window_end[-1] = min(window_end[-1], ts[-1])
+    hi = np.searchsorted(ts, window_end, side="right")
+    lo = np.searchsorted(ts, window_end - settings.window_ms, side="left")
+    n = (hi - lo).astype(np.float64)
+
+    diffs = np.diff(rr, prepend=rr[0])
+    prefix_rr = np.concatenate(([0.0], np.cumsum(rr)))
+    prefix_rr_sq = np.concatenate(([0.0], np.cumsum(rr ** 2)))
+    prefix_diff_sq = np.concatenate(([0.0], np.cumsum(diffs ** 2)))
+    prefix_nn50 = np.concatenate(([0], np.cumsum(np.abs(diffs) > NN50_MS)))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # The interval into the first beat of a window belongs to the previous window
+        first_diff = np.minimum(lo + 1, hi)
+        n_diffs = np.where(n > 1, n - 1, np.nan)
+        sum_rr = prefix_rr[hi] - prefix_rr[lo]
+        rmssd = np.sqrt((prefix_diff_sq[hi] - prefix_diff_sq[first_diff]) / n_diffs)
+        sdnn = np.sqrt(np.maximum(prefix_rr_sq[hi] - prefix_rr_sq[lo] - sum_rr ** 2 / n, 0) / n_diffs)
+        pnn50 = 100 * (prefix_nn50[hi] - prefix_nn50[first_diff]) / n_diffs
+        mean_hr = 60000 * n / sum_rr
+
+    # Every window becomes a row of a strided view over one resampled recording
+    step_ms = 1000 / settings.resample_hz
+    grid = np.arange(ts[0], ts[-1] + step_ms, step_ms)
+    resampled = np.interp(grid, ts, rr)
+    length = min(int(settings.window_ms / step_ms), len(grid))
+    starts = np.clip(np.ceil((window_end - settings.window_ms - ts[0]) / step_ms).astype(np.int64), 0, len(grid) - length)
+    lf, hf = band_powers(sliding_window_view(resampled, length)[starts], settings)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lf_hf = np.where(hf > 0, lf / hf, np.nan)
+
+    # The baseline is an exponential average over windows, a short recurrence on window scalars
+    baseline = np.empty(len(window_end))
+    alpha = settings.baseline_alpha
+    for i, value in enumerate(rmssd.tolist()):
+        if not math.isnan(value):
+            baseline_rmssd = value if math.isnan(baseline_rmssd) else (1 - alpha) * baseline_rmssd + alpha * value
+        baseline[i] = baseline_rmssd
+
+    return {
+        "window_end_ms": window_end,
+        "mean_hr": mean_hr,
+        "rmssd": rmssd,
+        "sdnn": sdnn,
+        "pnn50": pnn50,
+        "lf": lf,
+        "hf": hf,
+        "lf_hf": lf_hf,
+        "baseline_rmssd": baseline,
+        "stress": stress_score(rmssd, baseline, lf_hf),
+        "beats": n.astype(np.int64),
+    }
@@ -0,0 +1,260 @@
+"""This FastAPI file defines the stress microservice. Wearables upload beat-to-beat (RR) intervals,
+each user's streaming HRV state turns them into RMSSD, SDNN, pNN50, LF/HF and a stress score. States
+are kept in memory, written to the hrv_states table in the background and on shutdown, and loaded
+back on a user's first request after a restart. Saves compare and swap on a version column, so
+workers that served the same user merge their beats instead of overwriting each other."""
+
+import asyncio, json, logging, math
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import select
+from backend.core import signals
+from backend.core.security import current_user_id
+from backend.database.db_pool_manager import get_database_connection
+from backend.database.database_query_functions import dialect_insert
+from backend.database.models import hrv_states
+from backend.services.stress.hrv import HRVSettings, HRVState, batch_hrv
+
+STRESS_FILE = "./configs/stress.json"
+
+
+def load_stress_config(file_path: str = STRESS_FILE) -> dict:
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except Exception as e:
+        logging.exception(f"Error loading stress config: {e}")
+        return {}
+
+
+class HRVStateStore:
+    """
+    Per-worker cache of HRV states, saved with a compare-and-swap on hrv_states.version.
+
+    Changed states are marked dirty and flushed in bulk, together with the beats each one received
+    since its last save. A save only applies if the row still has the version this worker loaded;
+    when another worker saved the user in between, the newer state is loaded, the unsaved beats are
+    replayed onto it and the save is retried, so no worker overwrites another's beats. Clean states
+    beyond max_cached_states are dropped least recently used first.
+    """
+    def __init__(self, settings: HRVSettings, max_cached_states: int = 10000, max_attempts: int = 3):
+        self.settings = settings
+        self.max_cached_states = max_cached_states
+        self.max_attempts = max_attempts
+        self.states = OrderedDict()
+        self.versions = {}  # user_id: version of the row the cached state is based on, 0 if none
+        self.pending = {}  # user_id: [(ts_ms, rr_ms, baseline_rmssd)] not saved yet
+        self.dirty = set()
+        self.locks = {}
+        self.flush_lock = asyncio.Lock()
+        self.conflicts = 0
+
+    async def get(self, user_id: int) -> HRVState:
+        state = self.states.get(user_id)
+        if state is not None:
+            self.states.move_to_end(user_id)
+            return state
+
+        # Concurrent first requests of one user load the state once
+        lock = self.locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            state = self.states.get(user_id)
+            if state is None:
+                loaded = await self.load([user_id])
+                state, self.versions[user_id] = loaded.get(user_id, (HRVState(self.settings), 0))
+                self.states[user_id] = state
+                self.evict()
+        self.locks.pop(user_id, None)
+        return state
+
+    async def load(self, user_ids) -> dict:
+        """
+        Return {user_id: (state, version)} of the users that have a saved state.
+        """
+        db_conn = await get_database_connection()
+        async with db_conn.engine.connect() as connection:
+            rows = (await connection.execute(
+                select(hrv_states.c.user_id, hrv_states.c.state, hrv_states.c.version)
+                .where(hrv_states.c.user_id.in_(list(user_ids)))
+            )).all()
+        loaded = {}
+        for user_id, payload, version in rows:
+            try:
+                loaded[user_id] = (HRVState.from_bytes(payload, self.settings), version)
+            except Exception as e:
+                logging.error(f"Discarding unreadable HRV state of user {user_id}: {e}")
+                loaded[user_id] = (HRVState(self.settings), version)
+        return loaded
+
+    def mark_dirty(self, user_id: int, ts_ms, rr_ms):
+        """
+        Record beats that were added to the user's cached state, for the next flush.
+        """
+        self.pending.setdefault(user_id, []).append((ts_ms, rr_ms, self.states[user_id].baseline_rmssd))
+        self.dirty.add(user_id)
+
+    def evict(self):
+        for user_id in list(self.states):
+            if len(self.states) <= self.max_cached_states:
+                break
+            if user_id not in self.dirty:
+                del self.states[user_id]
+                self.versions.pop(user_id, None)
+
+    async def save(self, users) -> set:
+        """
+        Write the cached states of users where the row still has the expected version, in one
+        statement. Returns the users another worker saved in between.
+        """
+        rows = [{"user_id": user_id, "state": self.states[user_id].to_bytes(), "version": self.versions[user_id] + 1}
+                for user_id in users]
+        db_conn = await get_database_connection()
+        async with db_conn.engine.begin() as connection:
+            stmt = dialect_insert(connection, hrv_states)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[hrv_states.c.user_id],
+                set_={"state": stmt.excluded.state, "version": stmt.excluded.version},
+                where=hrv_states.c.version == stmt.excluded.version - 1,
+            ).returning(hrv_states.c.user_id)
+            saved = {user_id for user_id, in (await connection.execute(stmt, rows)).all()}
+        for row in rows:
+            if row["user_id"] in saved:
+                self.versions[row["user_id"]] = row["version"]
+        return set(users) - saved
+
+    async def rebase(self, users, taken: dict):
+        """
+        Replace the cached states of users by the newest saved ones, with this worker's unsaved
+        beats merged in by timestamp: the other worker may hold newer beats than these, so they are
+        not appended but merged into its window. taken holds the beats of the failed save and is
+        extended by the ones that arrived since, as the next save covers them all.
+        """
+        loaded = await self.load(users)
+        for user_id in users:
+            state, self.versions[user_id] = loaded.get(user_id, (HRVState(self.settings), 0))
+            taken[user_id] += self.pending.pop(user_id, [])
+            if taken[user_id]:
+                state.merge_beats(np.concatenate([ts_ms for ts_ms, _, _ in taken[user_id]]),
+                                  np.concatenate([rr_ms for _, rr_ms, _ in taken[user_id]]))
+                if math.isnan(state.baseline_rmssd):
+                    state.baseline_rmssd = taken[user_id][-1][2]
+            self.states[user_id] = state
+
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.dirty:
+                return
+            dirty, self.dirty = self.dirty, set()
+            users = [user_id for user_id in dirty if user_id in self.states]
+            taken = {user_id: self.pending.pop(user_id, []) for user_id in users}
+            try:
+                for _ in range(self.max_attempts):
+                    conflicts = await self.save(users)
+                    if not conflicts:
+                        break
+                    self.conflicts += len(conflicts)
+                    await self.rebase(conflicts, taken)
+                    users = list(conflicts)
+                else:
+                    logging.warning(f"{len(conflicts)} HRV states still conflicted after {self.max_attempts} attempts")
+                    self.keep_dirty(conflicts, taken)
+            except Exception as e:
+                logging.exception(f"Error saving {len(users)} HRV states: {e}")
+                self.keep_dirty(users, taken)
+                return
+            self.evict()
+
+    def keep_dirty(self, users, taken: dict):
+        """
+        Leave users for the next flush, their unsaved beats ahead of any that arrived since.
+        """
+        for user_id in users:
+            self.pending[user_id] = taken[user_id] + self.pending.get(user_id, [])
+        self.dirty |= set(users)
+
+    async def run_flusher(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+
+stress_config = load_stress_config()
+settings = HRVSettings(stress_config)
+state_store = HRVStateStore(settings, int(stress_config.get("max_cached_states", 10000)))
+MAX_BATCH_BEATS = int(stress_config.get("max_batch_beats", 200000))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    flusher = asyncio.create_task(state_store.run_flusher(float(stress_config.get("flush_interval_seconds", 30))))
+    yield
+    flusher.cancel()
+    await state_store.flush()
+
+
+# Merged into the application lifespan by include_router
+router = APIRouter(lifespan=lifespan)
+
+
+def to_json(value):
+    """
+    Floats and arrays with NaN (not enough beats yet) become JSON null.
+    """
+    if isinstance(value, np.ndarray):
+        return [None if isinstance(item, float) and math.isnan(item) else item for item in value.tolist()]
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+async def read_beats(request: Request):
+    """
+    Parse {"beats": [[ts_ms, rr_ms], ...]} into two arrays.
+    """
+    try:
+        beats = np.asarray(json.loads(await request.body())["beats"], dtype=np.float64)
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Body must be a JSON object with a beats list of [ts_ms, rr_ms]")
+    if beats.size == 0:
+        return np.empty(0), np.empty(0)
+    if beats.ndim != 2 or beats.shape[1] != 2:
+        raise HTTPException(status_code=400, detail="Every beat must be [ts_ms, rr_ms]")
+    if len(beats) > MAX_BATCH_BEATS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_BEATS} beats per request")
+    return beats[:, 0], beats[:, 1]
+
+
+# Streaming update endpoint
+@router.post("/beats")
+async def add_beats(request: Request, user_id: int = Depends(current_user_id)):
+    ts_ms, rr_ms = await read_beats(request)
+    state = await state_store.get(user_id)
+    if state.add_beats(ts_ms, rr_ms):
+        state_store.mark_dirty(user_id, ts_ms, rr_ms)
+        signals.emit(signals.STRESS, user_id)
+    return {key: to_json(value) for key, value in state.metrics().items()}
+
+
+# Current HRV metrics and stress score
+@router.get("/current")
+async def current_stress(user_id: int = Depends(current_user_id)):
+    state = await state_store.get(user_id)
+    return {key: to_json(value) for key, value in state.metrics().items()}
+
+
+# Backfill endpoint: metrics at every stride of a past recording; newer beats also seed the streaming state
+@router.post("/backfill")
+async def backfill(request: Request, user_id: int = Depends(current_user_id)):
+    ts_ms, rr_ms = await read_beats(request)
+    state = await state_store.get(user_id)
+    series = batch_hrv(ts_ms, rr_ms, settings, baseline_rmssd=state.baseline_rmssd)
+    if len(series["window_end_ms"]):
+        if math.isnan(state.baseline_rmssd):
+            state.baseline_rmssd = float(series["baseline_rmssd"][-1])
+        recent = ts_ms >= ts_ms.max() - settings.window_ms
+        if state.add_beats(ts_ms[recent], rr_ms[recent]):
+            state_store.mark_dirty(user_id, ts_ms[recent], rr_ms[recent])
+        signals.emit(signals.STRESS, user_id)
+    return {key: to_json(value) for key, value in series.items()}
@@ -0,0 +1,254 @@
+"""
+This file contains the in-process load test of the whole app.
+
+backend.server.app is driven through httpx's ASGI transport, with a throwaway SQLite database
+swapped into DatabaseConnection (db_url) and a low bcrypt cost factor, so the numbers measure the
+app and not Postgres or hashing. Scenarios:
+- signup: POST /users/signup with a new email each time (the verification email is only queued as a job);
+- login: POST /users/login of an active user (rate limit lifted);
+- rate_limited: POST /users/login from a whitelisted IP over its limit, answered by the 429 handler;
+- suspended_ip: any request from a suspended IP, answered by the security middleware;
+- blocked_path: GET of a blocked path, answered by the security middleware.
+
+Each scenario reports throughput and p50/p95/p99 latency, and is valid only if every measured request
+got its expected status (EXPECTED_STATUS); a run with an invalid scenario exits with status 1, and
+compare refuses to compare it. Results are written as JSON (by default
+to benchmarks/results/<commit>.json), and two result files can be compared:
+
+Run from the repository root:
+    python -m benchmarks.app_suite run [--requests N] [--concurrency C] [--output path]
+    python -m benchmarks.app_suite compare base.json new.json [--threshold 10]
+"""
+import argparse, asyncio, json, logging, os, platform, shutil, subprocess, sys, tempfile, time
+import httpx
+import numpy as np
+from sqlalchemy import update
+
+SCENARIOS = ("signup", "login", "rate_limited", "suspended_ip", "blocked_path")
+# signup and login pay for bcrypt, so they run fewer requests than the fast paths
+REQUEST_SHARE = {"signup": 0.1, "login": 0.2, "rate_limited": 1.0, "suspended_ip": 1.0, "blocked_path": 1.0}
+# Anything else means the scenario measured some other code path, an error page for instance
+EXPECTED_STATUS = {"signup": 200, "login": 200, "rate_limited": 429, "suspended_ip": 429, "blocked_path": 405}
+BCRYPT_ROUNDS = 4
+PASSWORD = "benchmark-password"
+SUSPENDED_IP = "10.9.9.9"
+RESULTS_DIR = "benchmarks/results"
+WARMUP = 50  # unmeasured requests before each scenario
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except Exception:
+        return "unknown"
+
+
+async def drive(send_one, total: int, concurrency: int, expected: int, warmup: int = 0) -> dict:
+    """
+    Call send_one(i) for i in range(total) from concurrency workers and summarize the latencies.
+    The first warmup calls (numbered from total up) are left out, so lazy imports and cold caches
+    do not end up in the tail latencies. The result is valid if every call returned the expected status.
+    """
+    for i in range(total, total + warmup):
+        await send_one(i)
+    latencies = np.empty(total)
+    statuses = {}
+    pending = iter(range(total))
+
+    async def worker():
+        for i in pending:
+            start = time.perf_counter()
+            status = await send_one(i)
+            latencies[i] = time.perf_counter() - start
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "expected_status": expected,
+        "valid": set(statuses) == {expected},
+    }
+
+
+def client_for(app, ip: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(ip, 50000)), base_url="http://bench")
+
+
+async def run_suite(requests: int, concurrency: int) -> dict:
+    from main import app
+    import backend.global_variables as configs
+    from backend.database import metadata
+    from backend.database.auth import shutdown_bcrypt_pool
+    from backend.database.database_connection import DatabaseConnection
+    from backend.database.db_pool_manager import clients_pool
+    from backend.database.models import users
+    from backend.limiter import suspension_store, whitelisted_ips
+
+    # After the app import, which sets up logging and loads the configs
+    logging.getLogger().setLevel(logging.WARNING)
+    # slowapi warns on every rejected request, which would flood the report of rate_limited
+    logging.getLogger("slowapi").setLevel(logging.ERROR)
+    configs.MISC_CONFIG = {**configs.MISC_CONFIG, "bcrypt_rounds": BCRYPT_ROUNDS}
+
+    data_dir = tempfile.mkdtemp(dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    # SQLite allows one writer at a time, so a single pooled connection avoids lock errors
+    db_conn = DatabaseConnection(f"sqlite+aiosqlite:///{os.path.join(data_dir, 'suite.db')}",
+                                 pool_overrides={"pool_size": 1, "max_overflow": 0})
+    await db_conn.init_db()
+    async with db_conn.engine.begin() as connection:
+        await connection.run_sync(metadata.create_all)
+    clients_pool["database_connection"] = db_conn
+
+    results = {}
+    async with client_for(app, "10.1.0.1") as client:
+        async def signup(i):
+            response = await client.post("/users/signup", json={"email": f"user{i}@example.com", "password": PASSWORD})
+            return response.status_code
+        results["signup"] = await drive(signup, max(1, int(requests * REQUEST_SHARE["signup"])), concurrency,
+                                    EXPECTED_STATUS["signup"])
+
+    async with db_conn.session_factory() as session:
+        await session.execute(update(users).where(users.c.email == "user0@example.com").values(is_active=True))
+        await session.commit()
+    login_body = {"email": "user0@example.com", "password": PASSWORD}
+
+    configs.RATE_LIMITER_CONFIG = {**configs.RATE_LIMITER_CONFIG, "general_rl": "1000000/minute"}
+    async with client_for(app, "10.1.0.2") as client:
+        async def login(i):
+            return (await client.post("/users/login", json=login_body)).status_code
+        results["login"] = await drive(login, max(1, int(requests * REQUEST_SHARE["login"])), concurrency,
+                                   EXPECTED_STATUS["login"], WARMUP)
+
+    # A whitelisted IP is never suspended, so every request over the limit reaches the 429 handler
+    configs.RATE_LIMITER_CONFIG = {**configs.RATE_LIMITER_CONFIG, "general_rl": "1/hour"}
+    async with client_for(app, next(iter(sorted(whitelisted_ips)))) as client:
+        await client.post("/users/login", json=login_body)
+
+        async def rate_limited(i):
+            return (await client.post("/users/login", json=login_body)).status_code
+        results["rate_limited"] = await drive(rate_limited, requests, concurrency, EXPECTED_STATUS["rate_limited"], WARMUP)
+
+    suspension_store.suspend(SUSPENDED_IP, 3600)
+    async with client_for(app, SUSPENDED_IP) as client:
+        async def suspended(i):
+            return (await client.post("/users/login", json=login_body)).status_code
+        results["suspended_ip"] = await drive(suspended, requests, concurrency, EXPECTED_STATUS["suspended_ip"], WARMUP)
+
+    async with client_for(app, "10.1.0.3") as client:
+        async def blocked(i):
+            return (await client.get("/.env")).status_code
+        results["blocked_path"] = await drive(blocked, requests, concurrency, EXPECTED_STATUS["blocked_path"], WARMUP)
+
+    shutdown_bcrypt_pool()
+    await db_conn.engine.dispose()
+    shutil.rmtree(data_dir)
+    return results
+
+
+def print_results(results: dict):
+    print(f"{'scenario':<14}{'requests':>9}{'req/s':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  statuses")
+    for name in SCENARIOS:
+        r = results[name]
+        print(f"{name:<14}{r['requests']:>9}{r['throughput_rps']:>11,.1f}{r['p50_ms']:>9.3f}{r['p95_ms']:>9.3f}"
+              f"{r['p99_ms']:>9.3f}  {r['statuses']}{'' if r['valid'] else ' INVALID, expected ' + str(r['expected_status'])}")
+
+
+def change(old: float, new: float) -> float:
+    return (new / old - 1) * 100 if old else 0.0
+
+
+def invalid_scenarios(results: dict) -> list:
+    return [name for name in SCENARIOS if name in results and not results[name].get("valid", True)]
+
+
+def compare(base: dict, new: dict, threshold: float) -> list:
+    """
+    Print old -> new per scenario and return the regressions: throughput down, or p95/p99 up,
+    by more than threshold percent. A scenario that is invalid in either file is a regression too,
+    its numbers belong to some other code path.
+    """
+    regressions = []
+    print(f"base {base['commit']}  ->  new {new['commit']}  (threshold {threshold:g}%)")
+    for name in SCENARIOS:
+        old, current = base["scenarios"].get(name), new["scenarios"].get(name)
+        if old is None or current is None:
+            print(f"{name:<14} missing in one of the files")
+            continue
+        invalid = [label for label, result in (("base", old), ("new", current)) if not result.get("valid", True)]
+        if invalid:
+            regressions.append(f"{name} is invalid in {' and '.join(invalid)}: statuses {old['statuses']} -> {current['statuses']}")
+            print(f"{name:<14}invalid in {' and '.join(invalid)}, not compared")
+            continue
+        cells = []
+        for key, worse_if_higher in (("throughput_rps", False), ("p50_ms", True), ("p95_ms", True), ("p99_ms", True)):
+            delta = change(old[key], current[key])
+            regressed = (delta > threshold if worse_if_higher else delta < -threshold) and key != "p50_ms"
+            if regressed:
+                regressions.append(f"{name} {key} {old[key]} -> {current[key]} ({delta:+.1f}%)")
+            cells.append(f"{key.replace('_ms', '').replace('_rps', '')} {old[key]:g}->{current[key]:g} "
+                         f"({delta:+.1f}%){' !' if regressed else ''}")
+        print(f"{name:<14}" + " | ".join(cells))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process load test of the FastAPI app")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run every scenario and write the results as JSON")
+    run.add_argument("--requests", type=int, default=5000, help="requests for the fast scenarios")
+    run.add_argument("--concurrency", type=int, default=16)
+    run.add_argument("--output", help=f"result file, default {RESULTS_DIR}/<commit>.json")
+    diff = commands.add_parser("compare", help="compare two result files")
+    diff.add_argument("base")
+    diff.add_argument("new")
+    diff.add_argument("--threshold", type=float, default=10.0, help="percent change counted as a regression")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold)
+        if regressions:
+            print("regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        return
+
+    commit = git_commit()
+    results = asyncio.run(run_suite(args.requests, args.concurrency))
+    print_results(results)
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "scenarios": results,
+        }, f, indent=2)
+    print(f"results written to {output}")
+    invalid = invalid_scenarios(results)
+    if invalid:
+        print(f"invalid scenarios (unexpected statuses): {', '.join(invalid)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+This file contains a micro-benchmark for event-loop latency while passwords are being hashed.
+
+A ticker coroutine wakes up every TICK_INTERVAL seconds and records how late it was woken.
+With inline hashing the ticker stalls for the whole bcrypt round, with the process pool
+it should stay flat.
+
+Run from the repository root:
+    python -m benchmarks.bench_bcrypt_event_loop [concurrent_hashes]
+"""
+import asyncio, statistics, sys, time
+import backend.global_variables as configs
+from backend.database import auth
+
+TICK_INTERVAL = 0.005
+
+
+async def ticker(stop: asyncio.Event, lags: list):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + TICK_INTERVAL
+        await asyncio.sleep(TICK_INTERVAL)
+        lags.append(loop.time() - expected)
+
+
+async def inline_hash(password: str):
+    return auth.hash_password(password)
+
+
+async def run_scenario(hash_coroutine, concurrency: int):
+    stop = asyncio.Event()
+    lags = []
+    ticker_task = asyncio.create_task(ticker(stop, lags))
+    await asyncio.sleep(TICK_INTERVAL * 4)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(hash_coroutine(f"password-{i}") for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker_task
+    lags_ms = sorted(lag * 1000 for lag in lags)
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "loop_lag_p50_ms": round(statistics.median(lags_ms), 2),
+        "loop_lag_p99_ms": round(lags_ms[int(len(lags_ms) * 0.99) - 1], 2),
+        "loop_lag_max_ms": round(lags_ms[-1], 2),
+    }
+
+
+async def main(concurrency: int):
+    configs.load_configs()
+    # Warm the pool so process start-up is not counted against the async variant
+    await auth.hash_password_async("warmup")
+
+    for name, hash_coroutine in (("inline", inline_hash), ("process_pool", auth.hash_password_async)):
+        result = await run_scenario(hash_coroutine, concurrency)
+        print(f"{name:>13}: {result}")
+
+    auth.shutdown_bcrypt_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 16))
@@ -0,0 +1,89 @@
+"""
+This file contains the benchmark of wearable ingestion against the target of 50k samples per second
+per API worker.
+
+"request path" is the work an upload does before it answers: parse a packed binary batch, validate
+it and append it to the buffer. "end to end" also flushes the buffer to a throwaway SQLite
+database, with the batch dedup, cursor and time-series writes, so it is the sustained rate of one
+worker with its share of the database work. Postgres is usually faster on the write side.
+
+Run from the repository root:
+    python -m benchmarks.bench_device_ingest [devices] [batches_per_device] [samples_per_batch]
+"""
+import asyncio, os, shutil, sys, tempfile, time
+import numpy as np
+from sqlalchemy import func, select
+from backend.database import metadata, timeseries
+from backend.database.database_connection import DatabaseConnection
+from backend.database.db_pool_manager import clients_pool
+from backend.database.models import device_metric_chunks
+from backend.device_ingest import (BINARY_HEADER, BINARY_MAGIC, SAMPLE_DTYPE, SampleBuffer, SampleValidator,
+                                   device_config, parse_binary)
+
+TARGET_SAMPLES_PER_SECOND = 50_000
+
+
+def binary_batch(rng, start_ms: int, samples: int) -> bytes:
+    records = np.zeros(samples, dtype=SAMPLE_DTYPE)
+    records["metric"] = 1
+    records["ts_ms"] = start_ms + np.arange(samples) * 1000
+    records["value"] = 60 + 20 * rng.random(samples)
+    return BINARY_HEADER.pack(BINARY_MAGIC, samples) + records.tobytes()
+
+
+async def run(buffer: SampleBuffer, validator: SampleValidator, bodies, flush: bool):
+    start = time.perf_counter()
+    for user_id, device_id, seq, body in bodies:
+        metric, ts_ms, value = parse_binary(body)
+        valid = validator.valid_mask(metric, ts_ms, value)
+        await buffer.add(user_id, device_id, seq, metric[valid], ts_ms[valid], value[valid], rejected=0)
+        if flush and buffer.size >= buffer.flush_samples:
+            await buffer.flush()
+    request_seconds = time.perf_counter() - start
+    if flush:
+        await buffer.flush()
+    return request_seconds, time.perf_counter() - start
+
+
+async def main(devices: int, batches: int, samples: int):
+    data_dir = tempfile.mkdtemp(dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    db_conn = DatabaseConnection(f"sqlite+aiosqlite:///{os.path.join(data_dir, 'ingest.db')}",
+                                 pool_overrides={"pool_size": 1, "max_overflow": 0})
+    await db_conn.init_db()
+    async with db_conn.engine.begin() as connection:
+        await connection.run_sync(metadata.create_all)
+    clients_pool["database_connection"] = db_conn
+    timeseries._timeseries_store = timeseries.TimeSeriesStore(db_conn.engine)
+
+    rng = np.random.default_rng(0)
+    start_ms = int(time.time() * 1000) - batches * samples * 1000
+    bodies = [
+        (user_id, f"watch-{user_id}", seq, binary_batch(rng, start_ms + seq * samples * 1000, samples))
+        for seq in range(batches) for user_id in range(devices)
+    ]
+    total = devices * batches * samples
+    validator = SampleValidator(device_config)
+    config = {**device_config, "max_buffered_samples": 10**9}
+
+    request_seconds, _ = await run(SampleBuffer({**config, "flush_samples": 10**9}), validator, bodies, flush=False)
+    print(f"{devices} devices x {batches} batches x {samples} samples = {total:,} samples, "
+          f"flush every {config.get('flush_samples', 50000):,} samples")
+    print(f"request path: {total / request_seconds:>12,.0f} samples/s")
+    _, total_seconds = await run(SampleBuffer(config), validator, bodies, flush=True)
+    rate = total / total_seconds
+    async with db_conn.engine.connect() as connection:
+        stored = (await connection.execute(select(func.sum(device_metric_chunks.c.sample_count)))).scalar()
+    assert stored == total, (stored, total)
+    print(f"end to end:   {rate:>12,.0f} samples/s "
+          f"({'meets' if rate >= TARGET_SAMPLES_PER_SECOND else 'misses'} the {TARGET_SAMPLES_PER_SECOND:,} target)")
+
+    await db_conn.engine.dispose()
+    shutil.rmtree(data_dir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 250,
+    ))
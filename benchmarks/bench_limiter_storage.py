@@ -0,0 +1,69 @@
+"""
+This file contains a benchmark of the rate limit storages: per-process memory vs the shared SQLite file.
+
+It reports per-call latency of a rate limit hit and a suspension lookup, then checks that
+concurrent worker processes hitting the same key through the shared file never lose an update.
+
+Run from the repository root:
+    python -m benchmarks.bench_limiter_storage [iterations]
+"""
+import multiprocessing, os, sys, tempfile, time
+from limits import parse
+from limits.strategies import FixedWindowRateLimiter
+from limits.storage import MemoryStorage
+from backend.limiter import SuspensionStore
+from backend.limiter_storage import SQLiteStorage, SharedSuspensionStore
+
+WORKERS = 4
+
+
+def time_per_call(func, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(i)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def hammer(uri, iterations):
+    limiter = FixedWindowRateLimiter(SQLiteStorage(uri))
+    item = parse("1000000/hour")
+    for _ in range(iterations):
+        limiter.hit(item, "shared-key")
+
+
+def main(iterations):
+    state_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    path = os.path.join(state_dir, f"bench-limiter-{os.getpid()}.db")
+    uri = f"sqlite://{path}"
+    item = parse("1000000/hour")
+
+    try:
+        for name, storage in (("memory", MemoryStorage()), ("sqlite", SQLiteStorage(uri))):
+            limiter = FixedWindowRateLimiter(storage)
+            micros = time_per_call(lambda i: limiter.hit(item, f"ip-{i % 1000}"), iterations)
+            print(f"{name:>7} rate limit hit:     {micros:7.2f} us/call")
+
+        for name, store in (("memory", SuspensionStore()), ("sqlite", SharedSuspensionStore(path))):
+            for i in range(1000):
+                store.suspend(f"ip-{i}", 200)
+            micros = time_per_call(lambda i: store.is_suspended(f"ip-{i % 2000}"), iterations)
+            print(f"{name:>7} suspension lookup:  {micros:7.2f} us/call")
+
+        per_worker = iterations // WORKERS
+        processes = [multiprocessing.Process(target=hammer, args=(uri, per_worker)) for _ in range(WORKERS)]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        count = SQLiteStorage(uri).get(item.key_for("shared-key"))
+        print(f"{WORKERS} processes, {per_worker * WORKERS} hits in {elapsed:.2f}s, counted {count}")
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,83 @@
+"""
+This file contains the benchmark of the nutrition food index: build time, load time, autocomplete
+latency for prefix and misspelled queries, and meal totals throughput.
+
+A synthetic catalogue of generated food names is written to a temporary CSV and indexed with the
+same build_index the CLI uses.
+
+Run from the repository root:
+    python -m benchmarks.bench_nutrition_search [foods]
+"""
+import csv, os, shutil, sys, tempfile, time
+import numpy as np
+from backend.services.nutrition.food_index import FoodIndex, build_index
+
+WORDS = ("apple banana cherry yogurt greek chicken breast roasted grilled salmon fillet brown rice "
+         "whole wheat bread oat milk almond butter peanut cheddar cheese tomato soup lentil spinach "
+         "raw boiled fried sweet potato beef steak pork chop turkey egg white plain low fat sugar free "
+         "orange juice coffee black tea green honey dark chocolate granola bar protein shake").split()
+NUTRIENTS = ["energy_kcal", "protein_g", "fat_g", "carbohydrate_g", "fiber_g", "sugar_g", "sodium_mg", "calcium_mg"]
+QUERIES = ["gre", "greek yog", "chick", "sal", "choc", "pean", "whole wheat br", "spinach raw"]
+TYPOS = ["yoghurt", "chiken brest", "salomn", "chedar chese", "brocoli", "protien shake"]
+
+
+def write_catalogue(path: str, foods: int, rng):
+    words = np.array(WORDS)
+    lengths = rng.integers(2, 6, foods)
+    picks = rng.integers(0, len(words), lengths.sum())
+    values = rng.random((foods, len(NUTRIENTS))) * [500, 40, 40, 80, 15, 40, 1000, 300]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name"] + NUTRIENTS)
+        start = 0
+        for i, length in enumerate(lengths.tolist()):
+            name = " ".join(words[picks[start:start + length]]).capitalize() + f" #{i}"
+            start += length
+            writer.writerow([name] + [f"{value:.2f}" for value in values[i]])
+
+
+def latency(function, queries, repeat=50):
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            function(query)
+            samples.append(time.perf_counter() - start)
+    samples = np.array(samples) * 1000
+    return np.percentile(samples, 50), np.percentile(samples, 99)
+
+
+def main(foods: int):
+    rng = np.random.default_rng(11)
+    work_dir = tempfile.mkdtemp()
+    csv_path, index_dir = os.path.join(work_dir, "foods.csv"), os.path.join(work_dir, "index")
+    write_catalogue(csv_path, foods, rng)
+
+    start = time.perf_counter()
+    build_index(csv_path, index_dir)
+    print(f"build:        {time.perf_counter() - start:8.2f} s for {foods} foods")
+
+    start = time.perf_counter()
+    index = FoodIndex(index_dir)
+    print(f"load:         {(time.perf_counter() - start) * 1000:8.2f} ms")
+
+    index.search("warm up")
+    p50, p99 = latency(lambda query: index.search(query, 10), QUERIES)
+    print(f"prefix:       p50 {p50:.3f} ms  p99 {p99:.3f} ms")
+    p50, p99 = latency(lambda query: index.search(query, 10), TYPOS)
+    print(f"typo:         p50 {p50:.3f} ms  p99 {p99:.3f} ms")
+    print(f"  'chiken brest' -> {[result['name'] for result in index.search('chiken brest', 3)]}")
+
+    meals, items = 1000, 6
+    meal_ptr = np.arange(0, meals * items + 1, items)
+    food_ids = rng.integers(0, foods, meals * items)
+    grams = rng.uniform(20, 300, meals * items)
+    start = time.perf_counter()
+    index.meal_totals(meal_ptr, food_ids, grams)
+    elapsed = time.perf_counter() - start
+    print(f"meal totals:  {meals / elapsed:10,.0f} meals/s ({items} items each)")
+    shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300000)
@@ -0,0 +1,60 @@
+"""
+This file contains the benchmark of recommender throughput against catalogue size.
+
+For every catalogue size it measures top-k queries answered one at a time (one matrix-vector
+product each) and queries from many concurrent requests answered through the MicroBatcher
+(one matrix-matrix product per batch), plus the cost of an in-place item update.
+
+Run from the repository root:
+    python -m benchmarks.bench_recommender [dim]
+"""
+import asyncio, sys, time
+import numpy as np
+from backend.services.recommender.index import EmbeddingIndex, MicroBatcher
+
+CATALOGUE_SIZES = (10_000, 100_000, 1_000_000)
+QUERIES = 2000
+CONCURRENCY = 256
+K = 10
+
+
+async def batched(index, queries):
+    batcher = MicroBatcher(index, window_ms=2, max_batch=CONCURRENCY)
+    pending = list(range(len(queries)))
+
+    async def client():
+        while pending:
+            await batcher.query(queries[pending.pop()], K)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - start
+    return len(queries) / elapsed, batcher.stats()
+
+
+def main(dim: int):
+    rng = np.random.default_rng(5)
+    queries = rng.standard_normal((QUERIES, dim)).astype(np.float32)
+    print(f"dim {dim}, k {K}, {CONCURRENCY} concurrent clients for the batched run")
+    for size in CATALOGUE_SIZES:
+        index = EmbeddingIndex(dim)
+        index.upsert_items(np.arange(size), rng.standard_normal((size, dim)).astype(np.float32))
+
+        single_queries = queries[:max(20, QUERIES * 10_000 // size)]
+        start = time.perf_counter()
+        for query in single_queries:
+            index.top_k(query[None], K)
+        single = len(single_queries) / (time.perf_counter() - start)
+
+        throughput, stats = asyncio.run(batched(index, queries))
+
+        start = time.perf_counter()
+        index.upsert_items(rng.integers(0, size, 1000), rng.standard_normal((1000, dim)))
+        update_ms = (time.perf_counter() - start) * 1000
+
+        print(f"{size:>9} items: single {single:9,.0f} q/s | batched {throughput:9,.0f} q/s "
+              f"(avg batch {stats['queries'] / stats['batches']:.0f}) | update 1000 items {update_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 64)
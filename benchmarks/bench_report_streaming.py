@@ -0,0 +1,109 @@
+"""
+This file contains the benchmark of streamed report rendering: time to first byte, total time and
+peak Python memory of a health report as the covered period grows.
+
+Hourly rollups for every device metric are seeded into a throwaway SQLite database swapped into
+the pool manager, then /reports/health is called straight through the ASGI interface so the
+moment of the first body chunk can be recorded exactly.
+
+Run from the repository root:
+    python -m benchmarks.bench_report_streaming [days]
+"""
+import asyncio, logging, os, shutil, sys, tempfile, time, tracemalloc
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from backend.database import metadata
+from backend.database.auth import create_access_token
+from backend.database.database_connection import DatabaseConnection
+from backend.database.db_pool_manager import clients_pool
+from backend.database.models import device_metric_rollups
+from backend.device_ingest import device_config
+
+USER_ID = 1
+DAY_MS = 86_400_000
+
+
+async def seed(engine, days: int, end_ms: int):
+    rng = np.random.default_rng(2)
+    codes = [metric["code"] for metric in device_config["metrics"].values()]
+    rows = []
+    for resolution in (3600, 86400):
+        buckets = np.arange(end_ms - days * DAY_MS, end_ms, resolution * 1000)
+        for code in codes:
+            means = rng.normal(60, 10, len(buckets))
+            rows += [{"user_id": USER_ID, "metric": code, "resolution": resolution, "bucket_start": int(bucket),
+                      "sample_count": 3600, "value_sum": float(mean * 3600), "value_min": float(mean - 15),
+                      "value_max": float(mean + 20)} for bucket, mean in zip(buckets, means)]
+    async with engine.begin() as connection:
+        await connection.execute(device_metric_rollups.insert(), rows)
+    return len(rows)
+
+
+async def fetch(app, query: str):
+    token = create_access_token({"sub": str(USER_ID)})
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": "/reports/health", "raw_path": b"/reports/health", "query_string": query.encode(),
+             "root_path": "", "headers": [(b"authorization", f"Bearer {token}".encode()), (b"host", b"bench")],
+             "client": ("10.0.0.1", 1234), "server": ("bench", 80)}
+    timings = {"first_byte": None, "bytes": 0, "status": None}
+    requested, finished = [], asyncio.Event()
+    start = time.perf_counter()
+
+    async def receive():
+        # The request has no body; after that the client just waits, as a real one would
+        if not requested:
+            requested.append(True)
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            timings["status"] = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            if timings["first_byte"] is None:
+                timings["first_byte"] = time.perf_counter() - start
+            timings["bytes"] += len(message["body"])
+        if message["type"] == "http.response.body" and not message.get("more_body"):
+            finished.set()
+
+    tracemalloc.start()
+    await app(scope, receive, send)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return timings, time.perf_counter() - start, peak
+
+
+async def main(days: int):
+    from main import app
+    logging.getLogger().setLevel(logging.WARNING)
+
+    data_dir = tempfile.mkdtemp(dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(data_dir, 'reports.db')}", pool_size=1, max_overflow=0)
+    async with engine.begin() as connection:
+        await connection.run_sync(metadata.create_all)
+    db_conn = DatabaseConnection()
+    db_conn.engine = engine
+    db_conn.session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    clients_pool["database_connection"] = db_conn
+
+    end_ms = 1_790_000_000_000 // DAY_MS * DAY_MS
+    print(f"seeded {await seed(engine, days, end_ms)} rollup rows for {days} days")
+    await fetch(app, f"start_ms={end_ms - DAY_MS}&end_ms={end_ms}")  # compile the template
+
+    for span in sorted({7, 30, 90, min(days, 365), days}):
+        for resolution in ("daily", "hourly"):
+            for output in ("html", "csv"):
+                query = f"start_ms={end_ms - span * DAY_MS}&end_ms={end_ms}&resolution={resolution}&format={output}"
+                timings, total, peak = await fetch(app, query)
+                print(f"{span:>4} days {resolution:>6} {output:>4}: status {timings['status']} "
+                      f"ttfb {timings['first_byte'] * 1000:6.1f} ms, total {total * 1000:7.1f} ms, "
+                      f"{timings['bytes'] / 1e6:6.2f} MB sent, peak {peak / 1e6:5.2f} MB")
+
+    await engine.dispose()
+    shutil.rmtree(data_dir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 365))
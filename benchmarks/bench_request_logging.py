@@ -0,0 +1,93 @@
+"""
+This file contains the benchmark of request logging overhead in the security middleware.
+
+Requests go through SecurityMiddleware in front of an app that answers at once, so the time per
+request is almost all middleware and logging. The log sink is either /dev/null or a slow stream
+that takes 50 microseconds per write, like a log pipe whose reader is falling behind. Setups:
+- sync: the old StreamHandler writing on the event loop, every line;
+- queue: QueueHandler/QueueListener pipeline (JSON), every line;
+- queue 1%: the same pipeline with the route sampled at 1%;
+- off: access lines disabled.
+
+Run from the repository root:
+    python -m benchmarks.bench_request_logging [requests]
+"""
+import asyncio, json, logging, os, shutil, sys, tempfile, time
+from backend.core import config, logging_pipeline
+from backend.core.security import SecurityMiddleware
+from backend.limiter import SuspensionStore
+
+SLOW_WRITE_SECONDS = 0.00005
+
+
+class SlowStream:
+    def write(self, text):
+        time.sleep(SLOW_WRITE_SECONDS)
+
+    def flush(self):
+        pass
+
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def use_logging_config(directory: str, settings: dict):
+    with open(os.path.join(directory, "logging.json"), "w") as f:
+        json.dump(settings, f)
+    config.reload(directory)
+
+
+async def run(requests: int) -> float:
+    middleware = SecurityMiddleware(ok_app, SuspensionStore(), blocked_paths=[], allowed_paths={})
+    scope = {"type": "http", "path": "/users/login", "method": "POST", "client": ("10.0.0.1", 1234)}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await middleware(dict(scope), receive, send)
+    return (time.perf_counter() - start) / requests
+
+
+def main(requests: int):
+    directory = tempfile.mkdtemp()
+    root_logger = logging.getLogger()
+    print(f"{requests} requests per setup, microseconds per request on the event loop")
+    for sink_name, open_sink in (("/dev/null", lambda: open(os.devnull, "w")), ("slow pipe", SlowStream)):
+        for setup in ("sync", "queue", "queue 1%", "off"):
+            settings = {"format": "json", "queue_size": 10000,
+                        "access_sample_rate": 0.0 if setup == "off" else 1.0,
+                        "route_sample_rates": {"/users": 0.01} if setup == "queue 1%" else {}}
+            use_logging_config(directory, settings)
+            sink = open_sink()
+            listener = None
+            if setup == "sync":
+                for handler in root_logger.handlers[:]:
+                    root_logger.removeHandler(handler)
+                handler = logging.StreamHandler(sink)
+                handler.setFormatter(logging.Formatter(logging_pipeline.LOG_FORMAT, logging_pipeline.DATE_FORMAT))
+                root_logger.addHandler(handler)
+                root_logger.setLevel(logging.INFO)
+            else:
+                listener = logging_pipeline.setup_logging(logger_names=(), stream=sink)
+            logging_pipeline.stats.update(queued=0, dropped=0, sampled_out=0)
+
+            per_request = asyncio.run(run(requests))
+            drain_start = time.perf_counter()
+            if listener is not None:
+                listener.stop()
+            drain = time.perf_counter() - drain_start
+            stats = logging_pipeline.logging_stats()
+            print(f"{sink_name:>9} {setup:>8}: {per_request * 1e6:7.2f} us/request | queued {stats['queued']:>6} "
+                  f"dropped {stats['dropped']:>6} sampled out {stats['sampled_out']:>6} | drain {drain * 1000:7.1f} ms")
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,84 @@
+"""
+This file contains a requests-per-second comparison of the security middleware implementations.
+
+"legacy" is the former @app.middleware("http") check_ip function running on BaseHTTPMiddleware,
+"asgi" is backend.core.security.SecurityMiddleware. Both wrap the same trivial FastAPI app
+and are driven in-process through httpx's ASGI transport, for an allowed and a blocked path.
+Request logging is silenced so only the middleware itself is measured.
+
+Run from the repository root:
+    python -m benchmarks.bench_security_middleware [requests]
+"""
+import asyncio, logging, sys, time
+import httpx
+from fastapi import FastAPI, Request
+from starlette.responses import JSONResponse
+from slowapi.util import get_remote_address
+from backend.core.security import SecurityMiddleware
+from backend.limiter import SuspensionStore
+
+CONCURRENCY = 32
+
+
+def build_app(kind: str) -> FastAPI:
+    app = FastAPI()
+    suspension_store = SuspensionStore()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    if kind == "asgi":
+        app.add_middleware(
+            SecurityMiddleware,
+            suspension_store=suspension_store,
+            blocked_paths=[".env", ".git", "configs", "DB_connection"],
+            allowed_paths={".env": ["assets/environment"]},
+        )
+        return app
+
+    @app.middleware("http")
+    async def check_ip(request: Request, call_next):
+        request_url = str(request.url)
+        logging.info(f"client URL - {request_url}, method - {request.method}")
+        if ".env" in request_url and "assets/environment" not in request_url:
+            return JSONResponse(content={"error": "You are not allowed to see this page"}, status_code=405)
+        if ".git" in request_url:
+            return JSONResponse(content={"error": "You are not allowed to see this page"}, status_code=405)
+        if "configs" in request_url:
+            return JSONResponse(content={"error": "You are not allowed to see this page"}, status_code=405)
+        if "DB_connection" in request_url:
+            return JSONResponse(content={"error": "You are not allowed to see this page"}, status_code=405)
+        if get_remote_address(request) in suspension_store:
+            return JSONResponse(content={"message": "IP is suspended. Try again later."}, status_code=429)
+        return await call_next(request)
+
+    return app
+
+
+async def measure(app: FastAPI, path: str, total: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        remaining = total
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                await client.get(path)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+        return total / (time.perf_counter() - start)
+
+
+async def main(total: int):
+    logging.getLogger().setLevel(logging.WARNING)
+    for path in ("/ping", "/.env"):
+        for kind in ("legacy", "asgi"):
+            rps = await measure(build_app(kind), path, total)
+            print(f"{kind:>6} {path:<6} {rps:10.0f} req/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
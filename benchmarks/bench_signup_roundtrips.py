@@ -0,0 +1,92 @@
+"""
+This file contains a load test counting database round trips per signup, before and after
+the single INSERT ... ON CONFLICT ... RETURNING rewrite. Since the verification email became a
+job in the same transaction, "after" also counts that INSERT (2 round trips per signup).
+
+"before" replays the former SELECT / INSERT / SELECT sequence, "after" drives the real
+/users/signup endpoint in-process. Both run against a throwaway SQLite database swapped into
+the pool manager, with a low bcrypt cost factor so hashing does not dominate. Every cursor
+execution is counted as one round trip.
+
+Run from the repository root:
+    python -m benchmarks.bench_signup_roundtrips [signups]
+"""
+import asyncio, logging, os, shutil, sys, tempfile, time
+import httpx
+from sqlalchemy import event, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+import backend.global_variables as configs
+from backend.database import metadata
+from backend.database.database_connection import DatabaseConnection
+from backend.database.db_pool_manager import clients_pool
+from backend.database.models import users
+
+CONCURRENCY = 16
+
+
+async def legacy_signup(session_maker, email: str):
+    async with session_maker() as session:
+        if (await session.execute(select(users.c.id).where(users.c.email == email))).first():
+            return None
+        await session.execute(insert(users).values(email=email, hashed_password="x"))
+        user_id = (await session.execute(select(users.c.id).where(users.c.email == email))).scalar_one()
+        await session.commit()
+        return user_id
+
+
+async def run(label, signup, total, round_trips):
+    round_trips[0] = 0
+    queue = list(range(total))
+
+    async def worker():
+        while queue:
+            await signup(f"{label}-{queue.pop()}@example.com")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:>6}: {round_trips[0] / total:.2f} round trips/signup, {total / elapsed:8.1f} signups/s")
+
+
+async def main(total: int):
+    from main import app
+
+    # after the app import, which reloads the configs and the logging setup
+    logging.getLogger().setLevel(logging.WARNING)
+    # The config snapshot is read-only, so the module global is pointed at a modified copy
+    configs.MISC_CONFIG = {**configs.MISC_CONFIG, "bcrypt_rounds": 4}
+
+    data_dir = tempfile.mkdtemp(dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    path = os.path.join(data_dir, "signup.db")
+    # SQLite allows one writer at a time, so a single pooled connection avoids lock errors
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", pool_size=1, max_overflow=0)
+    async with engine.begin() as connection:
+        await connection.run_sync(metadata.create_all)
+
+    round_trips = [0]
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count(*args):
+        round_trips[0] += 1
+
+    db_conn = DatabaseConnection()
+    db_conn.engine = engine
+    db_conn.session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    clients_pool["database_connection"] = db_conn
+
+    await run("before", lambda email: legacy_signup(db_conn.session_factory, email), total, round_trips)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def signup(email):
+            response = await client.post("/users/signup", json={"email": email, "password": "secret"})
+            response.raise_for_status()
+        await run("after", signup, total, round_trips)
+
+    await engine.dispose()
+    shutil.rmtree(data_dir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,115 @@
+"""
+This file contains the benchmark of the sleep staging engine for one night and for 10k nights.
+
+"one night" stages an 8 hour night from raw samples (accelerometer at 10 Hz, heart rate at 1 Hz),
+once with a per-sample Python loop building the epoch features and once with the vectorized
+engine. "batch" stages many nights at once from epoch features, the way wearables that
+pre-aggregate activity counts report them. "incremental" feeds one night in 5 minute uploads.
+
+Run from the repository root:
+    python -m benchmarks.bench_sleep_staging [nights]
+"""
+import math, sys, time
+import numpy as np
+from backend.services.sleep.staging import (EPOCH_MS, IncrementalHypnogram, score_epochs,
+                                            stage_nights)
+
+NIGHT_HOURS = 8
+ACCEL_HZ = 10
+HR_HZ = 1
+
+
+def synthetic_night(rng, start_ms=0):
+    """
+    Restless first and last half hour, 90 minute cycles of heart rate, occasional movement.
+    """
+    n_accel = NIGHT_HOURS * 3600 * ACCEL_HZ
+    accel_ts = start_ms + np.arange(n_accel, dtype=np.int64) * (1000 // ACCEL_HZ)
+    minutes = (accel_ts - start_ms) / 60000
+    restless = (minutes < 30) | (minutes > NIGHT_HOURS * 60 - 30) | (rng.random(n_accel) < 0.002)
+    noise = np.where(restless, 0.3, 0.005)[:, None] * rng.standard_normal((n_accel, 3))
+    accel_xyz = (noise + [0.0, 0.0, 1.0]).astype(np.float32)
+
+    n_hr = NIGHT_HOURS * 3600 * HR_HZ
+    hr_ts = start_ms + np.arange(n_hr, dtype=np.int64) * (1000 // HR_HZ)
+    cycle = np.sin(2 * math.pi * (hr_ts - start_ms) / (90 * 60000))
+    hr_bpm = (58 + 6 * cycle + rng.normal(0, 1.5, n_hr)).astype(np.float32)
+    return accel_ts, accel_xyz, hr_ts, hr_bpm
+
+
+def loop_features(start_ms, n_epochs, accel_ts, accel_xyz, hr_ts, hr_bpm):
+    """
+    Reference per-sample loop producing the same epoch features as the engine.
+    """
+    activity = [0.0] * n_epochs
+    activity_count = [0] * n_epochs
+    for ts, (x, y, z) in zip(accel_ts.tolist(), accel_xyz.tolist()):
+        epoch = (ts - start_ms) // EPOCH_MS
+        activity[epoch] += abs(math.sqrt(x * x + y * y + z * z) - 1.0) * 1000
+        activity_count[epoch] += 1
+    hr_sum, hr_sum_sq, hr_count = [0.0] * n_epochs, [0.0] * n_epochs, [0] * n_epochs
+    for ts, bpm in zip(hr_ts.tolist(), hr_bpm.tolist()):
+        epoch = (ts - start_ms) // EPOCH_MS
+        hr_sum[epoch] += bpm
+        hr_sum_sq[epoch] += bpm * bpm
+        hr_count[epoch] += 1
+    hr_mean = [s / max(c, 1) for s, c in zip(hr_sum, hr_count)]
+    hr_std = [math.sqrt(max(q / max(c, 1) - m * m, 0)) for q, c, m in zip(hr_sum_sq, hr_count, hr_mean)]
+    activity = [s / max(c, 1) for s, c in zip(activity, activity_count)]
+    return np.array([activity]), np.array([hr_mean]), np.array([hr_std])
+
+
+def timed(function, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(nights: int):
+    rng = np.random.default_rng(7)
+    accel_ts, accel_xyz, hr_ts, hr_bpm = synthetic_night(rng)
+    end_ms = NIGHT_HOURS * 3600 * 1000
+    n_epochs = end_ms // EPOCH_MS
+
+    loop_seconds, features = timed(lambda: score_epochs(*loop_features(0, n_epochs, accel_ts, accel_xyz, hr_ts, hr_bpm)), 1)
+    vector_seconds, (stages, _, summary) = timed(lambda: stage_nights(
+        [0], [end_ms], np.zeros(len(accel_ts), np.int64), accel_ts, accel_xyz,
+        np.zeros(len(hr_ts), np.int64), hr_ts, hr_bpm,
+    ))
+    agreement = np.mean(features[0] == stages[0])
+    print(f"one night ({len(accel_ts) + len(hr_ts)} samples, {n_epochs} epochs)")
+    print(f"  per-sample loop: {loop_seconds * 1000:9.1f} ms")
+    print(f"  vectorized:      {vector_seconds * 1000:9.1f} ms  ({loop_seconds / vector_seconds:.0f}x, "
+          f"{agreement:.1%} epochs agree, {summary['total_sleep_minutes'][0]:.0f} min asleep)")
+
+    chunk_ms = 5 * 60 * 1000
+    def incremental():
+        hypnogram = IncrementalHypnogram(0)
+        a_bounds = np.searchsorted(accel_ts, np.arange(0, end_ms + chunk_ms, chunk_ms))
+        h_bounds = np.searchsorted(hr_ts, np.arange(0, end_ms + chunk_ms, chunk_ms))
+        for a0, a1, h0, h1 in zip(a_bounds[:-1], a_bounds[1:], h_bounds[:-1], h_bounds[1:]):
+            hypnogram.add_samples(accel_ts[a0:a1], accel_xyz[a0:a1], hr_ts[h0:h1], hr_bpm[h0:h1])
+        return len(a_bounds) - 1
+    incremental_seconds, uploads = timed(incremental)
+    print(f"  incremental:     {incremental_seconds / uploads * 1000:9.2f} ms per 5 minute upload")
+
+    # Epoch features of many nights with varying length, padded into one (nights, epochs) batch
+    activity = np.abs(rng.normal(20, 15, (nights, n_epochs))).astype(np.float32)
+    activity[:, :60] += 200
+    activity[rng.random((nights, n_epochs)) < 0.02] += 300
+    cycle = np.sin(2 * math.pi * np.arange(n_epochs) / 180)
+    hr_mean = (rng.normal(60, 5, (nights, 1)) + 6 * cycle + rng.normal(0, 1.5, (nights, n_epochs))).astype(np.float32)
+    hr_std = np.abs(rng.normal(2, 0.5, (nights, n_epochs))).astype(np.float32)
+    lengths = rng.integers(n_epochs * 3 // 4, n_epochs + 1, nights)
+    present = np.arange(n_epochs) < lengths[:, None]
+
+    batch_seconds, batch_stages = timed(lambda: score_epochs(activity, hr_mean, hr_std, present, present, present))
+    print(f"batch of {nights} nights ({int(present.sum())} epochs)")
+    print(f"  vectorized:      {batch_seconds * 1000:9.1f} ms  ({nights / batch_seconds:,.0f} nights/s)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,95 @@
+"""
+This file contains the benchmark of stream_query: peak Python memory and rows per second of a
+full-table export as the table grows, next to fetching the same result in one piece.
+
+Rows are seeded with execute_many into a throwaway SQLite table. Each export is run under
+tracemalloc, so the peak covers every row object alive at the same time. With stream_query the
+peak should stay flat from 100k to 1M rows, since only one chunk is held at a time.
+
+Run from the repository root:
+    python -m benchmarks.bench_stream_query [max_rows] [chunk_size]
+"""
+import asyncio, os, shutil, sys, tempfile, time, tracemalloc
+from sqlalchemy import BigInteger, Column, Float, Integer, MetaData, Table, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from backend.database.database_query_functions import DEFAULT_CHUNK_SIZE, execute_many, stream_query
+
+SEED_BATCH = 50_000
+
+metadata = MetaData()
+samples = Table(
+    "export_samples",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", BigInteger, nullable=False),
+    Column("ts_ms", BigInteger, nullable=False),
+    Column("value", Float, nullable=False),
+)
+
+
+async def seed(session_maker, start: int, end: int):
+    for first in range(start, end, SEED_BATCH):
+        await execute_many(session_maker(), insert(samples), [
+            {"id": i, "user_id": i % 1000, "ts_ms": 1_700_000_000_000 + i * 1000, "value": i * 0.5}
+            for i in range(first, min(first + SEED_BATCH, end))
+        ])
+
+
+async def export_streamed(session_maker, rows: int, chunk_size: int) -> int:
+    statement = select(samples).where(samples.c.id < rows).order_by(samples.c.id)
+    count = 0
+    async for chunk in stream_query(session_maker(), statement, chunk_size=chunk_size):
+        count += len(chunk)
+    return count
+
+
+async def export_all(session_maker, rows: int, chunk_size: int) -> int:
+    async with session_maker() as session:
+        result = await session.execute(select(samples).where(samples.c.id < rows).order_by(samples.c.id))
+        return len(result.all())
+
+
+async def measure(export, session_maker, rows: int, chunk_size: int):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = await export(session_maker, rows, chunk_size)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert count == rows, (count, rows)
+    return peak / 2**20, rows / elapsed
+
+
+async def main(max_rows: int, chunk_size: int):
+    data_dir = tempfile.mkdtemp(dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(data_dir, 'export.db')}", pool_size=1, max_overflow=0)
+    async with engine.begin() as connection:
+        await connection.run_sync(metadata.create_all)
+    session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    sizes = [size for size in (100_000, 250_000, 500_000, 1_000_000) if size < max_rows] + [max_rows]
+    seeded = 0
+    print(f"chunk_size {chunk_size}")
+    print(f"{'rows':>10} {'streamed peak MB':>17} {'rows/s':>10} {'fetch-all peak MB':>18} {'rows/s':>10}")
+    for size in sizes:
+        await seed(session_maker, seeded, size)
+        seeded = size
+        streamed_peak, streamed_rate = await measure(export_streamed, session_maker, size, chunk_size)
+        # Fetching everything at once is only measured up to 250k rows, to keep the run short
+        if size <= 250_000:
+            all_peak, all_rate = await measure(export_all, session_maker, size, chunk_size)
+            fetched = f"{all_peak:>18.1f} {all_rate:>10,.0f}"
+        else:
+            fetched = f"{'-':>18} {'-':>10}"
+        print(f"{size:>10,} {streamed_peak:>17.2f} {streamed_rate:>10,.0f} {fetched}")
+
+    await engine.dispose()
+    shutil.rmtree(data_dir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_CHUNK_SIZE,
+    ))
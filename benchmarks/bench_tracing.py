@@ -0,0 +1,114 @@
+"""
+This file contains the benchmark of request tracing overhead.
+
+A day-long health report (JWT decode, pool checkout, SQL, template rendering) is requested
+through the whole app over the ASGI interface, against a throwaway SQLite database, with tracing
+off, sampled at 1% and at 100%. Setups are interleaved over several rounds, each starting with a
+different one, and the median round is reported, so drift in machine speed hits them all alike.
+
+Whole requests vary by more than the tracing cost, so the security middleware is also timed alone,
+in front of an app that adds two stages and answers at once, which isolates what tracing adds.
+
+Run from the repository root:
+    python -m benchmarks.bench_tracing [requests per round]
+"""
+import asyncio, json, logging, os, shutil, statistics, sys, tempfile, time
+import httpx
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from backend.core import config, tracing
+from backend.core.security import SecurityMiddleware
+from backend.database import metadata
+from backend.database.auth import create_access_token
+from backend.database.database_connection import DatabaseConnection
+from backend.database.db_pool_manager import clients_pool
+from backend.database.instrumentation import InstrumentedAsyncQueuePool, instrument_engine
+from backend.limiter import SuspensionStore
+
+SETUPS = {"off": 0.0, "1%": 0.01, "100%": 1.0}
+ROUNDS = 9
+
+
+def use_sample_rate(directory: str, rate: float):
+    with open(os.path.join(directory, "tracing.json"), "w") as f:
+        json.dump({"enabled": True, "sample_rate": rate, "server_timing": True}, f)
+    config.reload(directory)
+
+
+async def traced_app(scope, receive, send):
+    with tracing.span("sql"):
+        pass
+    tracing.record("db_checkout", 0.0001)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def middleware_only(requests: int) -> float:
+    middleware = SecurityMiddleware(traced_app, SuspensionStore(), blocked_paths=[], allowed_paths={})
+    scope = {"type": "http", "path": "/users/login", "method": "POST", "client": ("10.0.0.1", 1234)}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await middleware(dict(scope), receive, send)
+    return (time.perf_counter() - start) / requests
+
+
+async def main(requests: int):
+    from main import app
+    logging.getLogger().setLevel(logging.WARNING)
+
+    config_dir = tempfile.mkdtemp()
+    shutil.copytree(config.CONFIG_DIR, config_dir, dirs_exist_ok=True)
+    data_dir = tempfile.mkdtemp(dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(data_dir, 'tracing.db')}",
+                                 poolclass=InstrumentedAsyncQueuePool, pool_size=1, max_overflow=0)
+    instrument_engine(engine)
+    async with engine.begin() as connection:
+        await connection.run_sync(metadata.create_all)
+    db_conn = DatabaseConnection()
+    db_conn.engine = engine
+    db_conn.session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    clients_pool["database_connection"] = db_conn
+
+    headers = {"authorization": f"Bearer {create_access_token({'sub': '1'})}"}
+    url = "/reports/health?start_ms=0&end_ms=86400000"
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for _ in range(50):
+            await client.get(url, headers=headers)
+        results = {name: [] for name in SETUPS}
+        for round_number in range(ROUNDS):
+            # Each round starts with a different setup
+            names = list(SETUPS)[round_number % len(SETUPS):] + list(SETUPS)[:round_number % len(SETUPS)]
+            for name in names:
+                rate = SETUPS[name]
+                use_sample_rate(config_dir, rate)
+                start = time.perf_counter()
+                for _ in range(requests):
+                    await client.get(url, headers=headers)
+                results[name].append((time.perf_counter() - start) / requests)
+
+    baseline = statistics.median(results["off"])
+    print(f"{requests} requests x {ROUNDS} rounds per setup, median per request")
+    for name, times in results.items():
+        median = statistics.median(times)
+        print(f"tracing {name:>4}: {median * 1e6:8.1f} us/request ({(median / baseline - 1) * 100:+.2f}% vs off)")
+
+    print("middleware alone, 50000 requests per setup")
+    for name, rate in SETUPS.items():
+        use_sample_rate(config_dir, rate)
+        per_request = await middleware_only(50000)
+        print(f"tracing {name:>4}: {per_request * 1e6:8.2f} us/request")
+
+    await engine.dispose()
+    shutil.rmtree(data_dir)
+    shutil.rmtree(config_dir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
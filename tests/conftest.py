@@ -0,0 +1,33 @@
+"""
+This file contains the shared test fixtures. Tests run from the repository root, like the app,
+so the configs/ paths resolve.
+"""
+from contextlib import asynccontextmanager
+import pytest
+from backend.database import metadata
+from backend.database import timeseries
+from backend.database.database_connection import DatabaseConnection
+from backend.database.db_pool_manager import clients_pool
+
+
+@pytest.fixture
+def sqlite_database(tmp_path, monkeypatch):
+    """
+    Async context manager factory: a throwaway SQLite database with every table, swapped into the
+    pool manager and the time-series store for the duration of the block.
+    """
+    @asynccontextmanager
+    async def open_database():
+        db_conn = DatabaseConnection(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}",
+                                     pool_overrides={"pool_size": 1, "max_overflow": 0})
+        await db_conn.init_db()
+        async with db_conn.engine.begin() as connection:
+            await connection.run_sync(metadata.create_all)
+        monkeypatch.setitem(clients_pool, "database_connection", db_conn)
+        monkeypatch.setattr(timeseries, "_timeseries_store", timeseries.TimeSeriesStore(db_conn.engine))
+        try:
+            yield db_conn
+        finally:
+            await db_conn.engine.dispose()
+
+    return open_database
@@ -0,0 +1,12 @@
+"""
+This file contains the tests of DatabaseConnection against a throwaway SQLite database.
+"""
+import asyncio
+
+
+def test_ping_on_sqlite(sqlite_database):
+    async def ping():
+        async with sqlite_database() as db_conn:
+            return await db_conn.ping()
+
+    assert asyncio.run(ping())["alive"] is True
@@ -0,0 +1,88 @@
+"""
+This file contains the tests of the device ingestion buffer with several API workers, each
+simulated by its own SampleBuffer on one shared SQLite database.
+"""
+import asyncio, time
+import numpy as np
+from sqlalchemy import func, select
+from backend.database.models import device_ingest_batches, device_metric_chunks
+from backend.device_ingest import SampleBuffer, contiguous_seq, read_committed_seq
+
+USER_ID, DEVICE_ID = 7, "watch-1"
+CONFIG = {"flush_samples": 10**9, "flush_interval_seconds": 3600, "max_buffered_samples": 10**9}
+
+
+def batch(seq: int, samples: int = 10):
+    ts_ms = int(time.time() * 1000) - 60_000 + seq * samples * 10 + np.arange(samples, dtype=np.int64) * 10
+    return np.ones(samples, np.int64), ts_ms, np.full(samples, 60.0, np.float32)
+
+
+async def stored_samples(db_conn) -> int:
+    async with db_conn.engine.connect() as connection:
+        return (await connection.execute(select(func.sum(device_metric_chunks.c.sample_count)))).scalar() or 0
+
+
+def test_contiguous_seq():
+    assert contiguous_seq(-1, [0, 1, 2, 4]) == 2
+    assert contiguous_seq(3, [5, 6]) == 3
+    assert contiguous_seq(3, []) == 3
+
+
+def test_cursor_waits_for_batch_buffered_on_another_worker(sqlite_database):
+    async def run():
+        async with sqlite_database() as db_conn:
+            worker_a, worker_b = SampleBuffer(CONFIG), SampleBuffer(CONFIG)
+            for seq in (0, 1):
+                await worker_b.add(USER_ID, DEVICE_ID, seq, *batch(seq), rejected=0)
+            await worker_b.flush()
+            await worker_a.add(USER_ID, DEVICE_ID, 2, *batch(2), rejected=0)
+            await worker_b.add(USER_ID, DEVICE_ID, 3, *batch(3), rejected=0)
+            await worker_b.flush()
+            # seq 3 is stored, but seq 2 is still only buffered on worker A
+            assert await read_committed_seq(USER_ID, DEVICE_ID) == 1
+            await worker_a.flush()
+            assert await read_committed_seq(USER_ID, DEVICE_ID) == 3
+            async with db_conn.engine.connect() as connection:
+                assert (await connection.execute(select(func.count()).select_from(device_ingest_batches))).scalar() == 0
+            assert await stored_samples(db_conn) == 40
+
+    asyncio.run(run())
+
+
+def test_retry_on_another_worker_is_stored_once(sqlite_database):
+    async def run():
+        async with sqlite_database() as db_conn:
+            worker_a, worker_b = SampleBuffer(CONFIG), SampleBuffer(CONFIG)
+            samples = batch(0)
+            assert await worker_a.add(USER_ID, DEVICE_ID, 0, *samples, rejected=0)
+            # The client timed out and retried, the load balancer picked the other worker
+            assert await worker_b.add(USER_ID, DEVICE_ID, 0, *samples, rejected=0)
+            await worker_a.flush()
+            await worker_b.flush()
+            assert await stored_samples(db_conn) == 10
+            assert await read_committed_seq(USER_ID, DEVICE_ID) == 0
+            # Once committed, a retry is recognized at once on both workers
+            assert not await worker_a.add(USER_ID, DEVICE_ID, 0, *samples, rejected=0)
+            assert not await worker_b.add(USER_ID, DEVICE_ID, 0, *samples, rejected=0)
+
+    asyncio.run(run())
+
+
+def test_oversized_body_is_rejected(monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from backend.core.security import current_user_id
+    from backend.routes import devices
+
+    monkeypatch.setattr(devices, "MAX_BODY_BYTES", 1024)
+    app = FastAPI()
+    app.include_router(devices.router)
+    app.dependency_overrides[current_user_id] = lambda: USER_ID
+    client = TestClient(app)
+    response = client.post(f"/devices/{DEVICE_ID}/samples?seq=0", content=b"\0" * 2048,
+                           headers={"content-type": "application/octet-stream"})
+    assert response.status_code == 413
+    # Without a Content-Length the body is counted while it streams in
+    response = client.post(f"/devices/{DEVICE_ID}/samples?seq=0", content=iter([b"\0" * 512] * 4),
+                           headers={"content-type": "application/octet-stream"})
+    assert response.status_code == 413
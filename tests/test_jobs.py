@@ -0,0 +1,108 @@
+"""
+This file contains the tests of the job queue and worker: outcomes are written only by the worker
+holding the job and forgotten only once committed, email jobs running together are sent in one
+SMTP session, and pooled SMTP connections are returned only when their thread is done with them.
+"""
+import asyncio, threading
+from sqlalchemy import func, select
+from backend.jobs import queue
+from backend.jobs.handlers import EmailSender
+from backend.jobs.worker import JobWorker
+from backend.database.models import jobs
+from backend.mail.mailer import get_mailer
+from backend.mail.smtp_sink import SMTPSink
+
+
+async def job_count(engine) -> int:
+    async with engine.connect() as connection:
+        return (await connection.execute(select(func.count()).select_from(jobs))).scalar()
+
+
+def test_outcomes_need_the_lock(sqlite_database):
+    async def run():
+        async with sqlite_database() as db_conn:
+            async with db_conn.engine.begin() as connection:
+                await queue.enqueue(connection, "analytics", {})
+                [job] = await queue.claim(connection, "analytics", 1, "worker-a")
+                # worker-a stops sending heartbeats, its job goes to worker-b
+                assert await queue.recover_stale(connection, -1) == 1
+                [job] = await queue.claim(connection, "analytics", 1, "worker-b")
+                assert await queue.complete(connection, "worker-a", [job.id]) == 0
+                assert await queue.fail(connection, "worker-a", job, "late failure") is None
+                assert await queue.complete(connection, "worker-b", [job.id]) == 1
+            assert await job_count(db_conn.engine) == 0
+
+    asyncio.run(run())
+
+
+def test_outcomes_are_kept_when_the_commit_fails(sqlite_database):
+    async def run():
+        async with sqlite_database() as db_conn:
+            worker = JobWorker(["analytics"], worker_id="worker-a")
+            async with db_conn.engine.begin() as connection:
+                await queue.enqueue(connection, "analytics", {})
+                [job] = await queue.claim(connection, "analytics", 1, worker.worker_id)
+            worker.finished.append(job.id)
+            try:
+                async with db_conn.engine.begin() as connection:
+                    await worker._flush(connection)
+                    raise ConnectionError("connection lost before the commit")
+            except ConnectionError:
+                pass
+            assert worker.finished == [job.id] and await job_count(db_conn.engine) == 1
+
+            await worker.poll(db_conn.engine)
+            assert worker.finished == [] and worker.stats["completed"] == 1
+            assert await job_count(db_conn.engine) == 0
+
+    asyncio.run(run())
+
+
+class BlockingConnection:
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def send_batch(self, messages):
+        self.started.set()
+        self.release.wait(5)
+        return []
+
+    def close(self):
+        pass
+
+
+def test_cancelled_send_returns_its_connection_after_the_thread():
+    async def run():
+        sender = EmailSender()
+        sender.start()
+        connection = BlockingConnection()
+        sender.connections = [connection]
+
+        task = asyncio.create_task(sender.send("user@example.com", "Subject", "Body"))
+        await asyncio.to_thread(connection.started.wait, 5)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # The thread is still sending, the connection must not be handed to another job yet
+        assert sender.connections == []
+        connection.release.set()
+        await asyncio.wait_for(sender.close(), 5)
+
+    asyncio.run(run())
+
+
+def test_email_jobs_started_together_share_one_session(monkeypatch):
+    async def run():
+        async with SMTPSink() as sink:
+            mailer = get_mailer()
+            for name, value in (("host", sink.host), ("port", sink.port), ("user", None), ("use_tls", False)):
+                monkeypatch.setattr(mailer, name, value)
+            sender = EmailSender()
+            sink.fail_next("550 No such user")
+            results = await asyncio.gather(
+                *(sender.send(f"user{i}@example.com", "Subject", "Body") for i in range(10)), return_exceptions=True)
+            await sender.close()
+        assert isinstance(results[0], queue.PermanentJobError) and results[1:] == [None] * 9
+        assert len(sink.messages) == 9 and sink.connections == 1
+
+    asyncio.run(run())
@@ -0,0 +1,102 @@
+"""
+This file contains the tests of the lab CSV import: the parser's rows and resume offsets must not
+depend on where the upload is split into chunks, and malformed records must come out as rejected
+rows instead of being buffered or failing the import.
+"""
+import asyncio, csv, io
+import pytest
+from backend.lab_import import UTF8_BOM, IncrementalCSVParser, import_lab_csv
+
+SAMPLE = (b'patient_id,sex,age,analyte,value,unit,collected_at\r\n'
+          b'p1,F,34,glucose,92,mg/dL,2024-03-01T08:00:00\r\n'
+          b'"p2","M",51,"LDL, direct",3.1,mmol/L,\r\n'
+          b'p3,F,40,"note ""quoted""\nover two lines",1,g/L,\r\n'
+          b'p4,M,29,tsh,2.2,mIU/L,')
+
+
+def parse(data: bytes, chunk_size: int, **kwargs):
+    parser = IncrementalCSVParser(**kwargs)
+    rows = []
+    for start in range(0, len(data), chunk_size):
+        rows += parser.feed(data[start:start + chunk_size])
+    return rows + parser.finish()
+
+
+def expected_rows(data: bytes):
+    return list(csv.reader(io.StringIO(data.decode("utf-8-sig"), newline="")))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 4096])
+def test_rows_do_not_depend_on_chunk_boundaries(chunk_size):
+    rows = parse(SAMPLE, chunk_size)
+    assert [row for row, _ in rows] == expected_rows(SAMPLE)
+    # Every offset is just after its record, the last one at the end of the upload
+    assert rows[-1][1] == len(SAMPLE)
+    assert all(SAMPLE[offset - 1:offset] == b"\n" for _, offset in rows[:-1])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5, 4096])
+def test_bom_is_stripped_but_counted(chunk_size):
+    rows = parse(UTF8_BOM + SAMPLE, chunk_size)
+    assert rows[0][0][0] == "patient_id"
+    assert [row for row, _ in rows] == expected_rows(SAMPLE)
+    assert rows[-1][1] == len(UTF8_BOM) + len(SAMPLE)
+
+
+def test_resumed_parser_counts_from_its_offset():
+    head, tail = SAMPLE.split(b"\r\n", 2)[:2], SAMPLE.split(b"\r\n", 2)[2]
+    offset = len(b"\r\n".join(head)) + 2
+    rows = parse(tail, 5, offset=offset)
+    assert [row for row, _ in rows] == expected_rows(tail)
+    assert rows[-1][1] == len(SAMPLE)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 4096])
+def test_stray_quote_inside_a_field_is_data(chunk_size):
+    data = b'a,b\n4,12" tube\n5,6\n7,"8\n'
+    rows = parse(data, chunk_size)
+    assert [row for row, _ in rows] == [["a", "b"], ["4", '12" tube'], ["5", "6"], ["7", "8\n"]]
+    assert [offset for _, offset in rows] == [4, 15, 19, len(data)]
+
+
+def test_unreadable_record_is_returned_as_an_error():
+    rows = parse(b"a,b\n1,2\r3\n4,5\n", 4096)
+    assert rows[0][0] == ["a", "b"]
+    assert isinstance(rows[1][0], csv.Error)
+    assert rows[2] == (["4", "5"], 14)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 16, 4096])
+def test_oversized_records_are_skipped_not_buffered(chunk_size):
+    unterminated = b'1,"' + b"x" * 200 + b"\n" * 50
+    endless_line = b"2," + b"y" * 500 + b"\n"
+    data = b"a,b\n" + endless_line + b"3,4\n" + unterminated
+    parser = IncrementalCSVParser(max_record_bytes=100)
+    rows = []
+    for start in range(0, len(data), chunk_size):
+        rows += parser.feed(data[start:start + chunk_size])
+        assert sum(map(len, parser.pending)) + len(parser.buffer) <= 100 + chunk_size
+    rows += parser.finish()
+    assert [row if isinstance(row, list) else "error" for row, _ in rows] == [["a", "b"], "error", ["3", "4"], "error"]
+    assert [offset for _, offset in rows] == [4, 4 + len(endless_line), 8 + len(endless_line), len(data)]
+
+
+def test_import_rejects_unreadable_rows_and_goes_on(sqlite_database):
+    data = (b'patient_id,sex,age,analyte,value,unit,collected_at\n'
+            b'p1,F,34,glucose,92,mg/dL,\n'
+            b'p2,M,51,"12" tube,1,mg/dL,\n'
+            b'p3,F,40,glucose\r,5,mmol/L,\n'
+            b'p4,M,29,tsh,2.2,mIU/L,\n')
+
+    async def chunks():
+        for start in range(0, len(data), 10):
+            yield data[start:start + 10]
+
+    async def run():
+        async with sqlite_database():
+            return await import_lab_csv("stray-quotes", chunks())
+
+    result = asyncio.run(run())
+    assert result["status"] == "completed"
+    assert (result["rows_committed"], result["rows_rejected"]) == (4, 2)
+    assert result["bytes_committed"] == len(data)
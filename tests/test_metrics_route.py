@@ -0,0 +1,26 @@
+"""
+This file contains the tests of the access check on /metrics.
+"""
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import backend.core.security as security
+from backend.routes.metrics import router
+
+
+def client(monkeypatch):
+    monkeypatch.setattr(security, "VALID_MICROSERVICE_TOKEN", "scrape-token")
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def test_metrics_require_token(monkeypatch):
+    test_client = client(monkeypatch)
+    assert test_client.get("/metrics").status_code == 403
+    assert test_client.get("/metrics", headers={"x-microservice-token": "wrong"}).status_code == 403
+
+
+def test_metrics_with_token(monkeypatch):
+    response = client(monkeypatch).get("/metrics", headers={"x-microservice-token": "scrape-token"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
@@ -0,0 +1,94 @@
+"""
+This file contains the tests of the recommender index across API workers, each simulated by its own
+index, cache and IndexSync on one shared SQLite database, and of updates taking turns with queries.
+"""
+import asyncio, threading
+import numpy as np
+from backend.services.recommender.index import EmbeddingIndex, MicroBatcher, RecommendationCache
+from backend.services.recommender.main import ITEM, USER, IndexSync
+
+DIM = 4
+
+
+def worker():
+    index = EmbeddingIndex(DIM)
+    return IndexSync(index, RecommendationCache())
+
+
+def test_updates_reach_every_worker_and_survive_a_restart(sqlite_database):
+    async def run():
+        async with sqlite_database():
+            worker_a, worker_b = worker(), worker()
+            items = np.eye(DIM, dtype=np.float32)
+            await worker_a.save_vectors(ITEM, np.arange(DIM), items)
+            await worker_a.save_vectors(USER, np.array([7]), items[[2]])
+            await worker_a.save_vectors(ITEM, np.array([0]))
+            assert len(worker_a.index.items) == DIM - 1
+
+            await worker_b.pull()
+            assert len(worker_b.index.items) == DIM - 1 and worker_b.index.items.get(0) is None
+            np.testing.assert_array_equal(worker_b.index.users.get(7), items[2])
+
+            restarted = worker()
+            await restarted.pull()
+            assert sorted(restarted.index.items.rows) == [1, 2, 3]
+            ids, _ = restarted.index.top_k(restarted.index.users.get(7)[None], 1)
+            assert ids.tolist() == [[2]]
+
+    asyncio.run(run())
+
+
+def test_signal_invalidation_reaches_other_workers(sqlite_database):
+    async def run():
+        async with sqlite_database():
+            worker_a, worker_b = worker(), worker()
+            for sync in (worker_a, worker_b):
+                sync.cache.put(7, 10, 0, np.arange(3), np.ones(3))
+            worker_a.invalidate(7)
+            assert worker_a.cache.get(7, 10, 0) is None
+            await worker_a.pull()
+            assert worker_b.cache.get(7, 10, 0) is not None
+            await worker_b.pull()
+            assert worker_b.cache.get(7, 10, 0) is None
+
+    asyncio.run(run())
+
+
+def test_updates_wait_for_running_products_and_queries_for_updates():
+    async def run():
+        index = EmbeddingIndex(DIM)
+        index.upsert_items(np.arange(DIM), np.eye(DIM, dtype=np.float32))
+        batcher = MicroBatcher(index, window_ms=0)
+        top_k, release = index.top_k, threading.Event()
+
+        def blocking_top_k(queries, k):
+            release.wait(5)
+            return top_k(queries, k)
+
+        index.top_k = blocking_top_k
+        first = asyncio.create_task(batcher.query(np.ones(DIM, np.float32), DIM))
+        while not batcher.computing:
+            await asyncio.sleep(0.001)
+
+        updated = asyncio.Event()
+
+        async def update():
+            async with batcher.exclusive():
+                index.upsert_items(np.array([1]), np.full((1, DIM), 5, dtype=np.float32))
+                index.remove_items([2])
+                updated.set()
+
+        writer = asyncio.create_task(update())
+        await asyncio.sleep(0.01)
+        # The product is still running on the old rows, the update waits for it
+        assert not updated.is_set()
+        second = asyncio.create_task(batcher.query(np.ones(DIM, np.float32), DIM))
+        release.set()
+        ids, scores = await first
+        assert sorted(ids.tolist()) == [0, 1, 2, 3] and scores.max() == 1
+        await writer
+        # A query that arrived while the update waited is answered after it
+        ids, scores = await second
+        assert ids.tolist()[0] == 1 and 2 not in ids.tolist()
+
+    asyncio.run(run())
@@ -0,0 +1,35 @@
+"""
+This file contains the tests of report streaming: a report that fails halfway must abort the
+response, not end it like a complete one.
+"""
+import asyncio
+import pytest
+from backend.routes.reports import encoded_chunks
+
+
+def test_error_mid_stream_aborts_the_response():
+    closed = []
+
+    async def periods():
+        try:
+            yield {}
+        finally:
+            closed.append(True)
+
+    async def pieces(source):
+        yield "header\n"
+        async for _ in source:
+            yield "row\n"
+        raise ConnectionError("database went away")
+
+    async def run():
+        source = periods()
+        chunks = []
+        with pytest.raises(ConnectionError):
+            async for chunk in encoded_chunks(pieces(source), source):
+                chunks.append(chunk)
+        return chunks
+
+    # The header went out on its own, the buffered row never does
+    assert asyncio.run(run()) == [b"header\n"]
+    assert closed == [True]
@@ -0,0 +1,60 @@
+"""
+This file contains the tests of the path blocklist of the security middleware, and of its access
+line replacing uvicorn's.
+"""
+import asyncio, io, json, logging
+import pytest
+from backend.core.logging_pipeline import setup_logging
+from backend.core.security import SecurityMiddleware, load_path_blocklist
+from backend.limiter import SuspensionStore
+
+
+@pytest.fixture
+def middleware():
+    blocked, allowed = load_path_blocklist()
+    return SecurityMiddleware(None, SuspensionStore(), blocked_paths=blocked, allowed_paths=allowed)
+
+
+@pytest.mark.parametrize("path", [
+    "/.env",
+    "/.git/config",
+    "/configs/DB_connection.json",
+    # The assets/environment exemption only applies to .env
+    "/assets/environment/.git/config",
+    "/assets/environment/x/configs/DB_connection.json",
+    "/assets/environment/.env/../.git/HEAD",
+])
+def test_blocked_paths(middleware, path):
+    assert middleware.is_blocked_path(path)
+
+
+@pytest.mark.parametrize("path", [
+    "/users/login",
+    "/assets/environment/.env",
+    "/assets/environment/app.env.js",
+])
+def test_allowed_paths(middleware, path):
+    assert not middleware.is_blocked_path(path)
+
+
+def test_access_lines_come_from_the_middleware_only():
+    async def ok_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 201, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def request(path):
+        async def send(message):
+            pass
+        middleware = SecurityMiddleware(ok_app, SuspensionStore(), blocked_paths=[], allowed_paths={})
+        await middleware({"type": "http", "path": path, "method": "POST", "client": ("10.0.0.1", 1)}, None, send)
+
+    stream = io.StringIO()
+    listener = setup_logging(logger_names=(), stream=stream)
+    try:
+        asyncio.run(request("/users/login"))
+        # What uvicorn would log for the same request is dropped
+        logging.getLogger("uvicorn.access").info('%s - "%s %s HTTP/%s" %d', "10.0.0.1:1", "POST", "/users/login", "1.1", 201)
+    finally:
+        listener.stop()
+    [line] = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert line["logger"] == "root" and line["path"] == "/users/login" and line["status"] == 201
@@ -0,0 +1,70 @@
+"""
+This file contains the tests of the sleep staging engine: a night's stages must not depend on the
+other nights of a batch, and the incremental hypnogram must end where batch scoring does.
+"""
+import numpy as np
+from backend.services.sleep.staging import EPOCH_MS, IncrementalHypnogram, stage_nights
+
+HOUR_MS = 3600 * 1000
+
+
+def synthetic_night(rng, hours: float, start_ms: int = 0):
+    """
+    Restless first half hour, heart rate cycling every 90 minutes, and a few missing stretches.
+    """
+    accel_ts = start_ms + np.arange(0, int(hours * HOUR_MS), 1000, dtype=np.int64)
+    minutes = (accel_ts - start_ms) / 60000
+    restless = (minutes < 30) | (rng.random(len(accel_ts)) < 0.003)
+    accel_xyz = np.where(restless, 0.3, 0.004)[:, None] * rng.standard_normal((len(accel_ts), 3))
+    accel_xyz[:, 2] += 1.0
+    gaps = (minutes % 97 > 90)
+    hr_ts = accel_ts[~gaps]
+    hr_bpm = 58 + 6 * np.sin(2 * np.pi * minutes[~gaps] / 90) + rng.normal(0, 2, len(hr_ts))
+    return accel_ts[~gaps], accel_xyz[~gaps], hr_ts, hr_bpm
+
+
+def stage(nights):
+    """
+    stage_nights on a list of (start_ms, end_ms, accel_ts, accel_xyz, hr_ts, hr_bpm).
+    """
+    return stage_nights(
+        [night[0] for night in nights], [night[1] for night in nights],
+        np.repeat(np.arange(len(nights)), [len(night[2]) for night in nights]),
+        np.concatenate([night[2] for night in nights]), np.concatenate([night[3] for night in nights]),
+        np.repeat(np.arange(len(nights)), [len(night[4]) for night in nights]),
+        np.concatenate([night[4] for night in nights]), np.concatenate([night[5] for night in nights]),
+    )
+
+
+def test_night_scores_the_same_alone_and_in_a_batch():
+    rng = np.random.default_rng(3)
+    night = (0, 6 * HOUR_MS, *synthetic_night(rng, 6))
+    # A longer night pads the 6 hour one; samples after its end_ms must not leak in either
+    long_night = (0, 14 * HOUR_MS, *synthetic_night(rng, 14))
+    trailing = (0, 6 * HOUR_MS, *(np.concatenate(parts) for parts in zip(
+        night[2:], synthetic_night(rng, 1, start_ms=6 * HOUR_MS))))
+
+    alone_stages, alone_epochs, alone_summary = stage([night])
+    for batch in ([night, long_night], [long_night, trailing]):
+        stages, epochs, summary = stage(batch)
+        index = 0 if batch[0] is night else 1
+        assert epochs[index] == alone_epochs[0] == 720
+        np.testing.assert_array_equal(stages[index, :720], alone_stages[0])
+        np.testing.assert_array_equal(summary["minutes"][index], alone_summary["minutes"][0])
+        assert summary["efficiency"][index] == alone_summary["efficiency"][0]
+    # Padding is not counted as time in bed or as wake
+    assert alone_summary["minutes"][0].sum() == 6 * 60
+
+
+def test_incremental_hypnogram_matches_batch_scoring():
+    rng = np.random.default_rng(5)
+    accel_ts, accel_xyz, hr_ts, hr_bpm = synthetic_night(rng, 7)
+    hypnogram = IncrementalHypnogram(0)
+    for start in range(0, 7 * HOUR_MS, 5 * 60 * 1000):
+        accel = (accel_ts >= start) & (accel_ts < start + 5 * 60 * 1000)
+        hr = (hr_ts >= start) & (hr_ts < start + 5 * 60 * 1000)
+        hypnogram.add_samples(accel_ts[accel], accel_xyz[accel], hr_ts[hr], hr_bpm[hr])
+
+    end_ms = hypnogram.n_epochs * EPOCH_MS
+    stages, _, _ = stage([(0, end_ms, accel_ts, accel_xyz, hr_ts, hr_bpm)])
+    np.testing.assert_array_equal(hypnogram.hypnogram(), stages[0])
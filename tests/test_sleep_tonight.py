@@ -0,0 +1,84 @@
+"""
+This file contains the tests of tonight's hypnogram kept in the sleep_epochs table: uploads served
+by different workers, in any order, must add up to the same night as one worker scoring them all.
+Also the byte cap of the batch scoring endpoint.
+"""
+import asyncio
+import numpy as np
+from sqlalchemy import func, select
+from backend.database.models import sleep_epochs
+from backend.services.sleep.main import TONIGHT_IDLE_SECONDS, add_tonight_sums, load_tonight
+from backend.services.sleep.staging import IncrementalHypnogram
+from tests.test_sleep_staging import HOUR_MS, synthetic_night
+
+USER_ID = 7
+UPLOAD_MS = 5 * 60 * 1000
+
+
+def uploads(start_ms: int, hours: float, seed: int):
+    """
+    The epoch sums of every 5 minute upload of a synthetic night.
+    """
+    accel_ts, accel_xyz, hr_ts, hr_bpm = synthetic_night(np.random.default_rng(seed), hours, start_ms)
+    for start in range(start_ms, start_ms + int(hours * HOUR_MS), UPLOAD_MS):
+        accel = (accel_ts >= start) & (accel_ts < start + UPLOAD_MS)
+        hr = (hr_ts >= start) & (hr_ts < start + UPLOAD_MS)
+        upload = IncrementalHypnogram(start_ms)
+        upload.accumulate(accel_ts[accel], accel_xyz[accel], hr_ts[hr], hr_bpm[hr])
+        yield upload, (accel_ts[accel], accel_xyz[accel], hr_ts[hr], hr_bpm[hr])
+
+
+def test_uploads_in_any_order_add_up_to_the_whole_night(sqlite_database):
+    night = list(uploads(0, 7, seed=5))
+    reference = IncrementalHypnogram(0)
+    for _, samples in night:
+        reference.add_samples(*samples)
+
+    async def run():
+        async with sqlite_database():
+            now_ms = 7 * HOUR_MS
+            # Two workers got every other upload; the late ones arrive first
+            order = night[1::2][::-1] + night[::2]
+            epochs = [await add_tonight_sums(USER_ID, upload, now_ms) for upload, _ in order]
+            assert epochs[-1] == reference.n_epochs
+            return await load_tonight(USER_ID, now_ms)
+
+    hypnogram = asyncio.run(run())
+    assert hypnogram.start_ms == 0 and hypnogram.n_epochs == reference.n_epochs
+    np.testing.assert_array_equal(hypnogram.hypnogram(), reference.hypnogram())
+
+
+def test_new_night_replaces_the_last_one_and_idle_nights_end(sqlite_database):
+    first, second = 0, 24 * HOUR_MS
+
+    async def run():
+        async with sqlite_database() as db_conn:
+            for upload, _ in list(uploads(first, 1, seed=1)):
+                await add_tonight_sums(USER_ID, upload, first + HOUR_MS)
+            upload, _ = next(uploads(second, 1, seed=2))
+            await add_tonight_sums(USER_ID, upload, second + UPLOAD_MS)
+            async with db_conn.engine.connect() as connection:
+                nights = (await connection.execute(select(func.distinct(sleep_epochs.c.start_ms)))).scalars().all()
+            assert nights == [second]
+
+            hypnogram = await load_tonight(USER_ID, second + UPLOAD_MS)
+            assert hypnogram.start_ms == second and hypnogram.n_epochs == 10
+            assert await load_tonight(USER_ID, second + UPLOAD_MS + TONIGHT_IDLE_SECONDS * 1000 + 1) is None
+            assert await load_tonight(USER_ID + 1, second) is None
+
+    asyncio.run(run())
+
+
+def test_oversized_score_body_is_rejected(monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from backend.core.security import current_user_id
+    from backend.services.sleep import main
+
+    monkeypatch.setattr(main, "MAX_SCORE_BODY_BYTES", 1024)
+    app = FastAPI()
+    app.include_router(main.router)
+    app.dependency_overrides[current_user_id] = lambda: USER_ID
+    client = TestClient(app)
+    assert client.post("/score", content=b" " * 2048).status_code == 413
+    assert client.post("/score", content=iter([b" " * 512] * 4)).status_code == 413
@@ -0,0 +1,67 @@
+"""
+This file contains the tests of the HRV state store with several API workers, each simulated by
+its own HRVStateStore on one shared SQLite database.
+"""
+import asyncio
+import pytest
+import numpy as np
+from backend.services.stress.hrv import HRVState
+from backend.services.stress.main import HRVStateStore, settings
+
+USER_ID = 7
+
+
+def beats(start_ms: float, count: int):
+    rr_ms = 800 + 40 * np.sin(np.arange(count) / 5)
+    return start_ms + np.cumsum(rr_ms), rr_ms
+
+
+async def add(store: HRVStateStore, ts_ms, rr_ms):
+    state = await store.get(USER_ID)
+    if state.add_beats(ts_ms, rr_ms):
+        store.mark_dirty(USER_ID, ts_ms, rr_ms)
+
+
+def test_workers_merge_instead_of_overwriting(sqlite_database):
+    async def run():
+        async with sqlite_database():
+            worker_a, worker_b = HRVStateStore(settings), HRVStateStore(settings)
+            # Both workers start from no saved state, A gets the older beats, B the newer ones
+            await add(worker_a, *beats(0, 100))
+            await add(worker_b, *beats(100_000, 50))
+            await worker_a.flush()
+            await worker_b.flush()
+            assert (worker_a.conflicts, worker_b.conflicts) == (0, 1)
+            assert worker_b.versions[USER_ID] == 2
+
+            restarted = HRVStateStore(settings)
+            assert (await restarted.get(USER_ID)).count == 150
+            # A's cached state is stale now, its next save is rebased on B's
+            await add(worker_a, *beats(200_000, 10))
+            await worker_a.flush()
+            assert worker_a.conflicts == 1
+            assert (await HRVStateStore(settings).get(USER_ID)).count == 160
+            assert not worker_a.dirty and not worker_a.pending
+
+    asyncio.run(run())
+
+
+def test_older_beats_survive_when_the_newer_worker_saves_first(sqlite_database):
+    async def run():
+        async with sqlite_database():
+            worker_a, worker_b = HRVStateStore(settings), HRVStateStore(settings)
+            older, newer = beats(0, 100), beats(100_000, 50)
+            await add(worker_a, *older)
+            await add(worker_b, *newer)
+            await worker_b.flush()
+            await worker_a.flush()
+            assert (worker_a.conflicts, worker_b.conflicts) == (1, 0)
+
+            merged = await HRVStateStore(settings).get(USER_ID)
+            assert merged.count == 150
+            reference = HRVState(settings)
+            reference.add_beats(np.concatenate((older[0], newer[0])), np.concatenate((older[1], newer[1])))
+            for key in ("mean_hr", "rmssd", "sdnn", "pnn50"):
+                assert merged.time_domain()[key] == pytest.approx(reference.time_domain()[key], rel=1e-6)
+
+    asyncio.run(run())
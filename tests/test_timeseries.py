@@ -0,0 +1,43 @@
+"""
+This file contains the tests of the time-series store: chunks of one minute written by several
+flushes end up in one row, and the rollups agree with the raw samples.
+"""
+import asyncio
+import numpy as np
+from sqlalchemy import select
+from backend.database import timeseries
+from backend.database.models import device_metric_chunks
+
+USER_ID, METRIC = 7, 1
+MINUTE = 1_700_000_040_000
+
+
+def test_flushes_into_the_same_minute_share_one_chunk(sqlite_database):
+    async def run():
+        async with sqlite_database() as db_conn:
+            store = timeseries.TimeSeriesStore(db_conn.engine)
+            # Three flushes, the later ones landing in minutes that already have chunks
+            for offsets in (np.arange(0, 30_000, 1000), np.arange(30_000, 60_000, 1000), np.arange(60_000, 90_000, 1000)):
+                ts_ms = MINUTE + offsets[::-1]
+                async with db_conn.engine.begin() as connection:
+                    await store.write(connection, np.full(len(ts_ms), USER_ID), np.full(len(ts_ms), METRIC),
+                                      ts_ms, offsets[::-1].astype(np.float32))
+            async with db_conn.engine.connect() as connection:
+                rows = (await connection.execute(
+                    select(device_metric_chunks.c.minute_start, device_metric_chunks.c.sample_count)
+                    .order_by(device_metric_chunks.c.minute_start)
+                )).all()
+            assert [tuple(row) for row in rows] == [(MINUTE, 60), (MINUTE + 60_000, 30)]
+
+            ts_ms, values = await store.read_raw(USER_ID, METRIC, MINUTE, MINUTE + 120_000)
+            np.testing.assert_array_equal(ts_ms, MINUTE + np.arange(0, 90_000, 1000))
+            np.testing.assert_array_equal(values, np.arange(0, 90_000, 1000))
+
+            series = await store.read_series(USER_ID, METRIC, MINUTE, MINUTE + 120_000, step_seconds=60)
+            assert series["count"].tolist() == [60, 30]
+            async with db_conn.engine.begin() as connection:
+                assert await store.rebuild_rollups(connection, USER_ID, METRIC, MINUTE, MINUTE + 120_000) == 90
+            rebuilt = await store.read_series(USER_ID, METRIC, MINUTE, MINUTE + 120_000, step_seconds=60)
+            np.testing.assert_allclose(rebuilt["mean"], series["mean"])
+
+    asyncio.run(run())